@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# 语义缓存配置，均可通过环境变量覆盖
+# 余弦距离阈值：新问题与缓存问题的距离不超过该值时视为同一问题
+CACHE_MAX_DISTANCE = float(os.environ.get("ANSWER_CACHE_MAX_DISTANCE", "0.08"))
+# 缓存条目存活时间（秒）
+CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", "3600"))
+# 缓存条目数量上限
+CACHE_MAX_SIZE = int(os.environ.get("ANSWER_CACHE_MAX_SIZE", "1000"))
+# 淘汰策略：lru（最近最少使用）或 lfu（最不经常使用）
+CACHE_POLICY = os.environ.get("ANSWER_CACHE_POLICY", "lru")
+
+
+def _normalize(embedding):
+    vec = np.asarray(embedding, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm > 0 else vec
+
+
+def _doc_key(doc_ids):
+    # 检索到的文档集合与顺序无关
+    return tuple(sorted(doc_ids))
+
+
+class SemanticCache:
+    """
+    语义回答缓存：保存 (问题向量, 检索文档id集合, 回答)，
+    对语义相近且检索到相同文档的新问题直接返回缓存的回答
+    """
+
+    def __init__(self, max_distance=CACHE_MAX_DISTANCE, ttl=CACHE_TTL,
+                 max_size=CACHE_MAX_SIZE, policy=CACHE_POLICY):
+        if policy not in ("lru", "lfu"):
+            raise ValueError(f"不支持的缓存淘汰策略: {policy}")
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.max_size = max_size
+        self.policy = policy
+
+        # 条目按最近访问顺序排列，便于 LRU 淘汰
+        self._entries = OrderedDict()
+        # 文档集合 -> 条目 key 集合，查找时只比较同一文档集合下的问题
+        self._by_docs = {}
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, embedding, doc_ids):
+        """
+        查找语义相近的缓存回答
+
+        Args:
+            embedding: 问题向量
+            doc_ids: 本次检索到的文档id列表
+
+        Returns:
+            命中时返回缓存的回答，否则返回None
+        """
+        query = _normalize(embedding)
+        doc_key = _doc_key(doc_ids)
+        now = time.time()
+
+        with self._lock:
+            key, _ = self._find_nearest(query, doc_key, now)
+            if key is None:
+                self.misses += 1
+                return None
+
+            entry = self._entries[key]
+            entry["hits"] += 1
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["answer"]
+
+    def put(self, embedding, doc_ids, answer):
+        """写入一条生成结果；已有语义相同的条目时直接覆盖"""
+        query = _normalize(embedding)
+        doc_key = _doc_key(doc_ids)
+        now = time.time()
+
+        with self._lock:
+            key, _ = self._find_nearest(query, doc_key, now)
+            if key is not None:
+                entry = self._entries[key]
+                entry["answer"] = answer
+                entry["created_at"] = now
+                self._entries.move_to_end(key)
+                return
+
+            if self.max_size <= 0:
+                return
+            # 先淘汰再写入：LFU 下新条目命中次数为 0，写入后再淘汰会把它自己立即淘汰
+            while len(self._entries) >= self.max_size:
+                self._evict_one()
+
+            key = self._next_key
+            self._next_key += 1
+            self._entries[key] = {
+                "embedding": query,
+                "doc_key": doc_key,
+                "answer": answer,
+                "created_at": now,
+                "hits": 0,
+            }
+            self._by_docs.setdefault(doc_key, set()).add(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_docs.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "policy": self.policy,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
+
+    def _find_nearest(self, query, doc_key, now):
+        """在同一文档集合下查找距离最近且未过期的条目，调用方需持有锁"""
+        keys = list(self._by_docs.get(doc_key, ()))
+        for key in keys:
+            if now - self._entries[key]["created_at"] > self.ttl:
+                self._remove(key)
+        keys = [key for key in keys if key in self._entries]
+        if not keys:
+            return None, None
+
+        matrix = np.stack([self._entries[key]["embedding"] for key in keys])
+        distances = 1.0 - matrix @ query
+        best = int(np.argmin(distances))
+        if distances[best] > self.max_distance:
+            return None, None
+        return keys[best], float(distances[best])
+
+    def _evict_one(self):
+        if self.policy == "lru":
+            key = next(iter(self._entries))
+        else:
+            # LFU：命中次数最少的条目，次数相同时淘汰最久未访问的
+            key = min(enumerate(self._entries.items()),
+                      key=lambda x: (x[1][1]["hits"], x[0]))[1][0]
+        self._remove(key)
+        self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        bucket = self._by_docs.get(entry["doc_key"])
+        if bucket is not None:
+            bucket.discard(key)
+            if not bucket:
+                del self._by_docs[entry["doc_key"]]
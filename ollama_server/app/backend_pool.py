@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import os
+import time
+
+import httpx
+
+from app.metrics import Counter, Histogram
+
+# 主动健康检查的间隔（秒）
+POOL_HEALTH_INTERVAL = float(os.environ.get("POOL_HEALTH_INTERVAL", "5"))
+# 单次健康检查的超时（秒）
+POOL_HEALTH_TIMEOUT = float(os.environ.get("POOL_HEALTH_TIMEOUT", "2"))
+# 连续失败多少次后熔断该后端
+POOL_FAILURE_THRESHOLD = int(os.environ.get("POOL_FAILURE_THRESHOLD", "3"))
+# 熔断持续时间（秒），之后放行一个试探请求，成功则恢复
+POOL_OPEN_SECONDS = float(os.environ.get("POOL_OPEN_SECONDS", "15"))
+# 模型未加载的后端需要先把模型读入内存，选择时按多这么多个进行中的请求计算
+POOL_COLD_PENALTY = float(os.environ.get("POOL_COLD_PENALTY", "2"))
+# 首字节延迟的指数滑动平均系数，进行中的请求数相同时选延迟低的后端
+POOL_LATENCY_ALPHA = 0.2
+
+# 熔断状态：closed 正常，open 熔断中，half_open 等待试探请求的结果
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+logger = logging.getLogger("ollama_server")
+
+# 各后端的生成请求数，outcome 为 ok、error（5xx 或连接失败）、not_found（模型不存在）、bad_request（其他 4xx）
+BACKEND_REQUESTS = Counter(
+    "ollama_server_backend_requests_total", "各 Ollama 后端的生成请求数", labelnames=("backend", "outcome"),
+)
+# 发出请求到收到第一个响应片段的时间，包括 Ollama 内部排队、加载模型和 prompt 评估
+BACKEND_FIRST_BYTE_SECONDS = Histogram(
+    "ollama_server_backend_first_byte_seconds", "各 Ollama 后端的首个响应片段延迟（秒）", labelnames=("backend",),
+)
+
+
+class OllamaUnavailable(Exception):
+    """无法连接 Ollama HTTP API"""
+
+
+class ModelNotFound(Exception):
+    """Ollama 中没有该模型（尚未 pull）"""
+
+    def __init__(self, model):
+        super().__init__(f"模型不存在: {model}")
+        self.model = model
+
+
+def normalize_host(host):
+    host = host.strip().rstrip("/")
+    if not host.startswith(("http://", "https://")):
+        host = "http://" + host
+    return host
+
+
+def model_key(model):
+    # Ollama 中不带标签的模型名即 :latest
+    return model if ":" in model else model + ":latest"
+
+
+class Backend:
+    """一个 Ollama 实例的连接、熔断状态和模型信息"""
+
+    def __init__(self, url, transport=None):
+        self.url = url
+        # 超时由调用方的 wait_for 控制
+        self.client = httpx.AsyncClient(base_url=url, timeout=None, transport=transport)
+        self.outstanding = 0
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial = False
+        # 最近一次健康检查是否成功；启动后检查之前视为健康
+        self.healthy = True
+        self.last_error = None
+        # 已 pull 的模型（/api/tags），None 表示尚未检查
+        self.installed = None
+        # 生成时返回 404 的模型，下次健康检查前不再发给这个后端
+        self.missing = set()
+        # 已加载进内存的模型（/api/ps 和最近成功的生成）
+        self.loaded = set()
+        self.version = None
+        self.latency = None
+
+    def current_state(self, now):
+        if self.state == OPEN and now - self.opened_at >= POOL_OPEN_SECONDS:
+            self.state = HALF_OPEN
+        return self.state
+
+    def available(self, now):
+        if not self.healthy:
+            return False
+        state = self.current_state(now)
+        # 半开状态只放行一个试探请求
+        return state == CLOSED or (state == HALF_OPEN and not self.trial)
+
+    def has_model(self, model):
+        """True / False，尚未检查时为 None"""
+        key = model_key(model)
+        if key in self.missing:
+            return False
+        if self.installed is None:
+            return None
+        return key in self.installed
+
+    def stats(self, now):
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "state": self.current_state(now),
+            "outstanding": self.outstanding,
+            "consecutive_failures": self.failures,
+            "installed": sorted(self.installed) if self.installed is not None else None,
+            "loaded": sorted(self.loaded),
+            "version": self.version,
+            "latency_seconds": round(self.latency, 3) if self.latency is not None else None,
+            "last_error": self.last_error,
+        }
+
+
+class BackendPool:
+    """
+    多个 Ollama 实例组成的后端池：
+    - 选择时只考虑健康且未熔断的后端，排除确认没有该模型的后端；
+      在剩下的后端中优先已加载该模型的，再按进行中的请求数（未加载的加 POOL_COLD_PENALTY）、首字节延迟选择
+    - 连续失败 POOL_FAILURE_THRESHOLD 次后熔断 POOL_OPEN_SECONDS 秒，之后放行一个试探请求，成功即恢复
+    - 后台任务定期访问 /api/tags 和 /api/ps，更新健康状态以及已 pull、已加载的模型
+    只在事件循环线程中使用，无需加锁
+    """
+
+    def __init__(self, hosts, transport=None):
+        self.backends = [Backend(normalize_host(host), transport) for host in hosts]
+        self.rejected = 0
+
+    def acquire(self, model, exclude=()):
+        """
+        选择一个后端并计入进行中的请求，用完后必须调用 release
+
+        Raises:
+            OllamaUnavailable: 没有健康且未熔断的后端
+            ModelNotFound: 可用的后端都没有该模型
+        """
+        now = time.monotonic()
+        candidates = [b for b in self.backends if b.url not in exclude and b.available(now)]
+        if not candidates:
+            self.rejected += 1
+            raise OllamaUnavailable("没有可用的 Ollama 后端")
+        candidates = [b for b in candidates if b.has_model(model) is not False]
+        if not candidates:
+            raise ModelNotFound(model)
+        key = model_key(model)
+
+        def cost(backend):
+            cold = 0.0 if key in backend.loaded else POOL_COLD_PENALTY
+            return backend.outstanding + cold, backend.latency or 0.0
+
+        backend = min(candidates, key=cost)
+        backend.outstanding += 1
+        if backend.state == HALF_OPEN:
+            backend.trial = True
+        return backend
+
+    def release(self, backend, model, outcome, first_byte=None):
+        """
+        Args:
+            outcome: ok（生成完成）、error（5xx 或连接失败）、not_found（该后端没有模型）、
+                bad_request（其他 4xx）或 cancelled（调用方提前结束）；后两者不影响熔断状态
+            first_byte: 首个响应片段的延迟（秒）
+        """
+        backend.outstanding -= 1
+        trial, backend.trial = backend.trial, False
+        if outcome != "cancelled":
+            BACKEND_REQUESTS.inc(backend=backend.url, outcome=outcome)
+        if first_byte is not None:
+            BACKEND_FIRST_BYTE_SECONDS.observe(first_byte, backend=backend.url)
+            backend.latency = first_byte if backend.latency is None else (
+                POOL_LATENCY_ALPHA * first_byte + (1 - POOL_LATENCY_ALPHA) * backend.latency
+            )
+        if outcome == "ok":
+            backend.failures = 0
+            backend.state = CLOSED
+            backend.loaded.add(model_key(model))
+        elif outcome == "not_found":
+            backend.missing.add(model_key(model))
+            backend.loaded.discard(model_key(model))
+        elif outcome == "error":
+            backend.failures += 1
+            if trial or backend.failures >= POOL_FAILURE_THRESHOLD:
+                self._open(backend)
+
+    def _open(self, backend):
+        if backend.state != OPEN:
+            logger.warning("Ollama 后端 %s 连续失败 %d 次，熔断 %.0f 秒", backend.url, backend.failures,
+                           POOL_OPEN_SECONDS)
+        backend.state = OPEN
+        backend.opened_at = time.monotonic()
+
+    async def check(self, backend, timeout=POOL_HEALTH_TIMEOUT):
+        """访问 /api/tags 和 /api/ps；/api/ps 需要较新版本的 Ollama，不存在时只根据成功的生成推断已加载的模型"""
+        try:
+            resp = await backend.client.get("/api/tags", timeout=timeout)
+            resp.raise_for_status()
+            installed = {model_key(m["name"]) for m in resp.json().get("models", [])}
+            resp = await backend.client.get("/api/ps", timeout=timeout)
+            loaded = {model_key(m["name"]) for m in resp.json().get("models", [])} if resp.status_code == 200 else None
+            if backend.version is None:
+                resp = await backend.client.get("/api/version", timeout=timeout)
+                if resp.status_code == 200:
+                    backend.version = resp.json().get("version")
+        except (httpx.HTTPError, ValueError, KeyError) as e:
+            if backend.healthy:
+                logger.warning("Ollama 后端 %s 健康检查失败：%s", backend.url, e)
+            backend.healthy = False
+            backend.last_error = str(e) or type(e).__name__
+            return False
+        if not backend.healthy:
+            logger.info("Ollama 后端 %s 恢复", backend.url)
+        backend.healthy = True
+        backend.installed = installed
+        backend.missing = set()
+        if loaded is not None:
+            backend.loaded = loaded
+        return True
+
+    async def check_all(self):
+        return await asyncio.gather(*(self.check(backend) for backend in self.backends))
+
+    async def run_health_checks(self, interval=POOL_HEALTH_INTERVAL):
+        """后台任务：定期检查全部后端，随服务退出取消"""
+        while True:
+            await self.check_all()
+            await asyncio.sleep(interval)
+
+    async def close(self):
+        for backend in self.backends:
+            await backend.client.aclose()
+
+    def stats(self):
+        now = time.monotonic()
+        backends = [backend.stats(now) for backend in self.backends]
+        return {
+            "backends": backends,
+            "available": sum(1 for backend in self.backends if backend.available(now)),
+            "outstanding": sum(backend.outstanding for backend in self.backends),
+            # 因没有可用后端而未能发出的请求数
+            "rejected": self.rejected,
+        }
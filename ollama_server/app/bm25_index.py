@@ -0,0 +1,120 @@
+import heapq
+import json
+import math
+import os
+from collections import Counter
+
+import jieba
+
+# BM25 索引保存在 chroma_db 旁边，与 Chroma 集合一一对应
+BM25_DIR = "./bm25_index"
+
+# 嵌入模型对这些银行业务术语区分度较弱，加入分词词典保证它们作为整词参与词法检索
+DOMAIN_TERMS = [
+    "LPR", "大额存单", "征信", "征信报告", "信用记录", "定期存款", "活期存款", "结构性存款",
+    "智能存款", "提前支取", "房贷", "车贷", "消费贷", "信用贷", "经营贷", "信用卡", "储蓄卡",
+    "借记卡", "手机银行", "网上银行", "转账限额", "挂失", "免息期", "年化收益", "风险等级",
+]
+for _term in DOMAIN_TERMS:
+    jieba.add_word(_term)
+
+
+def bm25_path(collection_name):
+    return os.path.join(BM25_DIR, f"{collection_name}.json")
+
+
+def tokenize(text):
+    """jieba 搜索引擎模式分词，去掉空白和纯标点"""
+    return [
+        tok for tok in jieba.lcut_for_search(text.lower())
+        if tok.strip() and any(ch.isalnum() for ch in tok)
+    ]
+
+
+class BM25Index:
+    """基于 jieba 分词的 BM25 倒排索引，只保存片段 id 与词频统计，文本仍以 Chroma 为准"""
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids = []
+        self.doc_len = []
+        self.avgdl = 0.0
+        # 词 -> [[片段下标, 词频], ...]
+        self.postings = {}
+
+    def build(self, ids, documents):
+        self.ids = list(ids)
+        self.doc_len = []
+        self.postings = {}
+        for idx, doc in enumerate(documents):
+            tokens = tokenize(doc)
+            self.doc_len.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                self.postings.setdefault(term, []).append([idx, tf])
+        self.avgdl = sum(self.doc_len) / len(self.doc_len) if self.doc_len else 0.0
+        return self
+
+    def search(self, query, k=10):
+        """
+        词法检索
+
+        Returns:
+            [(片段id, BM25分数), ...]，按分数降序
+        """
+        n_docs = len(self.ids)
+        if not n_docs:
+            return []
+
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log((n_docs - len(postings) + 0.5) / (len(postings) + 0.5) + 1.0)
+            for idx, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[idx] / self.avgdl)
+                scores[idx] = scores.get(idx, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        top = heapq.nlargest(k, scores.items(), key=lambda x: x[1])
+        return [(self.ids[idx], score) for idx, score in top]
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "k1": self.k1,
+                "b": self.b,
+                "ids": self.ids,
+                "doc_len": self.doc_len,
+                "postings": self.postings,
+            }, f, ensure_ascii=False)
+        # 原子替换，服务端不会读到写了一半的文件
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls(k1=data["k1"], b=data["b"])
+        index.ids = data["ids"]
+        index.doc_len = data["doc_len"]
+        index.postings = data["postings"]
+        index.avgdl = sum(index.doc_len) / len(index.doc_len) if index.doc_len else 0.0
+        return index
+
+
+def rebuild_bm25(collection, page_size=5000):
+    """从 Chroma 集合分页读取全部片段，重建并保存该集合的 BM25 索引，返回片段数"""
+    ids, documents = [], []
+    offset = 0
+    while True:
+        page = collection.get(include=["documents"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        ids.extend(page["ids"])
+        documents.extend(page["documents"])
+        offset += len(page["ids"])
+    BM25Index().build(ids, documents).save(bm25_path(collection.name))
+    return len(ids)
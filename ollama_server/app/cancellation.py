@@ -0,0 +1,60 @@
+import asyncio
+import time
+
+# 检测客户端是否断开的轮询间隔（秒）
+DISCONNECT_POLL_INTERVAL = 0.2
+
+
+class ClientDisconnected(Exception):
+    """客户端在请求处理完成前断开连接"""
+
+
+class DeadlineExceeded(Exception):
+    """请求在截止时间前未完成"""
+
+
+def time_left(deadline):
+    """距截止时间（time.monotonic() 时间戳）还剩多少秒，已过期返回 0"""
+    return max(0.0, deadline - time.monotonic())
+
+
+async def with_deadline(aw, deadline):
+    """在截止时间内等待 aw，超时则取消它并抛出 DeadlineExceeded"""
+    try:
+        return await asyncio.wait_for(aw, time_left(deadline))
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded() from None
+
+
+async def cancel_on_disconnect(request, coro, poll_interval=DISCONNECT_POLL_INTERVAL):
+    """
+    执行请求处理协程，同时轮询客户端连接；客户端断开时取消处理，
+    取消会沿检索、排队、生成一路传递，生成中的 ollama 子进程随之结束、名额立即释放
+
+    Args:
+        request: starlette Request，只用到 is_disconnected()
+        coro: 请求处理协程
+    """
+    task = asyncio.ensure_future(coro)
+    disconnected = False
+
+    async def watch():
+        nonlocal disconnected
+        while not task.done():
+            if await request.is_disconnected():
+                disconnected = True
+                task.cancel()
+                return
+            await asyncio.sleep(poll_interval)
+
+    watcher = asyncio.ensure_future(watch())
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if disconnected:
+            raise ClientDisconnected() from None
+        # 外层被取消（如服务关闭）时连同处理任务一起取消
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
@@ -0,0 +1,169 @@
+import hashlib
+import os
+import re
+from collections import namedtuple
+
+from app.context_builder import estimate_tokens
+
+# 每个片段的目标 token 数（含与上一片段重叠的部分），整句打包，不超过该值
+CHUNK_TARGET_TOKENS = int(os.environ.get("CHUNK_TARGET_TOKENS", "200"))
+# 相邻片段重叠的 token 数上限：上一片段末尾的若干整句会重复出现在下一片段开头，避免答案被切断在两个片段之间
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", "40"))
+# 文档末尾不足目标大小该比例的片段并入上一片段，避免产生碎片
+CHUNK_MIN_TAIL_RATIO = 0.25
+# 短于该长度的片段不入库（只有整篇文档都很短时才会出现）
+MIN_PARA_LEN = 10
+# 切分方式与参数的标识，计入文件哈希：参数变化后未修改的文件也会重新切分
+CHUNKER_SIGNATURE = f"sentences-v1:{CHUNK_TARGET_TOKENS}:{CHUNK_OVERLAP_TOKENS}"
+
+# 句末标点，以及紧跟其后、仍属于本句的引号和括号
+_SENTENCE_END = "。！？；!?;…"
+_CLOSERS = "”’」』）)\"'"
+# 一行中的句子：一段非句末标点的文本加上句末标点，或单独的标点；逐个匹配可覆盖整行
+_SENTENCE_RE = re.compile(
+    rf"[^{_SENTENCE_END}]+(?:[{_SENTENCE_END}]+[{_CLOSERS}]*)?|[{_SENTENCE_END}]+[{_CLOSERS}]*"
+)
+# 超长句子优先在逗号、顿号、冒号处断开
+_CLAUSE_RE = re.compile(r"[^，、：,:]+[，、：,:]*|[，、：,:]+")
+_CJK_RE = re.compile(r"[㐀-鿿豈-﫿]")
+
+# 一个句子：start / end 为在文档中的字符偏移，gap 为与上一句之间的空白（换行、空格）
+Sentence = namedtuple("Sentence", "start end text gap tokens")
+# 一个待入库的片段：index 为在文档中的序号，text 即文档的 [start, end) 部分
+Chunk = namedtuple("Chunk", "index text start end tokens")
+
+
+def hash_text(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def iter_sentences(lines):
+    """
+    逐行切句，返回 Sentence；lines 可以是文件对象或任意行迭代器，不把整个文件读入内存。
+    句子在句末标点（。！？；）处结束，换行也视为句子结束（标题、列表项通常没有句末标点）
+    """
+    pos = 0
+    gap = ""
+    for line in lines:
+        content = line.rstrip("\r\n")
+        for match in _SENTENCE_RE.finditer(content):
+            raw = match.group()
+            text = raw.strip()
+            if not text:
+                gap += raw
+                continue
+            lead = len(raw) - len(raw.lstrip())
+            start = pos + match.start() + lead
+            yield Sentence(start, start + len(text), text, gap + raw[:lead], estimate_tokens(text))
+            gap = raw[lead + len(text):]
+        gap += line[len(content):]
+        pos += len(line)
+
+
+def _split_long(sentence, max_tokens, first_max=None):
+    """
+    超过 max_tokens 的句子拆成多段：优先在逗号、顿号、冒号处断开，单个分句仍然过长时按字数硬切。
+    first_max 为第一段的上限，用于先填满当前片段的剩余空间
+    """
+    if sentence.tokens <= max_tokens:
+        yield sentence
+        return
+    text = sentence.text
+    limit = first_max or max_tokens
+    # 各段在句子中的 [begin, end)
+    bounds = []
+    begin, cost = 0, 0.0
+    for match in _CLAUSE_RE.finditer(text):
+        tokens = estimate_tokens(match.group())
+        if cost + tokens <= limit:
+            cost += tokens
+            continue
+        if cost:
+            bounds.append((begin, match.start()))
+            begin, cost, limit = match.start(), 0.0, max_tokens
+        if tokens <= limit:
+            cost = tokens
+            continue
+        # 逐字累计：中文每字 1 个 token，其余字符每 4 个 1 个 token，与 estimate_tokens 一致
+        for i, ch in enumerate(match.group(), match.start()):
+            step = 1.0 if _CJK_RE.match(ch) else (0.0 if ch == " " else 0.25)
+            if cost + step > limit:
+                bounds.append((begin, i))
+                begin, cost, limit = i, 0.0, max_tokens
+            cost += step
+    bounds.append((begin, len(text)))
+    for i, (begin, end) in enumerate(bounds):
+        part = text[begin:end]
+        yield Sentence(sentence.start + begin, sentence.start + end, part, sentence.gap if i == 0 else "",
+                       estimate_tokens(part))
+
+
+def _join(sentences):
+    text = sentences[0].text + "".join(s.gap + s.text for s in sentences[1:])
+    return text, sentences[0].start, sentences[-1].end
+
+
+def iter_chunks(lines, target_tokens=CHUNK_TARGET_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS,
+                min_chars=MIN_PARA_LEN):
+    """
+    把文档切成大小接近 target_tokens 的片段，返回 Chunk；lines 可以是文件对象或任意行迭代器。
+
+    按句子依次装入当前片段，再装一句会超过 target_tokens 时输出当前片段，
+    并把末尾不超过 overlap_tokens 的若干整句带入下一片段。段落之间不强制断开，
+    短标题、短段落与后面的内容合在一起，不再被丢弃。
+    只缓存当前片段和上一个片段，内存占用与文档大小无关
+    """
+    window, tokens, carried = [], 0, 0
+    # 延后一个片段输出：文档末尾的碎片可以并入上一片段
+    pending = None
+    index = 0
+
+    def emit(sentences):
+        nonlocal index
+        text, start, end = _join(sentences)
+        chunk = Chunk(index, text, start, end, sum(s.tokens for s in sentences))
+        index += 1
+        return chunk
+
+    for sentence in iter_sentences(lines):
+        # 超长句子先填满当前片段的剩余空间（留 1 个 token 的估算误差），剩余空间太小时从下一片段开始
+        room = target_tokens - tokens - 1
+        first_max = room if window and room >= target_tokens * CHUNK_MIN_TAIL_RATIO else None
+        for piece in _split_long(sentence, target_tokens, first_max):
+            if window and tokens + piece.tokens > target_tokens:
+                if pending is not None:
+                    yield pending
+                pending = emit(window)
+                # 末尾若干整句带入下一片段，至少留出一句新内容的位置
+                tail, tail_tokens = [], 0
+                for s in reversed(window[1:]):
+                    if tail_tokens + s.tokens > overlap_tokens:
+                        break
+                    tail.insert(0, s)
+                    tail_tokens += s.tokens
+                if tail_tokens + piece.tokens > target_tokens:
+                    tail, tail_tokens = [], 0
+                window, tokens, carried = tail, tail_tokens, len(tail)
+            window.append(piece)
+            tokens += piece.tokens
+
+    fresh = window[carried:]
+    if pending is not None and fresh:
+        fresh_tokens = sum(s.tokens for s in fresh)
+        if fresh_tokens < target_tokens * CHUNK_MIN_TAIL_RATIO:
+            # 尾部碎片并入上一片段（可能略超过目标大小）
+            extra = fresh[0].gap + _join(fresh)[0]
+            pending = pending._replace(text=pending.text + extra, end=fresh[-1].end,
+                                       tokens=pending.tokens + fresh_tokens)
+            fresh = []
+    if pending is not None:
+        yield pending
+    if fresh:
+        chunk = emit(window)
+        if pending is not None or len(chunk.text) >= min_chars:
+            yield chunk
+
+
+def chunk_text(text, target_tokens=CHUNK_TARGET_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """把一篇文档切成待入库的片段，返回 [Chunk]"""
+    return list(iter_chunks(text.splitlines(keepends=True), target_tokens, overlap_tokens))
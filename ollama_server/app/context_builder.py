@@ -0,0 +1,150 @@
+import os
+import re
+
+from app.bm25_index import tokenize
+
+# 背景知识部分的 token 预算
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "800"))
+# 单个片段裁剪后的 token 上限
+CONTEXT_CHUNK_MAX_TOKENS = int(os.environ.get("CONTEXT_CHUNK_MAX_TOKENS", "300"))
+# MMR 中相关度的权重，越小越偏向多样性
+CONTEXT_MMR_LAMBDA = float(os.environ.get("CONTEXT_MMR_LAMBDA", "0.7"))
+# 与已选片段的词集合相似度超过该值视为近似重复，直接丢弃
+CONTEXT_DUP_THRESHOLD = float(os.environ.get("CONTEXT_DUP_THRESHOLD", "0.8"))
+
+_CJK_RE = re.compile(r"[㐀-鿿豈-﫿]")
+_SENTENCE_RE = re.compile(r"[^。！？；!?;\n]+[。！？；!?;]*")
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：中文约每字 1 个 token，其余字符约每 4 个 1 个 token"""
+    cjk = len(_CJK_RE.findall(text))
+    other = len(text) - cjk - text.count(" ")
+    return cjk + (other + 3) // 4
+
+
+def split_sentences(text):
+    return [s.strip() for s in _SENTENCE_RE.findall(text) if s.strip()]
+
+
+def _truncate_tokens(text, max_tokens):
+    """按 estimate_tokens 截取不超过 max_tokens 的最长前缀"""
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 估算值随前缀变长单调不减，二分查找
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo]
+
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _trim_to_relevant(text, query_terms, max_tokens):
+    """保留与问题最相关的句子，按原文顺序拼接，不超过 max_tokens"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    scored, seen = [], set()
+    for i, sentence in enumerate(split_sentences(text)):
+        # 片段内重复的句子只保留一次
+        if sentence in seen:
+            continue
+        seen.add(sentence)
+        overlap = len(query_terms & set(tokenize(sentence)))
+        scored.append((overlap, -i, sentence))
+    # 有命中问题词的句子时，丢弃与问题无关的句子
+    if any(overlap for overlap, _, _ in scored):
+        scored = [item for item in scored if item[0]]
+
+    kept, used = [], 0
+    for overlap, neg_i, sentence in sorted(scored, reverse=True):
+        cost = estimate_tokens(sentence)
+        if used + cost > max_tokens:
+            continue
+        kept.append((-neg_i, sentence))
+        used += cost
+    if not kept:
+        # 单句就超限时按 token 估算截断
+        return _truncate_tokens(text, max_tokens)
+    return "".join(sentence for _, sentence in sorted(kept))
+
+
+def build_context(query, hits, token_budget=CONTEXT_TOKEN_BUDGET, max_chunks=None,
+                  chunk_max_tokens=CONTEXT_CHUNK_MAX_TOKENS, mmr_lambda=CONTEXT_MMR_LAMBDA,
+                  dup_threshold=CONTEXT_DUP_THRESHOLD):
+    """
+    组装拼入 prompt 的背景知识
+
+    Args:
+        query: 用户问题
+        hits: 检索结果（已按相关度排序），每项包含 id 与 document
+        token_budget: 背景知识的 token 预算
+        max_chunks: 最多使用的片段数，None 表示不限制
+
+    Returns:
+        (背景知识文本, 实际使用的片段列表, 统计信息)
+    """
+    query_terms = set(tokenize(query))
+    # 对比基准：不做去重和裁剪时直接拼入前 max_chunks 个片段的 token 数
+    baseline = hits if max_chunks is None else hits[:max_chunks]
+    tokens_before = sum(estimate_tokens(hit["document"]) for hit in baseline)
+
+    candidates = []
+    for rank, hit in enumerate(hits):
+        text = _trim_to_relevant(hit["document"], query_terms, chunk_max_tokens)
+        candidates.append({
+            "hit": hit,
+            "text": text,
+            "terms": set(tokenize(text)),
+            # 检索排名越靠前相关度越高
+            "relevance": 1.0 / (rank + 1),
+        })
+
+    selected, used = [], 0
+    dropped_duplicates = 0
+    while candidates and (max_chunks is None or len(selected) < max_chunks):
+        # MMR：相关度减去与已选片段的最大相似度
+        best, best_score, best_sim = None, None, 0.0
+        for cand in candidates:
+            sim = max((_jaccard(cand["terms"], s["terms"]) for s in selected), default=0.0)
+            score = mmr_lambda * cand["relevance"] - (1 - mmr_lambda) * sim
+            if best_score is None or score > best_score:
+                best, best_score, best_sim = cand, score, sim
+        candidates.remove(best)
+
+        if best_sim >= dup_threshold:
+            dropped_duplicates += 1
+            continue
+        remaining = token_budget - used
+        if remaining <= 0:
+            break
+        cost = estimate_tokens(best["text"])
+        if cost > remaining:
+            best["text"] = _trim_to_relevant(best["text"], query_terms, remaining)
+            cost = estimate_tokens(best["text"])
+            if not best["text"]:
+                break
+        selected.append(best)
+        used += cost
+
+    context = "\n".join(s["text"] for s in selected)
+    stats = {
+        "chunks_retrieved": len(hits),
+        "chunks_used": len(selected),
+        "duplicates_dropped": dropped_duplicates,
+        "tokens_before": tokens_before,
+        "tokens_after": used,
+        # 排名靠后的片段替换了被去重的片段时，使用的 token 数可能超过基准，不计为负数
+        "tokens_saved": max(0, tokens_before - used),
+    }
+    return context, [s["hit"] for s in selected], stats
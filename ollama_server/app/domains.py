@@ -0,0 +1,75 @@
+import logging
+import os
+import threading
+
+from app.faq_tier import _load_qa_processor_class
+
+logger = logging.getLogger("ollama_server")
+
+# 业务领域划分沿用 SmartQAApp 中 QAProcessor 的银行业务关键词表，
+# Chroma 集合名只能包含 ASCII 字符，每个领域对应一个英文标识
+DOMAIN_SLUGS = {
+    "账户服务": "account",
+    "贷款服务": "loan",
+    "信用卡": "credit_card",
+    "理财投资": "wealth",
+    "存款服务": "deposit",
+    "电子银行": "ebank",
+    "支付结算": "payment",
+    "账户安全": "security",
+    "网点服务": "branch",
+    "征信服务": "credit_report",
+}
+# 不属于任何领域的片段
+GENERAL_DOMAIN = "通用"
+GENERAL_SLUG = "general"
+# 片段至少命中该领域的这么多个关键词才归入该领域
+DOMAIN_MIN_HITS = int(os.environ.get("DOMAIN_MIN_HITS", "1"))
+
+_keywords = None
+_lock = threading.Lock()
+
+
+def domain_keywords():
+    """领域 -> 关键词列表；SmartQAApp 不可用时返回空表，全部片段归入通用领域"""
+    global _keywords
+    with _lock:
+        if _keywords is None:
+            try:
+                # _load_banking_keywords 不依赖实例状态，无需加载 FAQ 知识库和 TF-IDF
+                _keywords = _load_qa_processor_class()._load_banking_keywords(None)
+            except Exception:
+                logger.exception("无法加载领域关键词表，不做领域划分")
+                _keywords = {}
+        return _keywords
+
+
+def domain_slugs():
+    """领域 -> 集合名中使用的标识，包含通用领域"""
+    slugs = {}
+    for i, domain in enumerate(domain_keywords()):
+        slugs[domain] = DOMAIN_SLUGS.get(domain, f"domain{i}")
+    slugs[GENERAL_DOMAIN] = GENERAL_SLUG
+    return slugs
+
+
+def _hits(text):
+    text = text.lower()
+    return {
+        domain: sum(1 for keyword in keywords if keyword.lower() in text)
+        for domain, keywords in domain_keywords().items()
+    }
+
+
+def classify_text(text):
+    """入库时为片段分配领域：命中关键词最多的领域，并列时取关键词表中靠前的"""
+    best, best_hits = GENERAL_DOMAIN, DOMAIN_MIN_HITS - 1
+    for domain, hits in _hits(text).items():
+        if hits > best_hits:
+            best, best_hits = domain, hits
+    return best
+
+
+def query_domains(query):
+    """检索时问题涉及的全部领域（如“利率”同时属于贷款和存款）；为空表示无法判断"""
+    return [domain for domain, hits in _hits(query).items() if hits >= DOMAIN_MIN_HITS]
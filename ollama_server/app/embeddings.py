@@ -0,0 +1,167 @@
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# 句向量模型名称（PyTorch 后端从本地缓存或 HuggingFace 加载）
+EMBED_MODEL_NAME = os.environ.get("EMBED_MODEL", "all-MiniLM-L6-v2")
+# 嵌入后端：torch（sentence-transformers，默认）或 onnx（ONNX Runtime）
+EMBED_BACKEND = os.environ.get("EMBED_BACKEND", "torch")
+# app.export_onnx 导出的 ONNX 模型目录
+ONNX_MODEL_DIR = os.environ.get("ONNX_MODEL_DIR", "./onnx_models/all-MiniLM-L6-v2")
+# ONNX 后端是否使用 int8 动态量化模型
+ONNX_QUANTIZED = os.environ.get("ONNX_QUANTIZED", "1") != "0"
+# 推理线程数，0 表示使用框架默认值
+EMBED_THREADS = int(os.environ.get("EMBED_THREADS", "0"))
+
+
+class EmbeddingBackend:
+    """
+    句向量后端接口：encode 返回 L2 归一化后的 float32 矩阵，
+    与 SentenceTransformer.encode 的调用方式保持一致
+    """
+
+    name = "base"
+
+    def encode(self, texts, batch_size=32):
+        raise NotImplementedError
+
+    @property
+    def dim(self):
+        raise NotImplementedError
+
+
+class TorchBackend(EmbeddingBackend):
+    """sentence-transformers + PyTorch，与原有实现行为一致"""
+
+    name = "torch"
+
+    def __init__(self, model_name=EMBED_MODEL_NAME, threads=EMBED_THREADS):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if threads:
+            torch.set_num_threads(threads)
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts, batch_size=32):
+        return self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+
+    @property
+    def dim(self):
+        return self.model.get_sentence_embedding_dimension()
+
+
+class OnnxBackend(EmbeddingBackend):
+    """
+    ONNX Runtime CPU 推理，可选 int8 动态量化模型；
+    不依赖 PyTorch，分词使用 tokenizers 库，池化方式与 sentence-transformers 相同（mean + 归一化）
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR, quantized=ONNX_QUANTIZED, threads=EMBED_THREADS):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, "export_config.json"), encoding="utf-8") as f:
+            config = json.load(f)
+        model_file = config["quantized_model"] if quantized and config.get("quantized_model") else config["model"]
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, model_file), options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {i.name for i in self.session.get_inputs()}
+        self._dim = config["dim"]
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=config.get("pad_token_id", 0))
+        self.model_file = model_file
+
+    def encode(self, texts, batch_size=32):
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+        out = np.zeros((len(texts), self._dim), dtype=np.float32)
+        # 按长度排序后分批，减少同一批内的 padding
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), batch_size):
+            idx = order[start:start + batch_size]
+            out[idx] = self._encode_batch([texts[i] for i in idx])
+        return out[0] if single else out
+
+    def _encode_batch(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+
+        hidden = self.session.run(None, feeds)[0]
+        mask = attention_mask[..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return pooled / np.clip(norms, 1e-12, None)
+
+    @property
+    def dim(self):
+        return self._dim
+
+
+BACKENDS = {"torch": TorchBackend, "onnx": OnnxBackend}
+
+
+def get_embedding_backend(name=EMBED_BACKEND, **kwargs):
+    """按名称创建嵌入后端"""
+    try:
+        backend_cls = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"不支持的嵌入后端: {name}，可选 {sorted(BACKENDS)}") from None
+    return backend_cls(**kwargs)
+
+
+_worker_backend = None
+
+
+def _init_worker(name, threads):
+    global _worker_backend
+    _worker_backend = get_embedding_backend(name, threads=threads)
+
+
+def _encode_in_worker(texts, batch_size):
+    return _worker_backend.encode(texts, batch_size=batch_size)
+
+
+class EncodePool:
+    """多进程 encode：每个子进程各自加载一份嵌入后端，输入按进程数切片并行编码"""
+
+    def __init__(self, workers, name=EMBED_BACKEND):
+        self.workers = workers
+        # 各进程平分 CPU 核数，避免线程超额订阅
+        threads = max(1, (os.cpu_count() or workers) // workers)
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(name, threads),
+        )
+
+    def encode(self, texts, batch_size=32):
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        size = -(-len(texts) // self.workers)
+        slices = [texts[i:i + size] for i in range(0, len(texts), size)]
+        results = self._executor.map(_encode_in_worker, slices, [batch_size] * len(slices))
+        return np.vstack(list(results))
+
+    def close(self):
+        self._executor.shutdown()
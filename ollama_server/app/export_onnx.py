@@ -0,0 +1,104 @@
+import argparse
+import inspect
+import json
+import os
+
+from app.embeddings import EMBED_MODEL_NAME, ONNX_MODEL_DIR
+
+# ONNX 算子集版本
+OPSET = 14
+
+
+def export(model_name=EMBED_MODEL_NAME, output_dir=ONNX_MODEL_DIR, quantize=True, offline=True):
+    """
+    把 sentence-transformers 模型的 Transformer 部分导出为 ONNX，并可选做 int8 动态量化
+
+    Args:
+        model_name: 模型名称或本地路径
+        output_dir: 输出目录，包含 model.onnx、model.int8.onnx、tokenizer.json 和 export_config.json
+        quantize: 是否生成 int8 动态量化模型
+        offline: 只使用本地缓存的模型，不联网下载
+    """
+    if offline:
+        # 必须在导入 transformers 之前设置
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+        os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    st_model = SentenceTransformer(model_name, device="cpu")
+    transformer = st_model[0].auto_model.eval()
+    tokenizer = st_model.tokenizer
+
+    class _LastHiddenState(torch.nn.Module):
+        # 只导出最后一层隐藏状态，池化在 OnnxBackend 中用 numpy 完成
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            return self.model(
+                input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids
+            )[0]
+
+    os.makedirs(output_dir, exist_ok=True)
+    model_path = os.path.join(output_dir, "model.onnx")
+    dummy = tokenizer(["导出示例", "export sample"], padding=True, return_tensors="pt")
+    dynamic = {0: "batch", 1: "sequence"}
+    extra = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # 新版 torch 默认使用需要 onnxscript 的 dynamo 导出器，这里固定使用 TorchScript 导出器
+        extra["dynamo"] = False
+    with torch.no_grad():
+        torch.onnx.export(
+            _LastHiddenState(transformer),
+            (dummy["input_ids"], dummy["attention_mask"], dummy["token_type_ids"]),
+            model_path,
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": dynamic,
+                "attention_mask": dynamic,
+                "token_type_ids": dynamic,
+                "last_hidden_state": dynamic,
+            },
+            opset_version=OPSET,
+            **extra,
+        )
+    print(f"已导出 {model_path}")
+
+    quantized_model = None
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantized_model = "model.int8.onnx"
+        quantize_dynamic(model_path, os.path.join(output_dir, quantized_model), weight_type=QuantType.QInt8)
+        print(f"已生成 int8 量化模型 {os.path.join(output_dir, quantized_model)}")
+
+    # 快速分词器保存为 tokenizer.json，供 tokenizers 库直接加载
+    tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, "export_config.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "source_model": model_name,
+            "model": "model.onnx",
+            "quantized_model": quantized_model,
+            "dim": st_model.get_sentence_embedding_dimension(),
+            "max_seq_length": st_model.max_seq_length,
+            "pad_token_id": tokenizer.pad_token_id,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"导出完成：{output_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出 ONNX 句向量模型并做 int8 动态量化")
+    parser.add_argument("--model", default=EMBED_MODEL_NAME, help="模型名称或本地路径")
+    parser.add_argument("--output", default=ONNX_MODEL_DIR, help="输出目录")
+    parser.add_argument("--no-quantize", action="store_true", help="不生成 int8 量化模型")
+    parser.add_argument("--allow-download", action="store_true", help="本地没有缓存时允许联网下载模型")
+    args = parser.parse_args()
+    export(args.model, args.output, quantize=not args.no_quantize, offline=not args.allow_download)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import functools
+import importlib.util
+import logging
+import os
+import threading
+
+logger = logging.getLogger("ollama_server")
+
+# SmartQAApp 中的 QAProcessor 作为第 0 层：高置信度命中精选 FAQ 时直接返回，不调用 LLM
+SMARTQA_DIR = os.environ.get(
+    "SMARTQA_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "SmartQAApp"),
+)
+# 匹配分数高于该值才直接使用 FAQ 答案
+FAQ_CONFIDENCE = float(os.environ.get("FAQ_CONFIDENCE", "0.7"))
+# 设为 0 关闭 FAQ 层
+FAQ_TIER_ENABLED = os.environ.get("FAQ_TIER_ENABLED", "1") != "0"
+
+
+@functools.lru_cache(maxsize=None)
+def _load_qa_processor_class():
+    # FAQ 层和领域划分共用同一份模块；按文件路径加载，避免把 SmartQAApp 整个加入 sys.path 造成 models 等包名冲突
+    path = os.path.join(SMARTQA_DIR, "models", "qa_processor.py")
+    spec = importlib.util.spec_from_file_location("smartqa_qa_processor", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.QAProcessor
+
+
+class FAQTier:
+    """封装 QAProcessor 的匹配能力，只返回高置信度的精选答案"""
+
+    def __init__(self, confidence=FAQ_CONFIDENCE, enabled=FAQ_TIER_ENABLED):
+        self.confidence = confidence
+        self.enabled = enabled
+        self._processor = None
+        self._load_error = None
+        # QAProcessor 内部的 jieba/TF-IDF 不保证线程安全
+        self._lock = threading.Lock()
+
+    @property
+    def processor(self):
+        """首次使用时加载 QAProcessor，加载失败则关闭 FAQ 层；并发的首批请求只加载一次"""
+        if self._processor is None and self._load_error is None and self.enabled:
+            with self._lock:
+                if self._processor is None and self._load_error is None:
+                    try:
+                        processor = _load_qa_processor_class()()
+                        processor.initialize()
+                        self._processor = processor
+                    except Exception as e:
+                        self._load_error = str(e)
+                        logger.exception("FAQ 层加载失败，全部问题将交给 LLM")
+        return self._processor
+
+    def analyze(self, query):
+        """
+        调用 QAProcessor 理解问题并查找最佳匹配
+
+        Returns:
+            QAProcessor.match_query 的结果，FAQ 层不可用时返回 None
+        """
+        processor = self.processor
+        if processor is None:
+            return None
+        with self._lock:
+            return processor.match_query(query)
+
+    def answer(self, match):
+        """
+        根据 analyze 的结果判断能否直接回答
+
+        Returns:
+            命中时返回 {"id", "question", "answer", "category", "score"}，否则返回 None
+        """
+        if not match or match["item"] is None or match["score"] <= self.confidence:
+            return None
+        item = match["item"]
+        return {
+            "id": item["id"],
+            "question": item["question"],
+            "answer": item["answer"],
+            "category": item["category"],
+            "score": round(match["score"], 4),
+        }
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "loaded": self._processor is not None,
+            "load_error": self._load_error,
+            "confidence": self.confidence,
+        }
@@ -1,32 +1,371 @@
-import chromadb
-from sentence_transformers import SentenceTransformer
-import os
-
-# 新版 Chroma 初始化
-client = chromadb.PersistentClient(path="./chroma_db")
-collection = client.get_or_create_collection("kb_store")
-
-embed_model = SentenceTransformer("all-MiniLM-L6-v2")
-
-def index_docs():
-    for fname in os.listdir("./docs"):
-        with open(f"./docs/{fname}", encoding="utf-8") as f:
-            text = f.read()
-        for i, para in enumerate(text.split("\n\n")):
-            para = para.strip()
-            if len(para) < 10:
-                continue
-            emb = embed_model.encode(para).tolist()
-            collection.add(
-                ids=[f"{fname}_{i}"],
-                documents=[para],
-                embeddings=[emb],
-                metadatas=[{"source": fname, "para_id": i}]
-            )
-    print("知识库索引完成！")
-
-if __name__ == "__main__":
-    index_docs()
-
-
-
+import argparse
+import hashlib
+import os
+import random
+import time
+
+from app.bm25_index import rebuild_bm25
+from app.chunking import CHUNKER_SIGNATURE, hash_text, iter_chunks
+from app.domains import classify_text
+from app.embeddings import EMBED_BACKEND, EncodePool, get_embedding_backend
+from app.ingest import ORIGIN_BULK, BatchWriter, without_file_hash
+from app.kb_versions import (
+    activate, bump_generation, create_version, drop_version, gc, next_version_name, open_collection, read_alias,
+    swap_lock, validate_version,
+)
+from app.reduction import KB_REDUCE, KB_REDUCE_DIM, KB_REDUCE_FIT_SAMPLES, REDUCE_METHODS, Reducer, fit_reducer
+
+DOCS_DIR = "./docs"
+# 每批写入 Chroma 的片段数，同时也是一次 encode 调用处理的片段数
+UPSERT_BATCH_SIZE = 1000
+# 模型内部每个前向批次的大小
+ENCODE_BATCH_SIZE = 128
+# Chroma 分页读取元数据的页大小
+SCAN_PAGE_SIZE = 5000
+
+# 增量索引直接更新别名指向的当前版本；--new-version 时在新版本集合中全量构建
+collection = open_collection(read_alias()["active"])
+
+# 嵌入后端由 EMBED_BACKEND 选择（torch / onnx），须与服务端一致
+embed_model = get_embedding_backend()
+
+
+def _hash_file(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def iter_doc_files(docs_dir):
+    """按固定顺序遍历文档目录，返回 (source, 文件路径)，source 为相对路径"""
+    for root, dirs, files in os.walk(docs_dir):
+        dirs.sort()
+        for fname in sorted(files):
+            path = os.path.join(root, fname)
+            yield os.path.relpath(path, docs_dir).replace(os.sep, "/"), path
+
+
+def iter_file_chunks(path):
+    """逐行读取文件，按句子打包成大小均匀的片段，返回 Chunk，不把整个文件读入内存"""
+    with open(path, encoding="utf-8") as f:
+        yield from iter_chunks(f)
+
+
+def _scan_sources():
+    """分页扫描集合元数据，只保留出现过的 source 集合"""
+    sources = set()
+    offset = 0
+    while True:
+        page = collection.get(include=["metadatas"], limit=SCAN_PAGE_SIZE, offset=offset)
+        if not page["ids"]:
+            break
+        for meta in page["metadatas"]:
+            # 批量导入的文档不在文档目录中，不参与同步删除
+            if meta and "source" in meta and meta.get("origin") != ORIGIN_BULK:
+                sources.add(meta["source"])
+        offset += len(page["ids"])
+    return sources
+
+
+def _indexed_file_hash(source):
+    """只取该文件的第一个片段判断文件是否变化，它的 file_hash 在整个文件写入完成后才刷新"""
+    page = collection.get(ids=[f"{source}_0"], include=["metadatas"])
+    if not page["ids"]:
+        return None
+    return (page["metadatas"][0] or {}).get("file_hash")
+
+
+def _indexed_chunks(source):
+    """读取该文件已入库片段的 id -> (chunk_hash, domain)"""
+    page = collection.get(where={"source": source}, include=["metadatas"])
+    return {
+        chunk_id: ((meta or {}).get("chunk_hash"), (meta or {}).get("domain"))
+        for chunk_id, meta in zip(page["ids"], page["metadatas"])
+    }
+
+
+class _Progress:
+    """统计并打印索引进度与吞吐量"""
+
+    def __init__(self, total_files):
+        self.total_files = total_files
+        self.files_done = 0
+        self.files_skipped = 0
+        self.chunks_embedded = 0
+        self.chunks_unchanged = 0
+        self.chunks_deleted = 0
+        self.start = time.perf_counter()
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.start
+        return self.chunks_embedded / elapsed if elapsed > 0 else 0.0
+
+    def report(self):
+        print(
+            f"[{self.files_done}/{self.total_files} 文件] "
+            f"新写入 {self.chunks_embedded} 片段，未变化 {self.chunks_unchanged}，"
+            f"删除 {self.chunks_deleted}，{self.rate():.1f} 片段/秒"
+        )
+
+
+def _writer(progress, pool=None, batch_size=UPSERT_BATCH_SIZE):
+    """累积待入库片段，攒满一批后统一 encode 并 upsert，每批打印进度"""
+
+    def on_flush(count):
+        progress.chunks_embedded += count
+        progress.report()
+
+    return BatchWriter(collection, pool if pool is not None else embed_model, batch_size, ENCODE_BATCH_SIZE,
+                       on_flush=on_flush)
+
+
+def _index_file(source, path, writer, progress, full):
+    # 切分参数计入文件哈希，参数变化后未修改的文件也会重新切分
+    file_hash = hash_text(_hash_file(path) + CHUNKER_SIGNATURE)
+    if not full and _indexed_file_hash(source) == file_hash:
+        progress.files_skipped += 1
+        return
+
+    existing = {} if full else _indexed_chunks(source)
+    seen = set()
+    chunk_ids, chunk_metas = [], []
+
+    for chunk in iter_file_chunks(path):
+        chunk_id = f"{source}_{chunk.index}"
+        chunk_hash = hash_text(chunk.text)
+        # 入库时按关键词为片段分配业务领域，分片存储的版本据此写入对应分片
+        domain = classify_text(chunk.text)
+        # para_id 为片段序号，char_start / char_end 为片段在文件中的字符偏移
+        meta = {"source": source, "para_id": chunk.index, "char_start": chunk.start, "char_end": chunk.end,
+                "file_hash": file_hash, "chunk_hash": chunk_hash, "domain": domain}
+        seen.add(chunk_id)
+        # 内容未变的片段只需刷新 file_hash，不重新 encode；领域变化的片段需要重新写入（可能换了分片）
+        if existing.get(chunk_id) == (chunk_hash, domain):
+            chunk_ids.append(chunk_id)
+            chunk_metas.append(meta)
+            progress.chunks_unchanged += 1
+            continue
+        writer.add(chunk_id, chunk.text, without_file_hash(chunk, meta, chunk_ids, chunk_metas))
+
+    # 等本文件变化的片段写入后再刷新 file_hash
+    writer.commit_source(chunk_ids, chunk_metas)
+
+    stale = [chunk_id for chunk_id in existing if chunk_id not in seen]
+    if stale:
+        collection.delete(ids=stale)
+        progress.chunks_deleted += len(stale)
+
+
+def build_bm25_index():
+    """从 Chroma 中分页读取全部片段，重建并保存 BM25 词法索引"""
+    count = rebuild_bm25(collection, page_size=SCAN_PAGE_SIZE)
+    print(f"BM25 索引已更新，共 {count} 个片段")
+
+
+def index_docs(docs_dir=DOCS_DIR, workers=1, batch_size=UPSERT_BATCH_SIZE, full=False):
+    """
+    增量索引文档目录
+
+    Args:
+        docs_dir: 文档目录
+        workers: encode 使用的进程数，大于 1 时启用多进程
+        batch_size: 每批 encode/upsert 的片段数
+        full: 为 True 时忽略已有哈希，全部重新 encode
+    """
+    files = list(iter_doc_files(docs_dir))
+    progress = _Progress(len(files))
+    pool = None
+    if workers > 1:
+        pool = EncodePool(workers, EMBED_BACKEND)
+
+    try:
+        writer = _writer(progress, pool=pool, batch_size=batch_size)
+        for source, path in files:
+            _index_file(source, path, writer, progress, full)
+            progress.files_done += 1
+        writer.flush()
+    finally:
+        if pool is not None:
+            pool.close()
+
+    # 删除已不存在的文件对应的片段
+    current = {source for source, _ in files}
+    for source in _scan_sources() - current:
+        removed = collection.get(where={"source": source}, include=[])["ids"]
+        collection.delete(ids=removed)
+        progress.chunks_deleted += len(removed)
+
+    progress.report()
+    build_bm25_index()
+    if progress.chunks_embedded or progress.chunks_deleted:
+        # 增量索引原地修改当前版本，服务端各 worker 检查到内容代数变化后清空语义回答缓存和预生成的回答
+        bump_generation(collection.name)
+    print(f"知识库索引完成！跳过未变化文件 {progress.files_skipped} 个，耗时 {time.perf_counter() - progress.start:.1f} 秒")
+    return progress
+
+
+def _carry_over_bulk(source, writer):
+    """把当前版本中批量导入的片段（文档目录中没有原文）重新 encode 写入新版本，返回片段数"""
+    count = 0
+    offset = 0
+    while True:
+        page = source.get(where={"origin": ORIGIN_BULK}, include=["documents", "metadatas"],
+                          limit=SCAN_PAGE_SIZE, offset=offset)
+        if not page["ids"]:
+            break
+        for chunk_id, doc, meta in zip(page["ids"], page["documents"], page["metadatas"]):
+            writer.add(chunk_id, doc, meta)
+        count += len(page["ids"])
+        offset += len(page["ids"])
+    writer.flush()
+    return count
+
+
+def _bulk_metadatas(store):
+    """批量导入片段的 id -> 元数据"""
+    metas = {}
+    offset = 0
+    while True:
+        page = store.get(where={"origin": ORIGIN_BULK}, include=["metadatas"], limit=SCAN_PAGE_SIZE, offset=offset)
+        if not page["ids"]:
+            break
+        metas.update(zip(page["ids"], page["metadatas"]))
+        offset += len(page["ids"])
+    return metas
+
+
+def _sync_bulk(source, writer):
+    """
+    第二遍沿用批量导入的片段，持有切换锁时执行：第一遍之后新导入或修改的片段重新写入，
+    之后被删除的片段从新版本中删除
+
+    Returns:
+        (新增片段数, 修改片段数, 删除片段数)
+    """
+    current = _bulk_metadatas(source)
+    carried = _bulk_metadatas(collection)
+    changed = [chunk_id for chunk_id, meta in current.items() if carried.get(chunk_id) != meta]
+    removed = [chunk_id for chunk_id in carried if chunk_id not in current]
+    for start in range(0, len(changed), SCAN_PAGE_SIZE):
+        page = source.get(ids=changed[start:start + SCAN_PAGE_SIZE], include=["documents", "metadatas"])
+        for chunk_id, doc, meta in zip(page["ids"], page["documents"], page["metadatas"]):
+            writer.add(chunk_id, doc, meta)
+    writer.flush()
+    if removed:
+        collection.delete(ids=removed)
+    added = sum(1 for chunk_id in changed if chunk_id not in carried)
+    return added, len(changed) - added, len(removed)
+
+
+def fit_version_reducer(docs_dir, method, dim=KB_REDUCE_DIM, samples=KB_REDUCE_FIT_SAMPLES):
+    """
+    从文档目录的片段中均匀抽样（蓄水池抽样，不把全部片段留在内存中），encode 后拟合降维器；
+    样本不足以拟合时返回 None，该版本不降维。随机投影不需要 encode
+    """
+    rng = random.Random(0)
+    texts = []
+    seen = 0
+    for _, path in iter_doc_files(docs_dir):
+        for chunk in iter_file_chunks(path):
+            seen += 1
+            if len(texts) < samples:
+                texts.append(chunk.text)
+            else:
+                slot = rng.randrange(seen)
+                if slot < samples:
+                    texts[slot] = chunk.text
+    if not texts:
+        print("文档目录中没有片段，不降维")
+        return None
+    try:
+        if method == "random":
+            reducer = Reducer.random_projection(embed_model.dim, dim)
+        else:
+            reducer = fit_reducer(method, embed_model.encode(texts, batch_size=ENCODE_BATCH_SIZE), dim)
+    except ValueError as e:
+        print(f"无法拟合降维器，不降维：{e}")
+        return None
+    print(f"降维：{reducer.stats()}，抽样片段 {len(texts)} / {seen}")
+    return reducer
+
+
+def build_version(docs_dir=DOCS_DIR, workers=1, batch_size=UPSERT_BATCH_SIZE, switch=True, reduce=KB_REDUCE,
+                  reduce_dim=KB_REDUCE_DIM):
+    """
+    在新的版本集合 kb_store_v{n} 中全量构建知识库，服务端在此期间继续读取当前版本；
+    构建完成并通过校验后原子切换别名，再清理多余的旧版本
+
+    Args:
+        switch: 为 False 时只构建和校验，不切换（之后可用 python -m app.kb_versions activate 切换）
+        reduce: 降维方式（pca / random），为空时不降维；降维器在本次的文档上拟合，随版本保存
+
+    Returns:
+        新版本名；校验失败时删除新版本并返回 None
+    """
+    global collection
+    active = collection
+    name = next_version_name()
+    print(f"开始构建 {name}，当前版本 {active.name}")
+    reducer = fit_version_reducer(docs_dir, reduce, reduce_dim) if reduce else None
+    # 本模块的各函数都读写模块级 collection，构建期间指向新版本
+    collection = create_version(name, reducer=reducer)
+    try:
+        progress = index_docs(docs_dir, workers=workers, batch_size=batch_size, full=True)
+        carried = _carry_over_bulk(active, _writer(progress, batch_size=batch_size))
+        expected = progress.chunks_embedded
+        # 第一遍之后服务端仍在向当前版本批量导入；持有切换锁（导入暂停）补齐差异，再校验和切换别名，
+        # 锁释放后的导入写入新版本
+        with swap_lock(exclusive=True):
+            added, changed, removed = _sync_bulk(active, _writer(progress, batch_size=batch_size))
+            expected += added - removed
+            if carried or added or changed or removed:
+                print(f"沿用批量导入的片段 {carried + added - removed} 个")
+                build_bm25_index()
+            dim = reducer.out_dim if reducer is not None else embed_model.dim
+            errors = validate_version(collection, expected, dim, active.count())
+            if switch and not errors:
+                activate(name)
+    finally:
+        collection = active
+
+    if errors:
+        print(f"{name} 校验失败，未切换：")
+        for error in errors:
+            print(f"  - {error}")
+        drop_version(name)
+        return None
+    if switch:
+        collection = open_collection(name)
+        print(f"已切换到 {name}，可用 python -m app.kb_versions rollback 回滚")
+        removed = gc()
+        if removed:
+            print(f"已删除旧版本 {removed}")
+    return name
+
+
+def main():
+    parser = argparse.ArgumentParser(description="增量索引知识库文档")
+    parser.add_argument("--docs", default=DOCS_DIR, help="文档目录")
+    parser.add_argument("--workers", type=int, default=1, help="encode 进程数")
+    parser.add_argument("--batch-size", type=int, default=UPSERT_BATCH_SIZE, help="每批 encode/upsert 的片段数")
+    parser.add_argument("--full", action="store_true", help="忽略内容哈希，全部重建")
+    parser.add_argument("--new-version", action="store_true",
+                        help="在新的版本集合中全量构建，校验通过后切换，服务端不受影响")
+    parser.add_argument("--no-switch", action="store_true", help="与 --new-version 一起使用，只构建不切换")
+    parser.add_argument("--reduce", choices=REDUCE_METHODS + ("none",), default=KB_REDUCE or "none",
+                        help="与 --new-version 一起使用，在文档上拟合降维器并以低维向量存储")
+    parser.add_argument("--reduce-dim", type=int, default=KB_REDUCE_DIM, help="降维后的维度")
+    args = parser.parse_args()
+    if args.new_version:
+        reduce = "" if args.reduce == "none" else args.reduce
+        if build_version(args.docs, workers=args.workers, batch_size=args.batch_size,
+                         switch=not args.no_switch, reduce=reduce, reduce_dim=args.reduce_dim) is None:
+            raise SystemExit(1)
+    else:
+        index_docs(args.docs, workers=args.workers, batch_size=args.batch_size, full=args.full)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,450 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from app.bm25_index import rebuild_bm25
+from app.chunking import CHUNKER_SIGNATURE, chunk_text, hash_text
+from app.domains import classify_text, domain_slugs
+
+logger = logging.getLogger("ollama_server")
+
+# 批量导入配置，均可通过环境变量覆盖
+# 上传的 NDJSON 先落盘到该目录再由后台线程逐行处理，内存占用与上传大小无关；
+# 任务状态也写在这里，多 worker 部署时任意进程都能查询
+INGEST_SPOOL_DIR = os.environ.get("INGEST_SPOOL_DIR", "./ingest_spool")
+# 每批 encode + upsert 的片段数；比 index_kb 的批次小，单批占用 CPU 的时间短，不会长时间挤占问答请求的 encode
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "64"))
+# 有 LLM 生成进行中时，每批之间让出 CPU 的时间（秒）
+INGEST_YIELD_SECONDS = float(os.environ.get("INGEST_YIELD_SECONDS", "0.05"))
+# 单次上传的字节数上限
+INGEST_MAX_BYTES = int(os.environ.get("INGEST_MAX_BYTES", str(512 * 1024 * 1024)))
+# 内存中保留的任务数，超出时淘汰最早结束的任务
+INGEST_MAX_JOBS = int(os.environ.get("INGEST_MAX_JOBS", "100"))
+# 每个任务最多记录的出错行数
+INGEST_MAX_ERRORS = 20
+
+# 片段元数据中由导入流程维护的字段，不能被上传的 metadata 覆盖
+RESERVED_META = ("source", "para_id", "char_start", "char_end", "file_hash", "chunk_hash", "origin")
+# 批量导入的片段标记 origin，index_kb 按文档目录同步时不会把它们当作已删除的文件清理
+ORIGIN_BULK = "bulk"
+
+# 队列中的标记：只需重建 BM25 索引（例如按 source 删除之后）
+_REBUILD = object()
+
+
+class IngestJob:
+    """一次批量导入：上传（receiving）-> 排队（queued）-> 处理（running）-> 完成（done）/ 失败（failed）"""
+
+    def __init__(self, job_id, spool_dir):
+        self.id = job_id
+        self.spool_path = os.path.join(spool_dir, f"{job_id}.ndjson")
+        self.state_path = os.path.join(spool_dir, f"{job_id}.json")
+        self.status = "receiving"
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.bytes_received = 0
+        self.bytes_processed = 0
+        self.docs_done = 0
+        self.docs_unchanged = 0
+        self.docs_failed = 0
+        self.chunks_embedded = 0
+        self.chunks_unchanged = 0
+        self.chunks_deleted = 0
+        # [{"line": 行号, "error": 原因}]，最多 INGEST_MAX_ERRORS 条
+        self.errors = []
+
+    def fail_line(self, line_no, reason):
+        self.docs_failed += 1
+        if len(self.errors) < INGEST_MAX_ERRORS:
+            self.errors.append({"line": line_no, "error": reason})
+
+    def to_dict(self):
+        end = self.finished or time.time()
+        elapsed = end - self.started if self.started else 0.0
+        progress = self.bytes_processed / self.bytes_received if self.bytes_received else 0.0
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created,
+            "elapsed_seconds": round(elapsed, 3),
+            # 按已处理的上传字节估算的进度
+            "progress": round(1.0 if self.status == "done" else progress, 4),
+            "bytes_received": self.bytes_received,
+            "docs_done": self.docs_done,
+            "docs_unchanged": self.docs_unchanged,
+            "docs_failed": self.docs_failed,
+            "chunks_embedded": self.chunks_embedded,
+            "chunks_unchanged": self.chunks_unchanged,
+            "chunks_deleted": self.chunks_deleted,
+            "chunks_per_second": round(self.chunks_embedded / elapsed, 1) if elapsed > 0 else 0.0,
+            "docs_per_second": round(self.docs_done / elapsed, 1) if elapsed > 0 else 0.0,
+            "errors": self.errors,
+        }
+
+    def save_state(self):
+        # 原子替换，其他 worker 进程读到的总是完整的状态
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_path)
+
+
+def parse_document(line):
+    """
+    解析一行 NDJSON：{"source": "...", "text": "...", "metadata": {...}}
+
+    Returns:
+        (source, text, metadata)；格式错误时抛出 ValueError
+    """
+    try:
+        doc = json.loads(line)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"JSON 格式错误：{e.msg}") from None
+    if not isinstance(doc, dict):
+        raise ValueError("每行应为一个 JSON 对象")
+    source, text = doc.get("source"), doc.get("text")
+    if not isinstance(source, str) or not source.strip():
+        raise ValueError("缺少 source")
+    if not isinstance(text, str):
+        raise ValueError("缺少 text")
+    metadata = doc.get("metadata") or {}
+    if not isinstance(metadata, dict):
+        raise ValueError("metadata 应为对象")
+    # Chroma 元数据只支持标量
+    for key, value in metadata.items():
+        if key in RESERVED_META:
+            raise ValueError(f"metadata 不能包含保留字段 {key}")
+        if not isinstance(value, (str, int, float, bool)):
+            raise ValueError(f"metadata.{key} 只能是字符串、数字或布尔值")
+    if "domain" in metadata and metadata["domain"] not in domain_slugs():
+        raise ValueError(f"未知的 domain：{metadata['domain']}")
+    return source.strip(), text, metadata
+
+
+class IngestWorker:
+    """
+    后台导入线程：逐行读取落盘的 NDJSON，切分、分批 encode 并 upsert 到 Chroma。
+    任务按提交顺序串行执行，全部执行完后重建一次 BM25 索引；
+    encode 在独立线程中进行，不占用事件循环，有生成进行中时每批之间主动让出 CPU
+    """
+
+    def __init__(self, collection, embed_model, spool_dir=INGEST_SPOOL_DIR, batch_size=INGEST_BATCH_SIZE,
+                 should_yield=None, on_change=None, swap_lock=None):
+        """
+        Args:
+            should_yield: 返回 True 时每批之间暂停 INGEST_YIELD_SECONDS，例如有 LLM 生成进行中
+            on_change: 知识库内容变化且 BM25 索引重建后调用，例如清空语义回答缓存
+            swap_lock: 版本切换锁（kb_versions.swap_lock），每个任务和删除在持有共享锁期间写入
+        """
+        self.collection = collection
+        self.embed_model = embed_model
+        self.spool_dir = spool_dir
+        self.batch_size = batch_size
+        self.should_yield = should_yield
+        self.on_change = on_change
+        self.swap_lock = swap_lock
+
+        self._jobs = OrderedDict()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._dirty = False
+        self.running = None
+
+        self.completed = 0
+        self.failed = 0
+        self.chunks_embedded = 0
+        self.sources_deleted = 0
+        self.bm25_rebuilds = 0
+
+    def create_job(self):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        job = IngestJob(uuid.uuid4().hex[:16], self.spool_dir)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim()
+        return job
+
+    def submit(self, job):
+        """上传完成后排队处理"""
+        job.status = "queued"
+        job.save_state()
+        self._ensure_thread()
+        self._queue.put(job)
+
+    def discard(self, job):
+        """上传中断或超限，丢弃任务"""
+        with self._lock:
+            self._jobs.pop(job.id, None)
+        for path in (job.spool_path, job.state_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def get(self, job_id):
+        """查询任务状态；本进程没有的任务从状态文件读取（多 worker 部署时由其他进程处理）"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        # job id 只含十六进制字符，避免拼出目录外的路径
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(os.path.join(self.spool_dir, f"{job_id}.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def delete_source(self, source):
+        """删除某个文档的全部片段，返回删除的片段数；BM25 索引在后台线程中重建"""
+        with self._locked():
+            removed = self.collection.get(where={"source": source}, include=[])["ids"]
+            if removed:
+                self.collection.delete(ids=removed)
+        if removed:
+            with self._lock:
+                self.sources_deleted += 1
+                self._dirty = True
+            self._ensure_thread()
+            self._queue.put(_REBUILD)
+        return len(removed)
+
+    @contextmanager
+    def _locked(self):
+        """持有版本切换的共享锁；等待期间可能已切换到新版本，拿到锁后立即检查别名再写入"""
+        if self.swap_lock is None:
+            yield
+            return
+        with self.swap_lock():
+            refresh = getattr(self.collection, "refresh", None)
+            if refresh is not None:
+                refresh()
+            yield
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="kb-ingest", daemon=True)
+                self._thread.start()
+
+    def _trim(self):
+        # 只淘汰已结束的任务，状态文件一并删除
+        while len(self._jobs) > INGEST_MAX_JOBS:
+            for job_id, job in self._jobs.items():
+                if job.status in ("done", "failed"):
+                    del self._jobs[job_id]
+                    if os.path.exists(job.state_path):
+                        os.remove(job.state_path)
+                    break
+            else:
+                break
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is not _REBUILD:
+                self._run(item)
+            # 连续提交的多个任务全部处理完后只重建一次
+            if self._dirty and self._queue.empty():
+                self._rebuild()
+
+    def _rebuild(self):
+        self._dirty = False
+        try:
+            count = rebuild_bm25(self.collection)
+        except Exception:
+            logger.exception("BM25 索引重建失败")
+            return
+        self.bm25_rebuilds += 1
+        logger.info("批量导入后 BM25 索引已更新，共 %d 个片段", count)
+        if self.on_change is not None:
+            self.on_change()
+
+    def _run(self, job):
+        self.running = job.id
+        job.status = "running"
+        job.started = time.time()
+
+        def on_flush(count):
+            job.chunks_embedded += count
+            self.chunks_embedded += count
+            self._dirty = True
+            job.save_state()
+
+        writer = BatchWriter(self.collection, self.embed_model, self.batch_size, before_flush=self._pause,
+                             on_flush=on_flush)
+        try:
+            with self._locked():
+                self._ingest_spool(job, writer)
+            job.status = "done"
+            self.completed += 1
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            self.failed += 1
+            logger.exception("批量导入任务 %s 失败", job.id)
+        finally:
+            job.finished = time.time()
+            self.running = None
+            job.save_state()
+            if os.path.exists(job.spool_path):
+                os.remove(job.spool_path)
+            with self._lock:
+                self._trim()
+
+    def _ingest_spool(self, job, writer):
+        seen = set()
+        with open(job.spool_path, "rb") as f:
+            for line_no, raw in enumerate(f, 1):
+                job.bytes_processed += len(raw)
+                line = raw.decode("utf-8", errors="replace").strip()
+                if not line:
+                    continue
+                try:
+                    source, text, metadata = parse_document(line)
+                except ValueError as e:
+                    job.fail_line(line_no, str(e))
+                    continue
+                if source in seen:
+                    # 同一任务中重复出现的文档，先写入之前的片段再比较
+                    writer.flush()
+                seen.add(source)
+                self._ingest_document(job, writer, source, text, metadata)
+        writer.flush()
+
+    def _pause(self):
+        if self.should_yield is not None and self.should_yield():
+            time.sleep(INGEST_YIELD_SECONDS)
+
+    def _ingest_document(self, job, writer, source, text, metadata):
+        """与 index_kb 的增量逻辑相同：内容未变的片段只刷新元数据，不再出现的片段删除"""
+        file_hash = hash_text(json.dumps([text, metadata, CHUNKER_SIGNATURE], ensure_ascii=False, sort_keys=True))
+        page = self.collection.get(where={"source": source}, include=["metadatas"])
+        existing = {chunk_id: meta or {} for chunk_id, meta in zip(page["ids"], page["metadatas"])}
+        if existing and all(meta.get("file_hash") == file_hash for meta in existing.values()):
+            job.docs_unchanged += 1
+            job.docs_done += 1
+            return
+
+        seen = set()
+        chunk_ids, chunk_metas = [], []
+        for chunk in chunk_text(text):
+            chunk_id = f"{source}_{chunk.index}"
+            chunk_hash = hash_text(chunk.text)
+            meta = dict(metadata, source=source, para_id=chunk.index, char_start=chunk.start, char_end=chunk.end,
+                        file_hash=file_hash, chunk_hash=chunk_hash, origin=ORIGIN_BULK)
+            # 上传时未指定领域的片段按关键词分配
+            meta.setdefault("domain", classify_text(chunk.text))
+            seen.add(chunk_id)
+            old = existing.get(chunk_id, {})
+            if old.get("chunk_hash") == chunk_hash and old.get("domain") == meta["domain"]:
+                chunk_ids.append(chunk_id)
+                chunk_metas.append(meta)
+                job.chunks_unchanged += 1
+                continue
+            writer.add(chunk_id, chunk.text, without_file_hash(chunk, meta, chunk_ids, chunk_metas))
+
+        writer.commit_source(chunk_ids, chunk_metas)
+        stale = [chunk_id for chunk_id in existing if chunk_id not in seen]
+        if stale:
+            self.collection.delete(ids=stale)
+            job.chunks_deleted += len(stale)
+            self._dirty = True
+        job.docs_done += 1
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {
+            "queued": sum(1 for job in jobs if job.status == "queued"),
+            "running": self.running,
+            "jobs": len(jobs),
+            "completed": self.completed,
+            "failed": self.failed,
+            "chunks_embedded": self.chunks_embedded,
+            "sources_deleted": self.sources_deleted,
+            "bm25_rebuilds": self.bm25_rebuilds,
+        }
+
+
+def without_file_hash(chunk, meta, deferred_ids, deferred_metas):
+    """
+    变化的片段写入时的元数据：第一个片段先不带 file_hash，与内容未变的片段一起登记到
+    deferred_ids / deferred_metas，由 BatchWriter.commit_source 在本文件变化的片段全部写入后最后刷新。
+    这样只要第一个片段带有新的 file_hash，该文件就已完整写入，中途崩溃后下次运行不会误判为未变化而跳过
+    """
+    if chunk.index != 0:
+        return meta
+    deferred_ids.append(f"{meta['source']}_0")
+    deferred_metas.append(meta)
+    return {key: value for key, value in meta.items() if key != "file_hash"}
+
+
+class BatchWriter:
+    """
+    累积待入库片段，攒满一批后统一 encode 并 upsert；index_kb 与批量导入共用。
+    commit_source 登记的元数据刷新推迟到此前 add 的片段全部写入之后执行
+    """
+
+    def __init__(self, collection, encoder, batch_size, encode_batch_size=None, before_flush=None, on_flush=None):
+        """
+        Args:
+            encoder: 提供 encode(texts, batch_size) 的嵌入后端或 EncodePool
+            encode_batch_size: 模型内部每个前向批次的大小，默认与 batch_size 相同
+            before_flush: 每批 encode 之前调用，例如让出 CPU
+            on_flush: 每批写入后以片段数调用，用于统计进度
+        """
+        self.collection = collection
+        self.encoder = encoder
+        self.batch_size = batch_size
+        self.encode_batch_size = encode_batch_size or batch_size
+        self.before_flush = before_flush
+        self.on_flush = on_flush
+        self.ids, self.docs, self.metas = [], [], []
+        # 等待本批写入后执行的元数据刷新 [(ids, metadatas)]
+        self._pending_updates = []
+
+    def add(self, chunk_id, doc, meta):
+        self.ids.append(chunk_id)
+        self.docs.append(doc)
+        self.metas.append(meta)
+        if len(self.ids) >= self.batch_size:
+            self.flush()
+
+    def commit_source(self, ids, metadatas):
+        """
+        登记一个文件的元数据刷新，在已 add 的片段写入后执行。
+        ids 中的第一个片段是该文件写入完成的标记（见 without_file_hash），放在最后刷新
+        """
+        if ids:
+            self._pending_updates.append((list(ids[1:]) + list(ids[:1]), list(metadatas[1:]) + list(metadatas[:1])))
+        if not self.ids:
+            self._apply_updates()
+
+    def flush(self):
+        if self.ids:
+            if self.before_flush is not None:
+                self.before_flush()
+            embs = self.encoder.encode(self.docs, batch_size=self.encode_batch_size)
+            self.collection.upsert(ids=self.ids, documents=self.docs, embeddings=embs, metadatas=self.metas)
+            count = len(self.ids)
+            self.ids, self.docs, self.metas = [], [], []
+            if self.on_flush is not None:
+                self.on_flush(count)
+        self._apply_updates()
+
+    def _apply_updates(self):
+        for ids, metadatas in self._pending_updates:
+            for start in range(0, len(ids), self.batch_size):
+                self.collection.update(ids=ids[start:start + self.batch_size],
+                                       metadatas=metadatas[start:start + self.batch_size])
+        self._pending_updates = []
@@ -0,0 +1,407 @@
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+import chromadb
+import numpy as np
+
+from app.bm25_index import bm25_path
+from app.reduction import REDUCER_FILE, ReducedStore, Reducer
+from app.shards import ShardedCollection
+from app.vector_store import ChromaStore, MmapStore, file_lock
+
+logger = logging.getLogger("ollama_server")
+
+# 尚未构建过版本（没有别名文件）时使用原有的 kb_store 集合
+CHROMA_PATH = "./chroma_db"
+KB_BASE_NAME = "kb_store"
+# 每个版本 kb_store_v{n} 使用独立的目录，构建新版本时的写入（如 Chroma 的 SQLite）不会与服务端的读取争用，
+# 删除旧版本时也能直接回收磁盘空间
+KB_VERSIONS_DIR = os.environ.get("KB_VERSIONS_DIR", "./kb_versions")
+# 别名文件：记录当前生效的版本和上一个版本，切换时原子替换
+KB_ALIAS_PATH = os.path.join(KB_VERSIONS_DIR, "alias.json")
+# 服务端检查别名文件是否变化的间隔（秒）
+KB_ALIAS_CHECK_SECONDS = float(os.environ.get("KB_ALIAS_CHECK_SECONDS", "1.0"))
+# 除当前版本外保留的旧版本数，用于回滚
+KB_KEEP_VERSIONS = int(os.environ.get("KB_KEEP_VERSIONS", "1"))
+# 新构建版本的存储方式，记录在版本目录的 layout.json 中，读取时以此为准：
+# chroma 为 Chroma 集合，mmap 为进程内精确检索的内存映射存储（不分片）
+KB_STORE = os.environ.get("KB_STORE", "chroma")
+# chroma 存储时是否按业务领域分片
+KB_SHARDED = os.environ.get("KB_SHARDED", "1") != "0"
+# 校验：抽样片段用自身向量检索，top1 应为其自身的比例下限
+KB_VALIDATE_SAMPLES = int(os.environ.get("KB_VALIDATE_SAMPLES", "20"))
+KB_MIN_SELF_RECALL = float(os.environ.get("KB_MIN_SELF_RECALL", "0.9"))
+# 校验：新版本片段数不低于当前版本的该比例，防止文档目录挂载失败等情况下切到一个残缺的版本
+KB_MIN_COUNT_RATIO = float(os.environ.get("KB_MIN_COUNT_RATIO", "0.5"))
+
+_VERSION_RE = re.compile(rf"^{KB_BASE_NAME}_v(\d+)$")
+_clients = {}
+
+
+def version_name(n):
+    return f"{KB_BASE_NAME}_v{n}"
+
+
+def version_number(name):
+    match = _VERSION_RE.match(name or "")
+    return int(match.group(1)) if match else 0
+
+
+def version_path(name):
+    return CHROMA_PATH if name == KB_BASE_NAME else os.path.join(KB_VERSIONS_DIR, name)
+
+
+def _layout_path(name):
+    return os.path.join(version_path(name), "layout.json")
+
+
+def read_layout(name):
+    """版本的存储方式；原有的 kb_store 和没有 layout.json 的版本为单一集合"""
+    if name == KB_BASE_NAME:
+        return {"sharded": False}
+    try:
+        with open(_layout_path(name), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"sharded": False}
+
+
+def create_version(name, store=KB_STORE, sharded=KB_SHARDED, reducer=None):
+    """
+    创建新版本目录并记录存储方式，返回可写入的集合
+
+    Args:
+        reducer: 降维器，保存在版本目录中；该版本的写入和检索都经过它投影到低维
+    """
+    if store not in ("chroma", "mmap"):
+        raise ValueError(f"未知的存储方式: {store}")
+    os.makedirs(version_path(name), exist_ok=True)
+    layout = {"store": store, "sharded": sharded and store == "chroma"}
+    if reducer is not None:
+        reducer.save(os.path.join(version_path(name), REDUCER_FILE))
+        layout["reduce"] = reducer.stats()
+    with open(_layout_path(name), "w", encoding="utf-8") as f:
+        json.dump(layout, f)
+    return open_collection(name)
+
+
+def open_collection(name, create=True):
+    """
+    打开某个版本的知识库
+
+    Returns:
+        VectorStore：ChromaStore、ShardedCollection 或 MmapStore，接口一致；
+        版本带降维器时外面再包一层 ReducedStore
+    """
+    path = version_path(name)
+    layout = read_layout(name)
+    if layout.get("store") == "mmap":
+        store = MmapStore(path, name)
+    else:
+        if path not in _clients:
+            # 版本目录一经创建即占用版本号，list_versions 按目录判断
+            os.makedirs(path, exist_ok=True)
+            _clients[path] = chromadb.PersistentClient(path=path)
+        client = _clients[path]
+        if layout.get("sharded"):
+            store = ShardedCollection(client, name, create=create)
+        else:
+            store = ChromaStore(client.get_or_create_collection(name) if create else client.get_collection(name))
+    if layout.get("reduce"):
+        store = ReducedStore(store, Reducer.load(os.path.join(path, REDUCER_FILE)))
+    return store
+
+
+def _generation_path(name):
+    return os.path.join(version_path(name), "generation.json")
+
+
+def read_generation(name):
+    """版本的内容代数：批量导入、增量索引等原地修改该版本时递增，未修改过为 0"""
+    try:
+        with open(_generation_path(name), encoding="utf-8") as f:
+            return json.load(f)["generation"]
+    except (FileNotFoundError, ValueError, KeyError):
+        return 0
+
+
+def bump_generation(name):
+    """
+    记录版本内容已变化，返回新的代数。各 worker 与别名一起定期检查代数，
+    变化时清空本进程的语义回答缓存和预生成的回答
+    """
+    generation = read_generation(name) + 1
+    path = _generation_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"generation": generation, "updated_at": time.time()}, f)
+    os.replace(tmp_path, path)
+    return generation
+
+
+def read_alias():
+    try:
+        with open(KB_ALIAS_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"active": KB_BASE_NAME, "previous": None}
+
+
+def _write_alias(active, previous):
+    os.makedirs(KB_VERSIONS_DIR, exist_ok=True)
+    tmp_path = f"{KB_ALIAS_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"active": active, "previous": previous, "updated_at": time.time()}, f, ensure_ascii=False)
+    # 原子替换，服务端不会读到写了一半的别名
+    os.replace(tmp_path, KB_ALIAS_PATH)
+
+
+@contextmanager
+def swap_lock(exclusive=False):
+    """
+    跨进程的版本切换锁（vector_store.file_lock，锁文件在 KB_VERSIONS_DIR 中）：批量导入每个任务写入期间持有共享锁，
+    build_version 补齐批量导入的片段、校验并切换别名期间持有排他锁，切换前后的导入不会写进即将被替换的版本
+    """
+    os.makedirs(KB_VERSIONS_DIR, exist_ok=True)
+    with file_lock(os.path.join(KB_VERSIONS_DIR, "swap.lock"), exclusive=exclusive):
+        yield
+
+
+def list_versions():
+    """已构建的版本，按版本号升序"""
+    try:
+        names = os.listdir(KB_VERSIONS_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted((name for name in names if _VERSION_RE.match(name)), key=version_number)
+
+
+def next_version_name():
+    versions = list_versions()
+    return version_name(version_number(versions[-1]) + 1 if versions else 1)
+
+
+def activate(name):
+    """把别名指向 name，原来的版本记为 previous 以便回滚"""
+    if name != KB_BASE_NAME and name not in list_versions():
+        raise ValueError(f"版本 {name} 不存在")
+    alias = read_alias()
+    if alias["active"] != name:
+        _write_alias(name, alias["active"])
+
+
+def rollback():
+    """切回上一个版本，返回切换后的版本名"""
+    alias = read_alias()
+    previous = alias.get("previous")
+    if not previous or (previous != KB_BASE_NAME and previous not in list_versions()):
+        raise ValueError("没有可回滚的版本")
+    _write_alias(previous, alias["active"])
+    return previous
+
+
+def drop_version(name):
+    shutil.rmtree(version_path(name), ignore_errors=True)
+    _clients.pop(version_path(name), None)
+    try:
+        os.remove(bm25_path(name))
+    except FileNotFoundError:
+        pass
+
+
+def gc(keep=KB_KEEP_VERSIONS):
+    """
+    删除旧版本，保留当前版本、别名中的 previous 以及最近的 keep 个旧版本；
+    版本号大于当前版本的可能正在构建，不会删除。原有的 kb_store 集合不在此管理
+
+    Returns:
+        被删除的版本名列表
+    """
+    alias = read_alias()
+    active = version_number(alias["active"])
+    older = [name for name in list_versions() if version_number(name) < active]
+    protected = set(older[-keep:] if keep > 0 else []) | {alias.get("previous")}
+    removed = [name for name in older if name not in protected]
+    for name in removed:
+        drop_version(name)
+    return removed
+
+
+def validate_version(collection, expected_count, dim, active_count=0):
+    """
+    切换前校验新版本
+
+    Args:
+        expected_count: 构建时写入的片段数
+        dim: 服务端嵌入模型的向量维度，降维存储时为降维后的维度
+        active_count: 当前版本的片段数
+
+    Returns:
+        错误信息列表，为空表示通过
+    """
+    errors = []
+    count = collection.count()
+    if count == 0:
+        return ["新版本没有任何片段"]
+    if count != expected_count:
+        errors.append(f"片段数 {count} 与写入数 {expected_count} 不一致")
+    if active_count and count < active_count * KB_MIN_COUNT_RATIO:
+        errors.append(f"片段数 {count} 不足当前版本 {active_count} 的 {KB_MIN_COUNT_RATIO:.0%}")
+
+    sample = collection.get(limit=KB_VALIDATE_SAMPLES, include=["embeddings"])
+    if len(sample["embeddings"][0]) != dim:
+        errors.append(f"向量维度 {len(sample['embeddings'][0])} 与嵌入模型 {dim} 不一致")
+        return errors
+    # 用片段自身的向量检索，检查向量与 id 的对应关系和索引是否可用
+    found = 0
+    for chunk_id, emb in zip(sample["ids"], sample["embeddings"]):
+        result = collection.query(query_embeddings=np.asarray([emb], dtype=np.float32), n_results=1)
+        found += bool(result["ids"][0]) and result["ids"][0][0] == chunk_id
+    recall = found / len(sample["ids"])
+    if recall < KB_MIN_SELF_RECALL:
+        errors.append(f"抽样自检索命中率 {recall:.0%} 低于 {KB_MIN_SELF_RECALL:.0%}")
+    return errors
+
+
+class ActiveCollection:
+    """
+    服务端持有的当前版本指针：定期检查别名文件，切换到新激活的版本；
+    其余属性和方法都转发给当前版本的 Chroma 集合，检索代码无需感知版本。
+    构建新版本时读取的始终是完整的旧版本，切换只是替换一个引用。
+    同时检查当前版本的内容代数，其他 worker（或 index_kb 增量索引）修改了当前版本时同样通知
+    """
+
+    def __init__(self, on_switch=None):
+        """
+        Args:
+            on_switch: 切换版本或当前版本内容变化后调用，例如清空语义回答缓存
+        """
+        self.on_switch = on_switch
+        self.switches = 0
+        self.content_changes = 0
+        self.generation = 0
+        self._collection = None
+        self._mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._refresh()
+
+    @property
+    def version(self):
+        """当前版本名和内容代数，各 worker 一致"""
+        return f"{self.current().name}@{self.generation}"
+
+    def refresh(self):
+        """立即检查别名和内容代数，不等 KB_ALIAS_CHECK_SECONDS"""
+        self._refresh()
+
+    def mark_changed(self):
+        """本进程修改了当前版本的内容：递增内容代数，其他 worker 检查时发现变化"""
+        with self._lock:
+            self.generation = bump_generation(self._collection.name)
+        self.content_changes += 1
+        if self.on_switch is not None:
+            self.on_switch()
+
+    def current(self):
+        if time.monotonic() - self._checked >= KB_ALIAS_CHECK_SECONDS:
+            self._refresh()
+        return self._collection
+
+    def _refresh(self):
+        with self._lock:
+            self._checked = time.monotonic()
+            switched = self._switch()
+            if self._collection is None:
+                return
+            generation = read_generation(self._collection.name)
+            changed = not switched and generation != self.generation
+            self.generation = generation
+        if switched:
+            self.switches += 1
+            logger.info("知识库已切换到 %s", self._collection.name)
+        elif changed:
+            self.content_changes += 1
+            # 其他进程写入了当前版本，分片存储重新读取各领域的片段数
+            refresh_counts = getattr(self._collection, "refresh_counts", None)
+            if refresh_counts is not None:
+                refresh_counts()
+        if (switched or changed) and self.on_switch is not None:
+            self.on_switch()
+
+    def _switch(self):
+        """别名指向的版本变化时打开新版本，返回是否切换；调用方需持有锁"""
+        try:
+            mtime = os.path.getmtime(KB_ALIAS_PATH)
+        except OSError:
+            mtime = None
+        if self._collection is not None and mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        name = read_alias()["active"]
+        if self._collection is not None and name == self._collection.name:
+            return False
+        try:
+            # 首次打开时允许创建（全新部署），切换时目标版本必须已存在
+            collection = open_collection(name, create=self._collection is None)
+        except Exception:
+            logger.exception("切换知识库版本 %s 失败，继续使用当前版本", name)
+            return False
+        switched = self._collection is not None
+        self._collection = collection
+        return switched
+
+    def __getattr__(self, attr):
+        return getattr(self.current(), attr)
+
+    def stats(self):
+        alias = read_alias()
+        current = self.current()
+        return {
+            "active": current.name,
+            "previous": alias.get("previous"),
+            "versions": list_versions(),
+            "switches": self.switches,
+            "generation": self.generation,
+            "content_changes": self.content_changes,
+            "store": current.stats(),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="管理知识库版本")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="列出全部版本")
+    sub.add_parser("rollback", help="切回上一个版本")
+    sub.add_parser("gc", help="删除多余的旧版本")
+    activate_parser = sub.add_parser("activate", help="切换到指定版本")
+    activate_parser.add_argument("name")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        alias = read_alias()
+        names = list_versions()
+        if KB_BASE_NAME in (alias["active"], alias.get("previous")):
+            names.insert(0, KB_BASE_NAME)
+        for name in names:
+            mark = "*" if name == alias["active"] else " "
+            print(f"{mark} {name}")
+    elif args.command == "rollback":
+        print(f"已回滚到 {rollback()}")
+    elif args.command == "gc":
+        print(f"已删除 {gc() or '无'}")
+    elif args.command == "activate":
+        activate(args.name)
+        print(f"已切换到 {args.name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,130 +1,827 @@
-from fastapi import FastAPI
-from pydantic import BaseModel
-import chromadb
-from sentence_transformers import SentenceTransformer
-from app.ollama_client import generate_response
-from fastapi.middleware.cors import CORSMiddleware
-
-app = FastAPI()
-
-# 添加CORS中间件以允许跨域请求
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # 允许所有来源，生产环境中应该限制
-    allow_credentials=True,
-    allow_methods=["*"],  # 允许所有方法
-    allow_headers=["*"],  # 允许所有头
-)
-
-# 新版 Chroma 初始化：PersistentClient
-client = chromadb.PersistentClient(path="./chroma_db")
-collection = client.get_or_create_collection("kb_store")
-
-# 初始化 embedding 模型
-embed_model = SentenceTransformer("all-MiniLM-L6-v2")
-
-# 请求模型
-class ChatRequest(BaseModel):
-    user_id: str
-    query: str
-
-class KnowledgeRequest(BaseModel):
-    query: str
-    limit: int = 3
-
-@app.get("/")
-async def root():
-    return {"message": "欢迎使用智能服务API"}
-
-@app.get("/api/status")
-async def get_status():
-    return {
-        "success": True,
-        "status": "running",
-        "model": "deepseek-r1:7b",
-        "datetime": "",  # 可以添加服务器时间
-    }
-
-@app.post("/chat")
-async def chat(req: ChatRequest):
-    # 生成 query embedding
-    q_emb = embed_model.encode([req.query]).tolist()[0]
-    
-    # 检索最近的知识片段
-    result = collection.query(query_embeddings=[q_emb], n_results=3)
-    
-    # 打印检索结果
-    print("Raw query result:", result)
-
-    # 安全获取检索到的文档
-    if result["documents"] and result["documents"][0]:
-        docs = result["documents"][0]
-    else:
-        docs = []
-
-    print("Docs to use as context:", docs)
-
-    context = "\n".join(docs) if docs else "无相关背景知识"
-
-    # 构建 prompt
-    prompt = f"""
-以下是背景知识：
-{context}
-
-请根据背景知识回答：
-{req.query}
-"""
-    # 调用 Ollama 生成回答
-    answer = generate_response(prompt)
-    return {"answer": answer, "docs": docs}
-
-@app.post("/api/chat/ask")
-async def api_chat(req: ChatRequest):
-    # 复用现有的chat功能
-    result = await chat(req)
-    
-    # 返回适配前端的格式
-    return {
-        "success": True,
-        "answer": result["answer"],
-        "used_knowledge": len(result.get("docs", [])) > 0,
-        "knowledge_items": result.get("docs", []),
-        "processing_time": 0  # 可以添加处理时间计算
-    }
-
-@app.post("/api/knowledge/search")
-async def search_knowledge(req: KnowledgeRequest):
-    # 生成 query embedding
-    q_emb = embed_model.encode([req.query]).tolist()[0]
-    
-    # 检索知识片段
-    result = collection.query(query_embeddings=[q_emb], n_results=req.limit)
-    
-    # 构造返回结果
-    items = []
-    if result["documents"] and result["documents"][0]:
-        for i, doc in enumerate(result["documents"][0]):
-            items.append({
-                "id": result["ids"][0][i] if result["ids"] and result["ids"][0] else f"item_{i}",
-                "content": doc,
-                "metadata": result["metadatas"][0][i] if result["metadatas"] and result["metadatas"][0] else {}
-            })
-    
-    return {
-        "success": True,
-        "results": items,
-        "count": len(items)
-    }
-
-@app.get("/api/knowledge/stats")
-async def get_knowledge_stats():
-    # 获取知识库统计信息
-    count = collection.count()
-    
-    return {
-        "success": True,
-        "count": count,
-        "domains": []  # 可以添加领域分类统计
-    }
-
-
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import List, Literal, Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+from pydantic import BaseModel
+from app.ollama_client import (
+    GenerationFailed, ModelNotFound, OllamaUnavailable, backend_pool, eval_stats, generate_response_async,
+    is_error_response,
+    stream_generate_async,
+)
+from app.answer_cache import SemanticCache
+from app.embeddings import get_embedding_backend
+from app.retrieval import HybridRetriever
+from app.context_builder import build_context
+from app.faq_tier import FAQTier
+from app.scheduler import GenerationScheduler, SchedulerRejected, GEN_DEFAULT_TIMEOUT
+from app.singleflight import Flight, SingleFlight, StreamBuffer, flight_key, run_with_relay
+from app.think_filter import ThinkFilter
+from app.cancellation import (
+    ClientDisconnected, DeadlineExceeded, cancel_on_disconnect, time_left, with_deadline,
+)
+from app.metrics import (
+    REGISTRY, ERRORS, TIMEOUTS, Counter as MetricCounter, Gauge, Histogram, MetricsMiddleware, RequestTimings,
+    log_request,
+)
+from app.warmup import Readiness
+from app.sessions import SESSIONS_ENABLED, SessionStore
+from app.router import DEFAULT_TIER, ModelRouter
+from app.ingest import INGEST_MAX_BYTES, IngestWorker
+from app.kb_versions import ActiveCollection, swap_lock, version_number
+from app.precompute import PRECOMPUTE_ENABLED, PrecomputedAnswers, PrecomputeWorker, QueryLog
+from app.query_log import QueryLogWriter
+from app.responses import (
+    STATS_CACHE_SECONDS, STATUS_CACHE_SECONDS, CompressionMiddleware, FastJSONResponse, cached_json, dumps,
+    select_fields, snippet,
+)
+from fastapi.middleware.cors import CORSMiddleware
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+# 就绪状态：预热完成前和排空期间 /ready 返回 503
+readiness = Readiness()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    readiness.install_drain_handler()
+    # 定期检查各 Ollama 后端的健康状态和已加载的模型
+    health_task = asyncio.create_task(ollama_backends.run_health_checks())
+    # 预热在后台执行，期间服务已可接受请求，/ready 返回 503
+    warmup_task = asyncio.create_task(readiness.run_warmup(embed_model, scheduler))
+    # 空闲时为热门问题预生成回答
+    precompute_task = asyncio.create_task(precompute.run()) if PRECOMPUTE_ENABLED else None
+    yield
+    readiness.draining = True
+    warmup_task.cancel()
+    if precompute_task is not None:
+        precompute_task.cancel()
+    health_task.cancel()
+    await ollama_backends.close()
+    await run_in_threadpool(query_log_writer.close)
+
+# 默认用 orjson 序列化响应；热点接口直接返回 FastJSONResponse，跳过 jsonable_encoder
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+
+# 添加CORS中间件以允许跨域请求
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],  # 允许所有来源，生产环境中应该限制
+    allow_credentials=True,
+    allow_methods=["*"],  # 允许所有方法
+    allow_headers=["*"],  # 允许所有头
+)
+
+# 较大的非流式响应按 Accept-Encoding 用 brotli / gzip 压缩
+app.add_middleware(CompressionMiddleware)
+
+# 记录各阶段耗时并写入 Server-Timing 响应头；在压缩之外，记录的响应体大小为实际传输的字节数
+app.add_middleware(MetricsMiddleware)
+
+def on_kb_change():
+    # 知识库内容变化：清空语义回答缓存（缓存按片段 id 匹配，同 id 的内容可能已变化），
+    # 预生成的回答失效，空闲时按新内容重新生成
+    answer_cache.clear()
+    precomputed.invalidate()
+
+# 知识库当前版本：index_kb --new-version 构建并切换别名后自动改用新版本；
+# 别名切换和当前版本的内容代数变化（任一 worker 的批量导入、index_kb 增量索引）都会在各 worker 中调用 on_kb_change
+collection = ActiveCollection(on_switch=lambda: on_kb_change())
+
+# 初始化 embedding 模型，后端由 EMBED_BACKEND 选择（torch / onnx）
+embed_model = get_embedding_backend()
+
+# 第 0 层：精选 FAQ 高置信度命中时直接回答
+faq_tier = FAQTier()
+
+# LLM 生成准入控制：限制并发，超出的请求按优先级排队
+scheduler = GenerationScheduler()
+
+# Ollama 后端池：OLLAMA_BACKENDS 中的多个实例按进行中的请求数和已加载的模型分配，失败的实例熔断
+ollama_backends = backend_pool()
+
+# 相同问题 + 相同背景知识的并发请求合并为一次生成
+inflight = SingleFlight()
+
+# 各层回答的请求数：faq（精选 FAQ）、precomputed（空闲时预生成的热门问题回答）、cache（语义缓存）、
+# llm（检索 + 生成）、shared（与其他进行中的相同请求共享生成结果）
+tier_counts = Counter()
+
+# 语义回答缓存：相近问题且检索到相同文档时跳过 LLM 生成
+answer_cache = SemanticCache()
+
+# 模型路由：简单问题交给小模型，比较、投诉等复杂问题交给推理模型
+router = ModelRouter()
+
+# 多轮会话：按 user_id 保存最近的问答和 Ollama context，追问时只需评估新增的 token
+sessions = SessionStore()
+
+# 混合检索：BM25 词法检索 + 向量检索，RRF 融合
+retriever = HybridRetriever(collection, embed_model)
+
+# 批量导入：上传的文档在后台线程中切分、encode 并写入 Chroma，有生成进行中时让出 CPU；
+# 知识库变化后递增当前版本的内容代数，各 worker 清空语义回答缓存和预生成的回答，避免返回基于旧内容的回答
+# 构建新版本切换别名期间导入等待切换完成，之后写入新版本
+ingest = IngestWorker(collection, embed_model, should_yield=lambda: scheduler.active > 0,
+                      on_change=collection.mark_changed, swap_lock=swap_lock)
+
+# 热门问题预生成：按滚动窗口内的问题频次，在没有生成任务时为最热门的问题生成回答，
+# 按知识库版本保存；高峰期的相同问题直接返回，生成负载移到空闲时段
+query_log = QueryLog()
+# 每个问题的归一化问法、回答层级、分数、各阶段耗时等写入 JSONL 查询日志，由后台线程落盘，
+# 供 python -m app.query_report 离线分析
+query_log_writer = QueryLogWriter()
+precomputed = PrecomputedAnswers(kb_version=lambda: collection.version)
+precompute = PrecomputeWorker(query_log, precomputed, lambda query: precompute_answer(query), scheduler,
+                              ready=lambda: readiness.ready)
+
+# 在 /metrics 抓取时读取各组件的实时状态
+Gauge("ollama_server_ready", "预热完成且未在排空时为 1", lambda: int(readiness.ready))
+Gauge("ollama_server_generations_in_flight", "正在进行的 LLM 生成数", lambda: scheduler.active)
+Gauge("ollama_server_generation_queue_depth", "等待生成名额的请求数", lambda: scheduler.queue_depth)
+Gauge("ollama_server_singleflight_in_flight", "进行中的合并生成数", lambda: inflight.in_flight)
+Gauge("ollama_server_generations_saved_total", "因合并相同请求省下的生成次数",
+      lambda: inflight.saved, kind="counter")
+Gauge("ollama_server_answers_total", "各层回答的请求数",
+      lambda: {(tier,): tier_counts[tier] for tier in ("faq", "precomputed", "cache", "llm", "shared")},
+      labelnames=("tier",), kind="counter")
+Gauge("ollama_server_route_decisions_total", "各模型档位的路由次数",
+      lambda: {key: count for key, count in router.decisions.items()},
+      labelnames=("tier", "reason"), kind="counter")
+Gauge("ollama_server_backend_outstanding", "各 Ollama 后端进行中的生成请求数",
+      lambda: {(b.url,): b.outstanding for b in ollama_backends.backends}, labelnames=("backend",))
+Gauge("ollama_server_backend_up", "健康检查通过且未熔断的 Ollama 后端为 1",
+      lambda: {(s["url"],): int(s["healthy"] and s["state"] != "open") for s in ollama_backends.stats()["backends"]},
+      labelnames=("backend",))
+Gauge("ollama_server_backend_circuit_open", "熔断中（含等待试探结果）的 Ollama 后端为 1",
+      lambda: {(s["url"],): int(s["state"] != "closed") for s in ollama_backends.stats()["backends"]},
+      labelnames=("backend",))
+Gauge("ollama_server_kb_version", "当前知识库版本号，0 为未版本化的 kb_store", lambda: version_number(collection.name))
+Gauge("ollama_server_ingest_jobs_queued", "排队中的批量导入任务数", lambda: ingest.stats()["queued"])
+Gauge("ollama_server_ingest_chunks_total", "批量导入写入的片段数", lambda: ingest.chunks_embedded, kind="counter")
+Gauge("ollama_server_sessions", "保留的多轮会话数", lambda: sessions.stats()["sessions"])
+Gauge("ollama_server_answer_cache_hit_ratio", "语义回答缓存命中率", lambda: answer_cache.stats()["hit_ratio"])
+Gauge("ollama_server_precomputed_hit_ratio", "查找预生成回答的请求中命中的占比",
+      lambda: precomputed.stats()["hit_ratio"])
+Gauge("ollama_server_precomputed_generations_total", "空闲时预生成的回答数",
+      lambda: precompute.generated, kind="counter")
+Gauge("ollama_server_faq_hit_ratio", "由精选 FAQ 直接回答的请求占比",
+      lambda: round(tier_counts["faq"] / max(1, sum(tier_counts.values())), 4))
+Gauge("ollama_server_llm_calls_avoided_ratio", "未调用 LLM 的请求占比",
+      lambda: get_tier_stats()["llm_calls_avoided_ratio"])
+# 每次生成需要评估的 prompt token 数，mode 为 context（复用上一轮 context）、
+# history（以文本重建历史）或 new（无历史）
+PROMPT_EVAL_TOKENS = Histogram(
+    "ollama_server_prompt_eval_tokens", "每次生成评估的 prompt token 数", labelnames=("mode",),
+    buckets=(16, 32, 64, 128, 256, 512, 1024, 2048, 4096),
+)
+# 各模型档位的生成耗时，_count 即各档位的生成次数
+ROUTE_GENERATION_SECONDS = Histogram(
+    "ollama_server_route_generation_seconds", "各模型档位的生成耗时（秒）", labelnames=("tier", "model"),
+)
+
+# 从请求到达到第一个可见（非推理）token 的时间，reasoning 为请求的推理模式
+FIRST_VISIBLE_TOKEN_SECONDS = Histogram(
+    "ollama_server_first_visible_token_seconds", "请求到达至第一个可见 token 的时间（秒）",
+    labelnames=("reasoning",),
+)
+# 推理内容的字符数：suppressed 为过滤掉未返回的，shown 为 reasoning=show 时原样返回的
+REASONING_CHARS = MetricCounter(
+    "ollama_server_reasoning_chars_total", "推理内容的字符数", labelnames=("action",),
+)
+REASONING_CAPPED = MetricCounter(
+    "ollama_server_reasoning_capped_total", "推理超过长度上限、改为直接回答的生成数",
+)
+
+# 拼入 prompt 的知识片段数上限
+CHAT_TOP_K = int(os.environ.get("CHAT_TOP_K", "3"))
+# 检索的候选片段数，由 context builder 去重、裁剪后选出 CHAT_TOP_K 个
+CHAT_CANDIDATES = int(os.environ.get("CHAT_CANDIDATES", "6"))
+
+# 请求模型
+class ChatRequest(BaseModel):
+    user_id: str
+    query: str
+    # interactive 为交互式对话，batch 为批量任务，排队时交互式优先
+    priority: Literal["interactive", "batch"] = "interactive"
+    # 请求截止时间（秒），排队超过该时间直接返回 503
+    timeout: Optional[float] = None
+    # 推理过程：hide 生成但不返回 <think> 中的推理内容，skip 要求模型不做推理直接回答，show 原样返回
+    reasoning: Literal["hide", "skip", "show"] = "hide"
+    # 推理内容的最长字符数，超过后停止推理、改为直接回答
+    max_reasoning_chars: Optional[int] = None
+    # 只返回列出的顶层字段，如 ["answer", "doc_ids", "snippets"]；snippets 为各文档的前缀，为空时返回全部字段
+    fields: Optional[List[str]] = None
+
+# 知识库搜索结果中每条可返回的字段，snippet 为 content 的前缀
+SEARCH_ITEM_FIELDS = ("id", "content", "snippet", "metadata", "score")
+
+class KnowledgeRequest(BaseModel):
+    query: str
+    limit: int = 3
+    # 每条结果返回的字段，默认为 id、content 和 metadata；移动端只需 ["id", "snippet"]
+    fields: Optional[List[Literal[SEARCH_ITEM_FIELDS]]] = None
+
+@app.exception_handler(SchedulerRejected)
+async def scheduler_rejected_handler(request: Request, exc: SchedulerRejected):
+    # 队列已满返回 429，排队超时返回 503，均带 Retry-After
+    if exc.reason == "queue_timeout":
+        TIMEOUTS.inc(reason=exc.reason)
+    else:
+        ERRORS.inc(path=request.url.path, reason=exc.reason)
+    log_request({"event": "rejected", "path": request.url.path, "reason": exc.reason}, force=True)
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"success": False, "error": exc.reason, "retry_after": exc.retry_after},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    TIMEOUTS.inc(reason="deadline_exceeded")
+    log_request({"event": "deadline_exceeded", "path": request.url.path,
+                 "stages": _timings(request).stages}, force=True)
+    return JSONResponse(status_code=504, content={"success": False, "error": "deadline_exceeded"})
+
+@app.exception_handler(ClientDisconnected)
+async def client_disconnected_handler(request: Request, exc: ClientDisconnected):
+    # 客户端已断开，响应不会被读取，仅用于访问日志
+    ERRORS.inc(path=request.url.path, reason="client_disconnected")
+    return JSONResponse(status_code=499, content={"success": False, "error": "client_disconnected"})
+
+def _timings(request: Request):
+    # MetricsMiddleware 为每个请求创建 RequestTimings
+    timings = getattr(request.state, "timings", None)
+    return timings if timings is not None else RequestTimings()
+
+@app.get("/")
+async def root():
+    return {"message": "欢迎使用智能服务API"}
+
+@app.get("/api/status")
+async def get_status(request: Request):
+    # 内容包含当前时间和实时计数，每次都不同，ETag 永远不会命中，只保留短时间的 Cache-Control
+    return cached_json(request, {
+        "success": True,
+        "status": "running",
+        "model": "deepseek-r1:7b",
+        "datetime": datetime.now().isoformat(timespec="seconds"),
+        "answer_cache": answer_cache.stats(),
+        "faq_tier": faq_tier.stats(),
+        "tiers": get_tier_stats(),
+        "scheduler": scheduler.stats(),
+        "singleflight": inflight.stats(),
+        "sessions": sessions.stats(),
+        "routing": router.stats(),
+        "ollama_backends": ollama_backends.stats(),
+        "readiness": readiness.stats(),
+        "ingest": ingest.stats(),
+        "precompute": precompute.stats(),
+        "query_log": query_log_writer.stats(),
+        "knowledge_base": collection.stats(),
+    }, STATUS_CACHE_SECONDS, etag=False)
+
+@app.get("/ready")
+async def ready():
+    # 供负载均衡 / 编排系统判断是否转发流量
+    return JSONResponse(status_code=200 if readiness.ready else 503, content=readiness.stats())
+
+@app.get("/metrics")
+async def metrics():
+    # Prometheus 文本格式
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def get_tier_stats():
+    total = sum(tier_counts.values())
+    avoided = tier_counts["faq"] + tier_counts["precomputed"] + tier_counts["cache"] + tier_counts["shared"]
+    return {
+        "faq": tier_counts["faq"],
+        "precomputed": tier_counts["precomputed"],
+        "cache": tier_counts["cache"],
+        "llm": tier_counts["llm"],
+        "shared": tier_counts["shared"],
+        # 未调用 LLM 的请求占比
+        "llm_calls_avoided_ratio": round(avoided / total, 4) if total else 0.0,
+    }
+
+@app.post("/chat")
+async def chat(req: ChatRequest, request: Request):
+    return FastJSONResponse(select_fields(await _answer(req, request), req.fields))
+
+async def _answer(req: ChatRequest, request: Request):
+    # 截止时间从请求到达时开始计算，贯穿检索、排队和生成
+    deadline = time.monotonic() + (req.timeout or GEN_DEFAULT_TIMEOUT)
+    # 客户端断开时取消整个处理过程，释放生成名额
+    return await cancel_on_disconnect(request, answer_query(req, deadline, _timings(request)))
+
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest, request: Request):
+    """
+    流式聊天，返回 NDJSON：每行 {"delta": ...} 是一段可见的回答（推理内容已过滤），
+    最后一行 {"done": true, ...} 给出回答层级、路由和生成统计。
+    相同问题的并发流式请求共享同一个生成的输出流
+    """
+    deadline = time.monotonic() + (req.timeout or GEN_DEFAULT_TIMEOUT)
+    queue = asyncio.Queue()
+    task = asyncio.ensure_future(answer_query(req, deadline, _timings(request), on_delta=queue.put_nowait))
+    getter = asyncio.ensure_future(queue.get())
+
+    async def first_event():
+        await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+
+    # 等到第一段输出或处理结束后才开始响应，准入拒绝、超时等错误仍以对应的状态码返回
+    try:
+        await cancel_on_disconnect(request, first_event())
+    except BaseException:
+        task.cancel()
+        getter.cancel()
+        raise
+    first = None
+    if getter.done():
+        first = getter.result()
+    else:
+        getter.cancel()
+        task.result()
+    return StreamingResponse(_stream_events(task, queue, first), media_type="application/x-ndjson")
+
+async def _stream_events(task, queue, first):
+    def line(event):
+        return dumps(event) + b"\n"
+
+    streamed = first is not None
+    try:
+        if first is not None:
+            yield line({"delta": first})
+        while True:
+            getter = asyncio.ensure_future(queue.get())
+            await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                getter.cancel()
+                break
+            streamed = True
+            yield line({"delta": getter.result()})
+        while not queue.empty():
+            streamed = True
+            yield line({"delta": queue.get_nowait()})
+
+        try:
+            result = task.result()
+        except DeadlineExceeded:
+            TIMEOUTS.inc(reason="deadline_exceeded")
+            yield line({"done": True, "error": "deadline_exceeded"})
+            return
+        except SchedulerRejected as e:
+            yield line({"done": True, "error": e.reason})
+            return
+        if not streamed:
+            # FAQ、缓存命中等非流式的回答一次性输出
+            yield line({"delta": result["answer"]})
+        yield line({
+            "done": True,
+            "tier": result["tier"],
+            "cached": result.get("cached", False),
+            "shared": result.get("shared", False),
+            "failed": result.get("failed", False),
+            "route": result.get("route"),
+            "generation": result.get("generation"),
+            "knowledge_items": len(result.get("docs", [])),
+        })
+    finally:
+        # 客户端断开时响应被中止，取消仍在进行的处理
+        task.cancel()
+
+async def answer_query(req: ChatRequest, deadline: float, timings: RequestTimings, on_delta=None):
+    """
+    Args:
+        on_delta: 流式输出回调，LLM 生成时逐段收到可见的回答
+    """
+    # 同一 user_id 的多轮会话；没有历史时回答与用户无关，可以使用语义缓存和请求合并
+    session = sessions.get(req.user_id) if SESSIONS_ENABLED else None
+    fresh = session is None or session.is_fresh
+    # 追问依赖上一轮的问题，只统计独立的问题
+    if fresh:
+        query_log.record(req.query)
+
+    # 第 0 层：精选 FAQ 高置信度命中时直接返回，不做检索和生成
+    with timings.stage("faq"):
+        faq_match = await with_deadline(run_in_threadpool(faq_tier.analyze, req.query), deadline)
+    faq_hit = faq_tier.answer(faq_match)
+    faq_score = round(faq_match["score"], 4) if faq_match else None
+    if faq_hit is not None:
+        tier_counts["faq"] += 1
+        if session is not None:
+            sessions.record(session, req.query, faq_hit["answer"])
+        log_chat({"event": "chat", "tier": "faq", "query": req.query, "faq_id": faq_hit["id"],
+                  "faq_score": faq_score, "answer_chars": len(faq_hit["answer"])}, timings)
+        return {"answer": faq_hit["answer"], "docs": [faq_hit["answer"]], "doc_ids": [f"faq:{faq_hit['id']}"],
+                "cached": False, "tier": "faq", "faq": faq_hit, "context": None}
+
+    # 第 1 层：空闲时预生成的热门问题回答，知识库未变化时直接返回，不做检索和生成；
+    # 预生成的回答已过滤推理内容，要求原样返回推理过程时不使用
+    if fresh and req.reasoning != "show":
+        precomputed_result = precomputed.get(req.query)
+        if precomputed_result is not None:
+            tier_counts["precomputed"] += 1
+            if session is not None:
+                sessions.record(session, req.query, precomputed_result["answer"])
+            log_chat({"event": "chat", "tier": "precomputed", "query": req.query, "faq_score": faq_score,
+                      "used": precomputed_result["doc_ids"], "answer_chars": len(precomputed_result["answer"])},
+                     timings)
+            return dict(precomputed_result, cached=True, tier="precomputed")
+
+    # 追问（如“那利率呢”）检索时带上上一轮的问题
+    search_query = session.retrieval_query(req.query) if session is not None else req.query
+
+    # 混合检索最相关的知识片段，同时得到 query embedding
+    q_emb, hits = await with_deadline(
+        retriever.retrieve(search_query, n_results=CHAT_CANDIDATES, timings=timings), deadline
+    )
+
+    # 去重、裁剪并按 token 预算组装背景知识
+    with timings.stage("prompt_build"):
+        context, used_hits, context_stats = build_context(search_query, hits, max_chunks=CHAT_TOP_K)
+    docs = [hit["document"] for hit in used_hits]
+    used_ids = [hit["id"] for hit in used_hits]
+    doc_ids = [hit["id"] for hit in hits]
+
+    # 采样记录检索结果摘要，不输出完整文档
+    log_event = {
+        "event": "chat",
+        "query": req.query,
+        "faq_score": faq_score,
+        "hits": [{"id": hit["id"], "distance": hit["distance"], "score": round(hit["score"], 5)} for hit in hits],
+        "used": [hit["id"] for hit in used_hits],
+        "context": context_stats,
+    }
+
+    # 语义缓存命中时直接返回，不再调用 LLM；有历史的会话回答依赖上下文，不查缓存；
+    # 缓存中只有过滤掉推理内容的回答，要求原样返回推理过程时也不查缓存
+    use_cache = fresh and req.reasoning != "show"
+    cached_answer = answer_cache.get(q_emb, doc_ids) if use_cache else None
+    if cached_answer is not None:
+        tier_counts["cache"] += 1
+        if session is not None:
+            sessions.record(session, req.query, cached_answer)
+        log_chat(dict(log_event, tier="cache", answer_chars=len(cached_answer)), timings)
+        return {"answer": cached_answer, "docs": docs, "doc_ids": used_ids, "cached": True, "tier": "cache",
+                "context": context_stats}
+
+    # 构建 prompt
+    with timings.stage("prompt_build"):
+        prompt = build_prompt(context, req.query)
+    # 按问题难度、检索置信度和意图选择模型档位
+    route = router.route(req.query, faq_match, hits)
+
+    # 生成中的可见输出，流式请求和合并进来的相同请求都从这里读取
+    buffer = StreamBuffer()
+    # 排队和生成使用的截止时间与优先级；合并进来的请求更晚的截止时间、更高的优先级会更新到这里
+    flight = Flight(deadline, req.priority)
+
+    async def generate():
+        # 获取生成名额后调用 Ollama；任务被取消时子进程随之结束
+        try:
+            queued_at = time.perf_counter()
+            async with scheduler.slot(flight=flight):
+                timings.record("queue_wait", time.perf_counter() - queued_at)
+                started = time.perf_counter()
+                with timings.stage("generation"):
+                    result = await generate_in_session(
+                        session, prompt, route, timings, time_left(flight.deadline), buffer,
+                        reasoning=req.reasoning, max_reasoning_chars=req.max_reasoning_chars,
+                    )
+                elapsed = time.perf_counter() - started
+                router.observe(route["tier"], elapsed)
+                ROUTE_GENERATION_SECONDS.observe(elapsed, tier=route["tier"], model=route["model"])
+        finally:
+            buffer.close()
+        # 只缓存成功生成、且与会话历史无关的回答
+        if use_cache and not is_error_response(result[0]):
+            answer_cache.put(q_emb, doc_ids, result[0])
+        return result
+
+    try:
+        if fresh:
+            # 相同的进行中请求只生成一次，其余请求等待并共享结果（流式请求共享输出流）；
+            # 模型和推理模式不同时输出不同，不能合并
+            key = flight_key(req.query, f"{route['model']}|{req.reasoning}|{req.max_reasoning_chars}\n{context}")
+            result, shared = await inflight.do(
+                key, generate, timeout=time_left(deadline), buffer=buffer, on_delta=on_delta, flight=flight
+            )
+        else:
+            result = await asyncio.wait_for(run_with_relay(generate(), buffer, on_delta), time_left(deadline))
+            shared = False
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded() from None
+    answer, new_context, gen_stats = result
+    tier_counts["shared" if shared else "llm"] += 1
+    failed = is_error_response(answer)
+    if failed:
+        ERRORS.inc(path="/chat", reason="generation_failed")
+    elif session is not None:
+        sessions.record(session, req.query, answer, new_context, generated=True, tier=route["tier"])
+    route_info = {key: route[key] for key in ("tier", "model", "reason")}
+    log_chat(dict(log_event, tier="llm", shared=shared, answer_chars=len(answer), failed=failed,
+                  route=route_info, generation=gen_stats), timings, force=failed)
+    return {"answer": answer, "docs": docs, "doc_ids": used_ids, "cached": False, "tier": "llm", "shared": shared,
+            "failed": failed, "context": context_stats, "generation": gen_stats, "route": route_info}
+
+def log_chat(event: dict, timings: RequestTimings, force=False):
+    # 采样输出结构化日志，同时完整写入查询日志（不阻塞，由后台线程落盘）
+    event["stages"] = dict(timings.stages)
+    log_request(event, force=force)
+    query_log_writer.write(event, total_seconds=time.perf_counter() - timings.start)
+
+def build_prompt(context, query: str) -> str:
+    context = context or "无相关背景知识"
+    return f"""
+以下是背景知识：
+{context}
+
+请根据背景知识回答：
+{query}
+"""
+
+async def precompute_answer(query: str):
+    """
+    为热门问题预生成回答：检索、组装 prompt 和路由与 answer_query 相同，以 batch 优先级占用生成名额；
+    FAQ 可以直接回答或生成失败时返回 None
+    """
+    faq_match = await run_in_threadpool(faq_tier.analyze, query)
+    if faq_tier.answer(faq_match) is not None:
+        return None
+    timings = RequestTimings()
+    q_emb, hits = await retriever.retrieve(query, n_results=CHAT_CANDIDATES, timings=timings)
+    context, used_hits, context_stats = build_context(query, hits, max_chunks=CHAT_TOP_K)
+    route = router.route(query, faq_match, hits)
+    deadline = time.monotonic() + GEN_DEFAULT_TIMEOUT
+    buffer = StreamBuffer()
+    try:
+        async with scheduler.slot("batch", deadline):
+            answer, _, gen_stats = await generate_in_session(
+                None, build_prompt(context, query), route, timings, time_left(deadline), buffer
+            )
+    except SchedulerRejected:
+        return None
+    finally:
+        buffer.close()
+    if is_error_response(answer):
+        return None
+    # 同时写入语义缓存，问法相近的问题也能命中
+    answer_cache.put(q_emb, [hit["id"] for hit in hits], answer)
+    return {
+        "answer": answer,
+        "docs": [hit["document"] for hit in used_hits],
+        "doc_ids": [hit["id"] for hit in used_hits],
+        "context": context_stats,
+        "generation": gen_stats,
+        "route": {key: route[key] for key in ("tier", "model", "reason")},
+    }
+
+async def generate_in_session(session, prompt: str, route: dict, timings: RequestTimings, timeout: float,
+                              buffer: StreamBuffer, reasoning: str = "hide", max_reasoning_chars=None):
+    """
+    在会话中生成：有上一轮的 Ollama context 时只发送新的内容，否则以摘要和最近几轮对话重建历史；
+    Ollama HTTP API 不可用时退回命令行生成（没有 context 可复用，也无法流式输出）。
+    路由选中的模型尚未 pull 时改用默认档位，并就地更新 route
+
+    Returns:
+        (可见的回答, 新的 context 或 None, 生成统计)
+    """
+    if session is None:
+        answer = await generate_response_async(_reasoning_prompt(prompt, reasoning), timeout=timeout,
+                                                model=route["model"])
+        return _filter_whole(answer, reasoning, timings, buffer), None, {}
+
+    # context 只对生成它的模型有效，本轮换了档位时丢弃 context，以文本重建历史
+    if session.context is not None and session.tier != route["tier"]:
+        sessions.note_tier_switch()
+    full_prompt, context = session.build_prompt(prompt, tier=route["tier"])
+    mode = "context" if context is not None else ("new" if session.is_fresh else "history")
+    started = time.monotonic()
+    try:
+        answer, new_context, stats = await asyncio.wait_for(
+            stream_answer(full_prompt, context, route, timings, buffer, reasoning, max_reasoning_chars), timeout
+        )
+    except asyncio.TimeoutError:
+        return GenerationFailed("抱歉，调用 Ollama 超时。"), None, {}
+    except OllamaUnavailable:
+        if buffer.chunks:
+            return GenerationFailed("抱歉，与 Ollama 的连接中断。"), None, {}
+        full_prompt, _ = session.build_prompt(prompt, use_context=False)
+        answer = await generate_response_async(_reasoning_prompt(full_prompt, reasoning), timeout=timeout,
+                                                model=route["model"])
+        return _filter_whole(answer, reasoning, timings, buffer), None, {}
+    except ModelNotFound as e:
+        if route["tier"] == DEFAULT_TIER:
+            return GenerationFailed(f"抱歉，生成失败：{e}"), None, {}
+        router.mark_unavailable(route["tier"])
+        route.update(router.describe(DEFAULT_TIER, "fast_unavailable"))
+        return await generate_in_session(
+            session, prompt, route, timings, max(0.0, timeout - (time.monotonic() - started)), buffer,
+            reasoning=reasoning, max_reasoning_chars=max_reasoning_chars,
+        )
+
+    if "prompt_eval_count" in stats:
+        stats["mode"] = mode
+        PROMPT_EVAL_TOKENS.observe(stats["prompt_eval_count"], mode=mode)
+        timings.record("prompt_eval", stats["prompt_eval_seconds"])
+        if mode == "context":
+            sessions.note_context_reuse()
+    return answer, new_context, stats
+
+def _reasoning_prompt(prompt: str, reasoning: str) -> str:
+    # skip 模式通过 prompt 要求模型直接回答
+    if reasoning == "skip":
+        return prompt + "请直接给出简洁的回答，不要输出思考过程。\n"
+    return prompt
+
+def _filter_whole(answer: str, reasoning: str, timings: RequestTimings, buffer: StreamBuffer) -> str:
+    if is_error_response(answer):
+        # 错误提示原样输出，保留 GenerationFailed 类型供调用方判断
+        buffer.publish(answer)
+        return answer
+    # 命令行生成只能在结束后一次性过滤；整段过滤时暂存没有延迟，模板打开的 <think> 同样能识别
+    think_filter = ThinkFilter(show=reasoning == "show", hold=True)
+    visible = (think_filter.feed(answer) + think_filter.finish()).strip()
+    _count_reasoning(think_filter, reasoning)
+    if visible:
+        FIRST_VISIBLE_TOKEN_SECONDS.observe(time.perf_counter() - timings.start, reasoning=reasoning)
+        buffer.publish(visible)
+    return visible
+
+def _count_reasoning(think_filter: ThinkFilter, reasoning: str):
+    if think_filter.reasoning_chars:
+        REASONING_CHARS.inc(think_filter.reasoning_chars, action="shown" if reasoning == "show" else "suppressed")
+
+async def stream_answer(prompt: str, context, route: dict, timings: RequestTimings, buffer: StreamBuffer,
+                        reasoning: str = "hide", max_reasoning_chars=None):
+    """
+    流式生成并过滤 <think> 推理内容，可见部分一出现就写入 buffer；
+    推理超过 max_reasoning_chars 仍未开始回答时停止本次生成，改为要求模型直接回答
+
+    Returns:
+        (可见的回答, 新的 context, 生成统计)
+    """
+    # skip 模式对推理模型同时通过 Ollama 的 think 参数关闭推理
+    think = False if reasoning == "skip" and route["tier"] == DEFAULT_TIER else None
+    # 推理模型的聊天模板可能已经打开了 <think>，见到第一个标签前暂存输出
+    think_filter = ThinkFilter(show=reasoning == "show", hold=route["tier"] == DEFAULT_TIER and think is not False)
+    parts = []
+    first_token = None
+    final = {}
+
+    def emit(text):
+        nonlocal first_token
+        if not text:
+            return
+        if first_token is None:
+            first_token = time.perf_counter() - timings.start
+            FIRST_VISIBLE_TOKEN_SECONDS.observe(first_token, reasoning=reasoning)
+        parts.append(text)
+        buffer.publish(text)
+
+    capped = False
+    async for chunk in stream_generate_async(_reasoning_prompt(prompt, reasoning), context, route["model"],
+                                             route["options"], think=think):
+        if chunk.get("error"):
+            return GenerationFailed(f"抱歉，生成失败。\n{chunk['error']}"), None, {}
+        # 较新的 Ollama 把推理内容放在单独的 thinking 字段，此时输出中不会再有标签
+        if chunk.get("thinking"):
+            think_filter.reasoning_chars += len(chunk["thinking"])
+            think_filter.release()
+        emit(think_filter.feed(chunk.get("response", "")))
+        if (max_reasoning_chars is not None and not think_filter.visible_chars
+                and think_filter.reasoning_chars + think_filter.held_chars > max_reasoning_chars):
+            # 暂存的内容没等到结束标签，按推理统计
+            think_filter.reasoning_chars += think_filter.held_chars
+            capped = True
+            break
+        if chunk.get("done"):
+            final = chunk
+    _count_reasoning(think_filter, reasoning)
+
+    if capped:
+        # 停止迭代时连接关闭，Ollama 停止这次生成
+        REASONING_CAPPED.inc()
+        answer, new_context, stats = await stream_answer(prompt, context, route, timings, buffer, reasoning="skip")
+        stats["reasoning_chars"] = think_filter.reasoning_chars + stats.get("reasoning_chars", 0)
+        stats["reasoning_capped"] = True
+        return answer, new_context, stats
+
+    emit(think_filter.finish())
+    stats = eval_stats(final)
+    stats.update({
+        "reasoning_chars": think_filter.reasoning_chars,
+        "first_token_seconds": round(first_token, 3) if first_token is not None else None,
+    })
+    return "".join(parts).strip(), final.get("context"), stats
+
+@app.post("/api/chat/ask")
+async def api_chat(req: ChatRequest, request: Request):
+    start_time = time.perf_counter()
+    # 复用现有的chat功能
+    result = await _answer(req, request)
+    
+    # 返回适配前端的格式
+    return FastJSONResponse(select_fields({
+        "success": True,
+        "answer": result["answer"],
+        "used_knowledge": len(result.get("docs", [])) > 0,
+        "knowledge_items": result.get("docs", []),
+        "knowledge_ids": result.get("doc_ids", []),
+        "cached": result.get("cached", False),
+        "tier": result["tier"],
+        "shared": result.get("shared", False),
+        "failed": result.get("failed", False),
+        "faq": result.get("faq"),
+        "context_tokens_saved": result["context"]["tokens_saved"] if result["context"] else 0,
+        "generation": result.get("generation"),
+        "processing_time": round(time.perf_counter() - start_time, 3)  # 单位：秒
+    }, req.fields, docs_key="knowledge_items"))
+
+@app.post("/api/knowledge/search")
+async def search_knowledge(req: KnowledgeRequest, request: Request):
+    # 混合检索知识片段
+    _, hits = await retriever.retrieve(req.query, n_results=req.limit, timings=_timings(request))
+    
+    # 构造返回结果，只包含请求的字段
+    fields = req.fields or ("id", "content", "metadata")
+    items = []
+    for hit in hits:
+        item = {
+            "id": hit["id"],
+            "content": hit["document"],
+            "snippet": snippet(hit["document"]),
+            "metadata": hit["metadata"] or {},
+            "score": round(hit["score"], 5),
+        }
+        items.append({key: item[key] for key in fields})
+    
+    return FastJSONResponse({
+        "success": True,
+        "results": items,
+        "count": len(items)
+    })
+
+@app.post("/api/knowledge/bulk", status_code=202)
+async def bulk_ingest(request: Request):
+    # 请求体为 NDJSON，每行一篇文档：{"source": "...", "text": "...", "metadata": {...}}
+    # 边接收边落盘，上传完成即返回任务 id，切分和 encode 在后台线程中进行
+    job = ingest.create_job()
+    try:
+        with open(job.spool_path, "wb") as f:
+            async for chunk in request.stream():
+                job.bytes_received += len(chunk)
+                if job.bytes_received > INGEST_MAX_BYTES:
+                    ingest.discard(job)
+                    return JSONResponse(status_code=413, content={"success": False, "error": "upload_too_large"})
+                f.write(chunk)
+    except ClientDisconnect:
+        ingest.discard(job)
+        raise ClientDisconnected()
+    ingest.submit(job)
+    return {
+        "success": True,
+        "job_id": job.id,
+        "status": job.status,
+        "bytes_received": job.bytes_received,
+        "status_url": f"/api/knowledge/jobs/{job.id}",
+    }
+
+@app.get("/api/knowledge/jobs/{job_id}")
+async def get_ingest_job(job_id: str):
+    job = ingest.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"success": False, "error": "job_not_found"})
+    return {"success": True, **job}
+
+@app.delete("/api/knowledge/sources/{source:path}")
+async def delete_source(source: str):
+    # 删除一篇文档的全部片段
+    deleted = await run_in_threadpool(ingest.delete_source, source)
+    if not deleted:
+        return JSONResponse(status_code=404, content={"success": False, "error": "source_not_found"})
+    return {"success": True, "source": source, "deleted": deleted}
+
+@app.get("/api/knowledge/stats")
+async def get_knowledge_stats(request: Request):
+    # 获取知识库统计信息；按领域分片存储时各领域的片段数来自缓存，不扫描数据
+    count = collection.count()
+    domain_counts = getattr(collection, "domain_counts", None)
+    domains = domain_counts() if domain_counts is not None else {}
+    
+    return cached_json(request, {
+        "success": True,
+        "count": count,
+        "domains": [{"domain": domain, "count": n} for domain, n in domains.items()]
+    }, STATS_CACHE_SECONDS)
+
+
@@ -0,0 +1,244 @@
+import bisect
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+# 结构化请求日志的采样率，错误请求总是记录
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.1"))
+
+# 延迟直方图的桶边界（秒），覆盖从毫秒级检索到分钟级生成
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+# 响应体大小直方图的桶边界（字节）
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+logger = logging.getLogger("ollama_server")
+
+
+def _format_labels(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in zip(labelnames, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Gauge(_Metric):
+    """数值由回调函数在抓取时计算，回调返回数值或 {标签值元组: 数值}"""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, fn, labelnames=(), registry=None, kind=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self._fn = fn
+        if kind:
+            self.kind = kind
+
+    def _samples(self):
+        value = self._fn()
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}"
+            for key, v in sorted(value.items())
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(buckets)
+        # 标签值元组 -> [各桶计数..., 总数, 总和]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            state[idx] += 1
+            state[-1] += value
+
+    def _samples(self):
+        lines = []
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames + ("le",), key + (_format_value(float(bound)),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-1])}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def render(self):
+        """Prometheus 文本格式"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = Histogram(
+    "ollama_server_stage_seconds", "各处理阶段耗时（秒）", labelnames=("stage",),
+)
+REQUESTS = Counter(
+    "ollama_server_requests_total", "HTTP 请求数", labelnames=("path", "status"),
+)
+ERRORS = Counter(
+    "ollama_server_errors_total", "处理出错的请求数", labelnames=("path", "reason"),
+)
+TIMEOUTS = Counter(
+    "ollama_server_timeouts_total", "超时的请求数", labelnames=("reason",),
+)
+RESPONSE_BYTES = Histogram(
+    "ollama_server_response_bytes", "响应体大小（字节）", labelnames=("path",), buckets=SIZE_BUCKETS,
+)
+
+
+class RequestTimings:
+    """记录单个请求各阶段耗时，同一阶段多次记录时累加"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+
+    def record(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+    def stage(self, name):
+        return _StageTimer(self, name)
+
+    def server_timing(self, total):
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+
+class _StageTimer:
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def log_request(event, sample_rate=LOG_SAMPLE_RATE, force=False):
+    """按采样率输出一行 JSON 结构化日志"""
+    if force or random.random() < sample_rate:
+        logger.info(json.dumps(event, ensure_ascii=False, default=str))
+
+
+class MetricsMiddleware:
+    """
+    纯 ASGI 中间件：为每个 HTTP 请求创建 RequestTimings（request.state.timings），
+    响应时写入 Server-Timing 头并记录总耗时、请求数和响应体大小（流式响应累计各段）
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        scope.setdefault("state", {})["timings"] = timings
+        status = {"code": 500}
+        body_bytes = 0
+
+        async def send_with_timing(message):
+            nonlocal body_bytes
+            if message["type"] == "http.response.body":
+                body_bytes += len(message.get("body", b""))
+            elif message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                total = time.perf_counter() - timings.start
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timings.server_timing(total).encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            timings.record("total", time.perf_counter() - timings.start)
+            # 以匹配到的路由模板（如 /api/knowledge/jobs/{job_id}）作为标签，避免路径参数导致标签基数失控；
+            # 未匹配路由的请求统一记为 unmatched
+            route = scope.get("route")
+            label = getattr(route, "path", None) or "unmatched"
+            REQUESTS.inc(path=label, status=status["code"])
+            RESPONSE_BYTES.observe(body_bytes, path=label)
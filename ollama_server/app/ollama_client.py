@@ -1,28 +1,213 @@
-import subprocess
-
-# 请用 ollama list 确认这个模型名
-MODEL_NAME = "deepseek-r1:7b"
-
-def generate_response(prompt: str) -> str:
-    cmd = ["ollama", "run", MODEL_NAME, prompt]
-    try:
-        # 明确把 stdout/stderr 都收集起来，指定 text=True 和 encoding='utf-8'
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            encoding="utf-8",     # 强制用 utf-8 解码，不走 GBK
-            timeout=60
-        )
-    except subprocess.TimeoutExpired:
-        return "抱歉，调用 Ollama 超时。"
-    except Exception as e:
-        return f"抱歉，调用 Ollama 出错：{e}"
-
-    if result.returncode != 0:
-        # 把 stderr 原样返回，便于排查
-        return f"抱歉，生成失败。\nOllama stderr:\n{result.stderr.strip()}"
-
-    # 走到这里，一定有 stdout，直接 strip 并返回
-    return result.stdout.strip()
+import asyncio
+import json
+import os
+import subprocess
+import time
+
+import httpx
+
+from app.backend_pool import BackendPool, ModelNotFound, OllamaUnavailable, normalize_host
+
+# 请用 ollama list 确认这个模型名
+MODEL_NAME = "deepseek-r1:7b"
+
+# ollama 可执行文件
+OLLAMA_BIN = "ollama"
+
+# Ollama HTTP API 地址，多轮会话需要通过 HTTP API 传递 context
+OLLAMA_HOST = normalize_host(os.environ.get("OLLAMA_HOST", "http://127.0.0.1:11434"))
+# 逗号分隔的多个 Ollama 地址，组成后端池按负载和已加载的模型分配请求；未设置时只使用 OLLAMA_HOST。
+# 设置后预热、预生成等非流式生成也通过 HTTP API 发往后端池，不再调用本机的 ollama 命令
+OLLAMA_BACKENDS = [host for host in os.environ.get("OLLAMA_BACKENDS", "").split(",") if host.strip()]
+
+# 单次生成的最长时间（秒）
+GENERATE_TIMEOUT = 60
+
+class GenerationFailed(str):
+    """
+    生成失败（超时、Ollama 出错、模型不存在等）时返回的提示文本，可以直接作为回答展示；
+    调用方按类型而不是文本内容判断，模型的正常回答以“抱歉，”开头也不会被当作失败
+    """
+
+def is_error_response(text: str) -> bool:
+    return isinstance(text, GenerationFailed)
+
+def generate_response(prompt: str) -> str:
+    cmd = [OLLAMA_BIN, "run", MODEL_NAME, prompt]
+    try:
+        # 明确把 stdout/stderr 都收集起来，指定 text=True 和 encoding='utf-8'
+        result = subprocess.run(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",     # 强制用 utf-8 解码，不走 GBK
+            timeout=GENERATE_TIMEOUT
+        )
+    except subprocess.TimeoutExpired:
+        return GenerationFailed("抱歉，调用 Ollama 超时。")
+    except Exception as e:
+        return GenerationFailed(f"抱歉，调用 Ollama 出错：{e}")
+
+    if result.returncode != 0:
+        # 把 stderr 原样返回，便于排查
+        return GenerationFailed(f"抱歉，生成失败。\nOllama stderr:\n{result.stderr.strip()}")
+
+    # 走到这里，一定有 stdout，直接 strip 并返回
+    return result.stdout.strip()
+
+async def generate_response_async(prompt: str, timeout: float = GENERATE_TIMEOUT, model: str = MODEL_NAME) -> str:
+    """
+    generate_response 的异步版本，可被取消：
+    任务被取消（客户端断开、截止时间已到）或超时时立即结束 ollama 子进程，释放模型。
+    配置了 OLLAMA_BACKENDS 时改为通过后端池生成，后端全部不可用时才退回本机的 ollama 命令
+    """
+    if OLLAMA_BACKENDS:
+        started = time.monotonic()
+        try:
+            return await asyncio.wait_for(_collect(prompt, model), timeout)
+        except asyncio.TimeoutError:
+            return GenerationFailed("抱歉，调用 Ollama 超时。")
+        except ModelNotFound as e:
+            return GenerationFailed(f"抱歉，生成失败：{e}")
+        except OllamaUnavailable:
+            timeout = max(0.0, timeout - (time.monotonic() - started))
+    return await _run_cli(prompt, timeout, model)
+
+async def _collect(prompt, model):
+    parts = []
+    async for chunk in stream_generate_async(prompt, model=model):
+        if chunk.get("error"):
+            return GenerationFailed(f"抱歉，生成失败。\n{chunk['error']}")
+        parts.append(chunk.get("response", ""))
+    return "".join(parts).strip()
+
+async def _run_cli(prompt, timeout, model):
+    cmd = [OLLAMA_BIN, "run", model, prompt]
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+    except Exception as e:
+        return GenerationFailed(f"抱歉，调用 Ollama 出错：{e}")
+
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        _kill(proc)
+        await proc.wait()
+        return GenerationFailed("抱歉，调用 Ollama 超时。")
+    except asyncio.CancelledError:
+        _kill(proc)
+        raise
+
+    if proc.returncode != 0:
+        # 把 stderr 原样返回，便于排查
+        stderr = stderr.decode("utf-8", errors="replace").strip()
+        return GenerationFailed(f"抱歉，生成失败。\nOllama stderr:\n{stderr}")
+
+    # 强制用 utf-8 解码，不走 GBK
+    return stdout.decode("utf-8", errors="replace").strip()
+
+def _kill(proc):
+    if proc.returncode is None:
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+
+_pool = None
+
+def backend_pool():
+    """全部 HTTP 生成共用的后端池，第一次使用时创建"""
+    global _pool
+    if _pool is None:
+        _pool = BackendPool(OLLAMA_BACKENDS or [OLLAMA_HOST])
+    return _pool
+
+def eval_stats(data):
+    """从 Ollama 最后一个响应片段中取出评估统计"""
+    return {
+        "prompt_eval_count": data.get("prompt_eval_count", 0),
+        "prompt_eval_seconds": round(data.get("prompt_eval_duration", 0) / 1e9, 4),
+        "eval_count": data.get("eval_count", 0),
+    }
+
+async def stream_generate_async(prompt: str, context=None, model: str = MODEL_NAME, options=None, think=None):
+    """
+    流式调用 Ollama HTTP API，逐个产出 Ollama 返回的 JSON 片段（response、thinking、done 等字段）。
+    最后一个片段 done 为 true，带有新的 context 和评估统计，可用 eval_stats 取出。
+    传入上一轮返回的 context 时，Ollama 直接复用其中的 token 状态，只需评估本轮新 prompt 的 token；
+    context 只对生成它的模型有效。调用方停止迭代或任务被取消时连接随之关闭，Ollama 停止生成
+
+    Args:
+        options: Ollama 生成参数，如 {"num_predict": 256, "stop": [...]}
+        think: 对推理模型传 False 时要求其不输出推理过程（需要较新版本的 Ollama）
+
+    请求由后端池分配给某个 Ollama 实例，开始输出之前失败（连接不上、5xx、该实例没有模型）时换一个实例重试
+
+    Raises:
+        OllamaUnavailable: 没有能连接上的后端，或输出中途连接中断；调用方可改用命令行生成
+        ModelNotFound: 所有可用的后端都没有该模型
+    """
+    payload = {"model": model, "prompt": prompt, "stream": True}
+    if context:
+        payload["context"] = list(context)
+    if options:
+        payload["options"] = options
+    if think is not None:
+        payload["think"] = think
+    pool = backend_pool()
+    tried = set()
+    not_found = False
+    last_error = None
+    while True:
+        # 收到第一个片段之前失败的请求换一个后端重试，每个后端最多一次
+        try:
+            backend = pool.acquire(model, exclude=tried)
+        except OllamaUnavailable:
+            if not_found:
+                raise ModelNotFound(model) from None
+            if last_error is not None:
+                yield {"error": last_error, "done": True}
+                return
+            raise
+        tried.add(backend.url)
+        outcome = "cancelled"
+        first_byte = None
+        started = time.perf_counter()
+        try:
+            async with backend.client.stream("POST", "/api/generate", json=payload) as resp:
+                if resp.status_code == 404:
+                    outcome, not_found = "not_found", True
+                    continue
+                if resp.status_code != 200:
+                    body = (await resp.aread()).decode("utf-8", errors="replace").strip()
+                    last_error = f"Ollama 返回 {resp.status_code}: {body}"
+                    if resp.status_code >= 500:
+                        outcome = "error"
+                        continue
+                    # 请求本身有误，换后端也不会成功
+                    outcome = "bad_request"
+                    yield {"error": last_error, "done": True}
+                    return
+                async for line in resp.aiter_lines():
+                    if not line.strip():
+                        continue
+                    if first_byte is None:
+                        first_byte = time.perf_counter() - started
+                    chunk = json.loads(line)
+                    if chunk.get("done"):
+                        outcome = "ok"
+                    yield chunk
+                return
+        except httpx.TransportError as e:
+            outcome = "error"
+            if first_byte is not None:
+                # 已经产出过片段，不能换后端重新生成
+                raise OllamaUnavailable(str(e)) from e
+            last_error = None
+        finally:
+            pool.release(backend, model, outcome, first_byte)
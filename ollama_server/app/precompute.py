@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import unicodedata
+from collections import Counter, deque
+
+# 热门问题统计窗口（秒）及分桶数，过期的桶整体丢弃
+QUERY_LOG_WINDOW_SECONDS = float(os.environ.get("QUERY_LOG_WINDOW_SECONDS", "86400"))
+QUERY_LOG_BUCKETS = int(os.environ.get("QUERY_LOG_BUCKETS", "24"))
+# 每个桶最多记录的不同问题数，超出后新问题不再计数，避免长尾问题占用内存
+QUERY_LOG_MAX_KEYS = int(os.environ.get("QUERY_LOG_MAX_KEYS", "10000"))
+# 设为 0 关闭预生成
+PRECOMPUTE_ENABLED = os.environ.get("PRECOMPUTE_ENABLED", "1") != "0"
+# 预生成出现次数最多的前 N 个问题，窗口内至少出现 PRECOMPUTE_MIN_COUNT 次
+PRECOMPUTE_TOP_N = int(os.environ.get("PRECOMPUTE_TOP_N", "20"))
+PRECOMPUTE_MIN_COUNT = int(os.environ.get("PRECOMPUTE_MIN_COUNT", "3"))
+# 检查是否空闲的间隔（秒）；最近一次请求之后至少空闲这么久才开始预生成
+PRECOMPUTE_INTERVAL_SECONDS = float(os.environ.get("PRECOMPUTE_INTERVAL_SECONDS", "30"))
+PRECOMPUTE_IDLE_SECONDS = float(os.environ.get("PRECOMPUTE_IDLE_SECONDS", "10"))
+# 预生成的回答超过该时长（秒）后在空闲时重新生成
+PRECOMPUTE_MAX_AGE = float(os.environ.get("PRECOMPUTE_MAX_AGE", "86400"))
+# 预生成进行中检查是否有请求排队的间隔（秒），有则中止预生成、让出生成名额
+PRECOMPUTE_PREEMPT_CHECK_SECONDS = 0.2
+
+logger = logging.getLogger("ollama_server")
+
+
+def normalize_query(query):
+    """归一化问题：全角转半角、转小写，去掉空白和标点，“转账限额？”与“转账 限额”视为同一问题"""
+    text = unicodedata.normalize("NFKC", query).lower()
+    return "".join(ch for ch in text if not ch.isspace() and not unicodedata.category(ch).startswith("P"))
+
+
+class QueryLog:
+    """
+    滚动窗口内的问题频次：按时间分桶计数，只保留窗口内的桶，
+    每个归一化问题保留最近一次的原始问法用于生成
+    """
+
+    def __init__(self, window=QUERY_LOG_WINDOW_SECONDS, buckets=QUERY_LOG_BUCKETS, max_keys=QUERY_LOG_MAX_KEYS):
+        self.window = window
+        self.bucket_seconds = window / buckets
+        self.max_keys = max_keys
+        # (桶编号, 计数, 归一化问题 -> 原始问法)
+        self._buckets = deque()
+        self._lock = threading.Lock()
+        self.total = 0
+        self.dropped = 0
+        self.last_seen = 0.0
+
+    def record(self, query, now=None):
+        key = normalize_query(query)
+        if not key:
+            return
+        now = time.time() if now is None else now
+        index = int(now // self.bucket_seconds)
+        with self._lock:
+            self._expire(index)
+            if not self._buckets or self._buckets[-1][0] != index:
+                self._buckets.append((index, Counter(), {}))
+            _, counts, texts = self._buckets[-1]
+            self.last_seen = now
+            if key not in counts and len(counts) >= self.max_keys:
+                self.dropped += 1
+                return
+            counts[key] += 1
+            texts[key] = query.strip()
+            self.total += 1
+
+    def top(self, n, min_count=1, now=None):
+        """窗口内出现次数最多的 n 个问题：[(归一化问题, 原始问法, 次数)]"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._expire(int(now // self.bucket_seconds))
+            counts, texts = Counter(), {}
+            for _, bucket_counts, bucket_texts in self._buckets:
+                counts.update(bucket_counts)
+                texts.update(bucket_texts)
+        return [(key, texts[key], count) for key, count in counts.most_common(n) if count >= min_count]
+
+    def stats(self):
+        with self._lock:
+            distinct = len(set().union(*(counts for _, counts, _ in self._buckets))) if self._buckets else 0
+            return {
+                "window_seconds": self.window,
+                "distinct": distinct,
+                "recorded": self.total,
+                "dropped": self.dropped,
+            }
+
+    def _expire(self, index):
+        # 调用方需持有锁
+        oldest = index - int(round(self.window / self.bucket_seconds)) + 1
+        while self._buckets and self._buckets[0][0] < oldest:
+            self._buckets.popleft()
+
+
+class PrecomputedAnswers:
+    """
+    预生成的回答：按归一化问题保存，记录生成时的知识库版本。
+    知识库切换或导入新内容后调用 invalidate，旧回答不再返回，由预生成任务在空闲时刷新
+    """
+
+    def __init__(self, kb_version=lambda: ""):
+        self._kb_version = kb_version
+        self._entries = {}
+        self._lock = threading.Lock()
+        # 每次 invalidate 递增；同一知识库版本内的增量导入也会使回答失效
+        self.generation = 0
+        self.lookups = 0
+        self.hits = 0
+
+    def version(self):
+        return f"{self._kb_version()}#{self.generation}"
+
+    def get(self, query):
+        key = normalize_query(query)
+        with self._lock:
+            self.lookups += 1
+            entry = self._entries.get(key)
+            if entry is None or entry["version"] != self.version():
+                return None
+            self.hits += 1
+            entry["hits"] += 1
+            return entry["result"]
+
+    def put(self, key, result, version):
+        with self._lock:
+            self._entries[key] = {"result": result, "version": version, "created_at": time.time(), "hits": 0}
+
+    def is_fresh(self, key, max_age=PRECOMPUTE_MAX_AGE):
+        with self._lock:
+            entry = self._entries.get(key)
+            return (entry is not None and entry["version"] == self.version()
+                    and time.time() - entry["created_at"] <= max_age)
+
+    def retain(self, keys):
+        """只保留仍在热门列表中的问题"""
+        with self._lock:
+            for key in set(self._entries) - set(keys):
+                del self._entries[key]
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+
+    def stats(self):
+        with self._lock:
+            version = self.version()
+            return {
+                "entries": len(self._entries),
+                "fresh": sum(1 for entry in self._entries.values() if entry["version"] == version),
+                "kb_version": version,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_ratio": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+            }
+
+
+class PrecomputeWorker:
+    """
+    空闲时为热门问题预生成回答：没有进行中和排队的生成、且最近 PRECOMPUTE_IDLE_SECONDS 秒内没有新请求时，
+    依次为缺少回答或回答已过期的热门问题调用 generate；生成期间有请求排队则中止，让出生成名额
+
+    Args:
+        generate: async (原始问法) -> 回答结果 dict，无需预生成（如 FAQ 可直接回答）或生成失败时返回 None
+        scheduler: GenerationScheduler，用于判断是否空闲
+        ready: 返回服务是否就绪，预热完成前不预生成
+    """
+
+    def __init__(self, log, answers, generate, scheduler, ready=lambda: True, top_n=PRECOMPUTE_TOP_N,
+                 min_count=PRECOMPUTE_MIN_COUNT, interval=PRECOMPUTE_INTERVAL_SECONDS,
+                 idle_seconds=PRECOMPUTE_IDLE_SECONDS):
+        self.log = log
+        self.answers = answers
+        self.generate = generate
+        self.scheduler = scheduler
+        self.ready = ready
+        self.top_n = top_n
+        self.min_count = min_count
+        self.interval = interval
+        self.idle_seconds = idle_seconds
+
+        self.runs = 0
+        self.generated = 0
+        self.skipped = 0
+        self.failed = 0
+        self.preempted = 0
+        self.generation_seconds = 0.0
+        self.last_run = None
+
+    def is_idle(self):
+        return (self.ready() and self.scheduler.active == 0 and self.scheduler.queue_depth == 0
+                and time.time() - self.log.last_seen >= self.idle_seconds)
+
+    def pending(self):
+        """需要（重新）生成的热门问题：[(归一化问题, 原始问法)]"""
+        hot = self.log.top(self.top_n, self.min_count)
+        self.answers.retain(key for key, _, _ in hot)
+        return [(key, text) for key, text, _ in hot if not self.answers.is_fresh(key)]
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("预生成热门问题回答失败")
+
+    async def run_once(self):
+        """空闲时处理一轮，返回本轮生成的回答数"""
+        if not self.is_idle():
+            return 0
+        self.runs += 1
+        self.last_run = time.time()
+        done = 0
+        for key, text in self.pending():
+            if not self.is_idle():
+                break
+            # 生成结束前知识库变化时，回答按生成开始时的版本保存，不会被当作新版本的回答返回
+            version = self.answers.version()
+            started = time.perf_counter()
+            result = await self._generate_preemptible(text)
+            self.generation_seconds += time.perf_counter() - started
+            if result is None:
+                continue
+            self.answers.put(key, result, version)
+            self.generated += 1
+            done += 1
+        return done
+
+    async def _generate_preemptible(self, text):
+        task = asyncio.ensure_future(self.generate(text))
+        while not task.done():
+            await asyncio.wait({task}, timeout=PRECOMPUTE_PREEMPT_CHECK_SECONDS)
+            if not task.done() and self.scheduler.queue_depth > 0:
+                task.cancel()
+                self.preempted += 1
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+                return None
+        try:
+            result = task.result()
+        except Exception as e:
+            self.failed += 1
+            logger.warning("预生成失败：%s %s", text, e)
+            return None
+        if result is None:
+            self.skipped += 1
+        return result
+
+    def stats(self):
+        return {
+            "enabled": PRECOMPUTE_ENABLED,
+            "top_n": self.top_n,
+            "min_count": self.min_count,
+            "runs": self.runs,
+            "generated": self.generated,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "preempted": self.preempted,
+            "generation_seconds": round(self.generation_seconds, 3),
+            "last_run": self.last_run,
+            "answers": self.answers.stats(),
+            "query_log": self.log.stats(),
+        }
@@ -0,0 +1,181 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+from app.precompute import normalize_query
+from app.responses import dumps
+
+# 设为 0 关闭查询日志
+QUERY_LOG_ENABLED = os.environ.get("QUERY_LOG_ENABLED", "1") != "0"
+# 查询日志目录，每个进程写自己的文件：queries-{开始时间}-{pid}-{轮转序号}.jsonl
+QUERY_LOG_DIR = os.environ.get("QUERY_LOG_DIR", "./query_logs")
+# 单个文件超过该字节数或跨天时换新文件，已关闭的文件不再修改，可直接压缩、归档或删除
+QUERY_LOG_ROTATE_BYTES = int(os.environ.get("QUERY_LOG_ROTATE_BYTES", str(64 * 1024 * 1024)))
+# 待写入记录的队列上限，写盘跟不上时丢弃新记录而不是阻塞请求
+QUERY_LOG_QUEUE_SIZE = int(os.environ.get("QUERY_LOG_QUEUE_SIZE", "10000"))
+# 缓冲数据最长多久写入磁盘（秒）
+QUERY_LOG_FLUSH_SECONDS = float(os.environ.get("QUERY_LOG_FLUSH_SECONDS", "1.0"))
+# 每次从队列中最多取出的记录数
+QUERY_LOG_BATCH = 1000
+
+logger = logging.getLogger("ollama_server")
+
+_STOP = object()
+
+
+def to_record(event, ts, total_seconds=None):
+    """
+    把 answer_query 的日志事件转换为一行查询日志：
+    q 归一化问题，tier 回答层级，id 命中的 FAQ 条目或第一个使用的片段，faq_score FAQ 匹配分数，
+    distance 最近片段的向量距离，score 第一名的融合分数，stages 与 total_ms 为耗时（毫秒）
+    """
+    hits = event.get("hits") or []
+    used = event.get("used") or []
+    distances = [hit["distance"] for hit in hits if hit.get("distance") is not None]
+    tier = event.get("tier")
+    route = event.get("route") or {}
+    faq_id = event.get("faq_id")
+    record = {
+        "ts": round(ts, 3),
+        "q": normalize_query(event.get("query", "")),
+        "tier": tier,
+        "id": f"faq:{faq_id}" if faq_id is not None else (used[0] if used else None),
+        "faq_score": event.get("faq_score"),
+        "distance": round(min(distances), 4) if distances else None,
+        "score": hits[0].get("score") if hits else None,
+        "cached": tier in ("cache", "precomputed"),
+        "shared": event.get("shared", False),
+        "failed": event.get("failed", False),
+        "answer_chars": event.get("answer_chars"),
+        "model": route.get("model"),
+        "stages": {stage: round(seconds * 1000, 1) for stage, seconds in (event.get("stages") or {}).items()},
+    }
+    if total_seconds is not None:
+        record["total_ms"] = round(total_seconds * 1000, 1)
+    return record
+
+
+class QueryLogWriter:
+    """
+    只追加的 JSONL 查询日志：请求处理中只把事件放入有界队列，
+    由后台线程批量序列化、写入并定期 flush，请求从不等待磁盘
+    """
+
+    def __init__(self, log_dir=QUERY_LOG_DIR, rotate_bytes=QUERY_LOG_ROTATE_BYTES, queue_size=QUERY_LOG_QUEUE_SIZE,
+                 flush_seconds=QUERY_LOG_FLUSH_SECONDS, enabled=QUERY_LOG_ENABLED):
+        self.log_dir = log_dir
+        self.rotate_bytes = rotate_bytes
+        self.flush_seconds = flush_seconds
+        self.enabled = enabled
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._file = None
+        self._file_day = None
+        self.path = None
+        self.file_bytes = 0
+
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.rotations = 0
+        self._thread = None
+        if enabled:
+            self._thread = threading.Thread(target=self._loop, name="query-log", daemon=True)
+            self._thread.start()
+
+    def write(self, event, total_seconds=None):
+        """放入待写入队列，不阻塞；队列已满时丢弃。event 在写入前不能再被修改"""
+        if not self.enabled:
+            return
+        try:
+            self._queue.put_nowait((time.time(), event, total_seconds))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout=5.0):
+        """写完队列中剩余的记录后停止后台线程"""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "path": self.path,
+            "written": self.written,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "rotations": self.rotations,
+            "queued": self._queue.qsize(),
+        }
+
+    def _loop(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                items = [self._queue.get(timeout=self.flush_seconds)]
+            except queue.Empty:
+                items = []
+            while items and len(items) < QUERY_LOG_BATCH:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(item is _STOP for item in items)
+            lines = []
+            for item in items:
+                if item is _STOP:
+                    continue
+                ts, event, total_seconds = item
+                try:
+                    lines.append(dumps(to_record(event, ts, total_seconds)) + b"\n")
+                except Exception as e:
+                    self.errors += 1
+                    logger.warning("查询日志记录无法序列化：%s", e)
+            try:
+                if lines:
+                    self._write(b"".join(lines))
+                    self.written += len(lines)
+                if self._file is not None and (stop or time.monotonic() - last_flush >= self.flush_seconds):
+                    self._file.flush()
+                    last_flush = time.monotonic()
+            except OSError as e:
+                self.errors += len(lines)
+                logger.warning("写入查询日志失败：%s", e)
+                self._close_file()
+            if stop:
+                self._close_file()
+                return
+
+    def _write(self, data):
+        day = time.strftime("%Y%m%d")
+        if self._file is None or self._file_day != day or self.file_bytes + len(data) > self.rotate_bytes:
+            if self._file is not None:
+                self.rotations += 1
+            self._open(day)
+        self._file.write(data)
+        self.file_bytes += len(data)
+
+    def _open(self, day):
+        self._close_file()
+        os.makedirs(self.log_dir, exist_ok=True)
+        # 文件名带上轮转序号，同一秒内轮转也不会写回已关闭的文件
+        name = f"queries-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self.rotations}.jsonl"
+        self.path = os.path.join(self.log_dir, name)
+        self._file = open(self.path, "ab", buffering=1024 * 1024)
+        self._file_day = day
+        self.file_bytes = self._file.tell()
+
+    def _close_file(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
@@ -0,0 +1,276 @@
+"""
+查询日志离线分析：流式读取 query_logs 下的 JSONL（也支持 .gz）日志，输出热门问题、低置信度问题簇
+和按小时统计的延迟分位数。逐行处理，内存占用与日志大小无关，可直接分析数 GB 的日志
+
+在 ollama_server 目录下运行：
+    python -m app.query_report query_logs --top 20
+    python -m app.query_report query_logs/queries-20261019-*.jsonl --since 2026-10-19 --json
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import math
+import os
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from app.domains import domain_keywords
+from app.query_log import QUERY_LOG_DIR
+from app.router import ROUTE_MAX_DISTANCE
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# 热门问题 / 问题簇的计数器容量：Misra-Gries 近似计数，计数为下界，误差不超过 总记录数 / (容量 + 1)
+REPORT_CAPACITY = 5000
+# 每个问题簇保留的示例问题数
+CLUSTER_EXAMPLES = 3
+# 延迟直方图：从 0.1 毫秒开始，每个桶比上一个宽 5%，分位数的相对误差不超过 5%
+HISTOGRAM_BASE_MS = 0.1
+HISTOGRAM_GROWTH = 1.05
+
+
+class HeavyHitters:
+    """
+    Misra-Gries 频繁项计数：最多保留 capacity 个计数器，计数器满时全部减 1 并丢弃归零的项，
+    均摊 O(1)；出现次数超过 总数 / (capacity + 1) 的项一定会被保留
+    """
+
+    def __init__(self, capacity=REPORT_CAPACITY, examples=0):
+        self.capacity = capacity
+        self.examples = examples
+        self.counts = {}
+        self.samples = {}
+        self.total = 0
+
+    def add(self, key, example=None):
+        self.total += 1
+        if key in self.counts:
+            self.counts[key] += 1
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = 1
+        else:
+            for k in list(self.counts):
+                self.counts[k] -= 1
+                if not self.counts[k]:
+                    del self.counts[k]
+                    self.samples.pop(k, None)
+            return
+        if self.examples and example is not None:
+            samples = self.samples.setdefault(key, [])
+            if len(samples) < self.examples and example not in samples:
+                samples.append(example)
+
+    def top(self, n):
+        return [(key, count, self.samples.get(key, [])) for key, count in Counter(self.counts).most_common(n)]
+
+
+class LatencyHistogram:
+    """对数分桶的延迟直方图，桶数只与延迟范围有关"""
+
+    def __init__(self):
+        self.buckets = Counter()
+        self.count = 0
+
+    def add(self, ms):
+        index = int(math.log(max(ms, HISTOGRAM_BASE_MS) / HISTOGRAM_BASE_MS) / math.log(HISTOGRAM_GROWTH))
+        self.buckets[index] += 1
+        self.count += 1
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                # 取桶的上界
+                return round(HISTOGRAM_BASE_MS * HISTOGRAM_GROWTH ** (index + 1), 1)
+        return None
+
+
+def iter_files(paths):
+    """展开目录与通配符，按文件名（即开始时间）排序"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += glob.glob(os.path.join(path, "*.jsonl")) + glob.glob(os.path.join(path, "*.jsonl.gz"))
+        else:
+            files += glob.glob(path)
+    return sorted(set(files), key=os.path.basename)
+
+
+def iter_records(files, stats):
+    for path in files:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rb") as f:
+            for line in f:
+                try:
+                    yield _loads(line)
+                except ValueError:
+                    # 进程被强制结束时最后一行可能不完整
+                    stats["invalid_lines"] += 1
+
+
+def cluster_key(query, keywords):
+    """低置信度问题按命中的业务关键词归簇（如 挂失+信用卡），没有命中关键词时按问题本身"""
+    matched = {keyword for keyword in keywords if keyword in query}
+    # 去掉被更长关键词包含的（如同时命中“信用”和“信用卡”时只保留“信用卡”）
+    matched = sorted(k for k in matched if not any(k != other and k in other for other in matched))
+    return "+".join(matched[:3]) if matched else query
+
+
+def is_low_confidence(record, max_distance):
+    """检索不到足够相近的片段、只能由 LLM 凭空回答的问题，以及生成失败的问题"""
+    if record.get("failed"):
+        return True
+    if record.get("tier") not in ("llm", "shared"):
+        return False
+    distance = record.get("distance")
+    return distance is None or distance > max_distance
+
+
+class Report:
+    """
+    Args:
+        keywords: 问题簇划分用的业务关键词，默认取领域关键词表（SmartQAApp 的银行业务关键词）
+    """
+
+    def __init__(self, max_distance=ROUTE_MAX_DISTANCE, capacity=REPORT_CAPACITY, utc=False, keywords=None):
+        self.max_distance = max_distance
+        self.utc = utc
+        self.stats = Counter()
+        self.tiers = Counter()
+        self.queries = HeavyHitters(capacity)
+        self.clusters = HeavyHitters(capacity, examples=CLUSTER_EXAMPLES)
+        self.by_hour = {hour: LatencyHistogram() for hour in range(24)}
+        self.stages = {}
+        self.days = set()
+        self.first_ts = None
+        self.last_ts = None
+        if keywords is None:
+            keywords = [keyword for words in domain_keywords().values() for keyword in words]
+        self._keywords = {keyword.lower() for keyword in keywords}
+
+    def add(self, record):
+        ts = record.get("ts")
+        if ts is None:
+            self.stats["invalid_lines"] += 1
+            return
+        self.stats["records"] += 1
+        self.first_ts = ts if self.first_ts is None else min(self.first_ts, ts)
+        self.last_ts = ts if self.last_ts is None else max(self.last_ts, ts)
+        tier = record.get("tier")
+        self.tiers[tier] += 1
+        if record.get("failed"):
+            self.stats["failed"] += 1
+        query = record.get("q") or ""
+        if query:
+            self.queries.add(query)
+            if is_low_confidence(record, self.max_distance):
+                self.stats["low_confidence"] += 1
+                self.clusters.add(cluster_key(query, self._keywords), query)
+
+        moment = time.gmtime(ts) if self.utc else time.localtime(ts)
+        self.days.add((moment.tm_year, moment.tm_yday))
+        if record.get("total_ms") is not None:
+            self.by_hour[moment.tm_hour].add(record["total_ms"])
+        for stage, ms in (record.get("stages") or {}).items():
+            self.stages.setdefault(stage, LatencyHistogram()).add(ms)
+
+    def to_dict(self, top):
+        def fmt(ts):
+            if ts is None:
+                return None
+            moment = datetime.fromtimestamp(ts, timezone.utc if self.utc else None)
+            return moment.isoformat(timespec="seconds")
+
+        days = max(1, len(self.days))
+        return {
+            "records": self.stats["records"],
+            "invalid_lines": self.stats["invalid_lines"],
+            "failed": self.stats["failed"],
+            "low_confidence": self.stats["low_confidence"],
+            "from": fmt(self.first_ts),
+            "to": fmt(self.last_ts),
+            "tiers": dict(self.tiers.most_common()),
+            "top_queries": [{"query": q, "count": n} for q, n, _ in self.queries.top(top)],
+            "low_confidence_clusters": [
+                {"cluster": key, "count": n, "examples": examples} for key, n, examples in self.clusters.top(top)
+            ],
+            "by_hour": [
+                {
+                    "hour": hour,
+                    "requests_per_day": round(h.count / days, 1),
+                    "p50_ms": h.percentile(50),
+                    "p95_ms": h.percentile(95),
+                    "p99_ms": h.percentile(99),
+                }
+                for hour, h in self.by_hour.items() if h.count
+            ],
+            "stages": {
+                stage: {"count": h.count, "p50_ms": h.percentile(50), "p95_ms": h.percentile(95)}
+                for stage, h in sorted(self.stages.items())
+            },
+        }
+
+
+def print_report(result):
+    print(f"记录 {result['records']} 条（{result['from']} ~ {result['to']}），无法解析 {result['invalid_lines']} 行，"
+          f"生成失败 {result['failed']} 条")
+    print("各层回答：" + "，".join(f"{tier} {n}" for tier, n in result["tiers"].items()))
+
+    print("\n热门问题（近似计数，为下界）：")
+    for item in result["top_queries"]:
+        print(f"  {item['count']:>8}  {item['query']}")
+
+    print(f"\n低置信度问题簇（共 {result['low_confidence']} 条，检索距离超过阈值或生成失败）：")
+    for item in result["low_confidence_clusters"]:
+        print(f"  {item['count']:>8}  {item['cluster']}  例：{' / '.join(item['examples'])}")
+
+    print("\n按小时统计的总耗时：")
+    print(f"  {'小时':<6}{'日均请求':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}")
+    for row in result["by_hour"]:
+        print(f"  {row['hour']:<8}{row['requests_per_day']:>10}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+
+    print("\n各阶段耗时：")
+    for stage, row in result["stages"].items():
+        print(f"  {stage:<14}{row['count']:>10}  p50 {row['p50_ms']} ms  p95 {row['p95_ms']} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查询日志离线分析")
+    parser.add_argument("paths", nargs="*", default=[QUERY_LOG_DIR], help="日志目录或文件，支持通配符")
+    parser.add_argument("--top", type=int, default=20, help="输出的热门问题 / 问题簇数")
+    parser.add_argument("--since", default=None, help="只统计该时间之后的记录，如 2026-10-19 或 2026-10-19T08:00")
+    parser.add_argument("--max-distance", type=float, default=ROUTE_MAX_DISTANCE,
+                        help="最近片段的向量距离超过该值视为低置信度")
+    parser.add_argument("--capacity", type=int, default=REPORT_CAPACITY, help="近似计数器容量")
+    parser.add_argument("--utc", action="store_true", help="按 UTC 而非本地时间划分小时")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出")
+    args = parser.parse_args()
+
+    since = datetime.fromisoformat(args.since).timestamp() if args.since else None
+    report = Report(max_distance=args.max_distance, capacity=args.capacity, utc=args.utc)
+    for record in iter_records(iter_files(args.paths), report.stats):
+        if since is not None and (record.get("ts") or 0) < since:
+            continue
+        report.add(record)
+
+    result = report.to_dict(args.top)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print_report(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import os
+
+import numpy as np
+
+from app.vector_store import VectorStore
+
+# 新构建版本的降维方式：空为不降维，pca 为在语料上拟合的主成分投影，random 为高斯随机投影（无需拟合）
+KB_REDUCE = os.environ.get("KB_REDUCE", "")
+# 降维后的维度
+KB_REDUCE_DIM = int(os.environ.get("KB_REDUCE_DIM", "128"))
+# 拟合 PCA 时最多抽样的片段数
+KB_REDUCE_FIT_SAMPLES = int(os.environ.get("KB_REDUCE_FIT_SAMPLES", "20000"))
+# 投影矩阵保存在版本目录中的文件名
+REDUCER_FILE = "reducer.npz"
+
+REDUCE_METHODS = ("pca", "random")
+
+
+class Reducer:
+    """
+    线性降维：先减去均值（PCA）再乘投影矩阵，结果重新 L2 归一化，
+    降维后的距离仍为 2 - 2·cos，与未降维时的度量一致
+    """
+
+    def __init__(self, method, components, mean=None, explained=None):
+        self.method = method
+        # (输入维度, 输出维度)
+        self.components = np.ascontiguousarray(components, dtype=np.float32)
+        self.mean = None if mean is None else np.asarray(mean, dtype=np.float32)
+        # PCA 保留的方差占比
+        self.explained = explained
+
+    @property
+    def in_dim(self):
+        return self.components.shape[0]
+
+    @property
+    def out_dim(self):
+        return self.components.shape[1]
+
+    @classmethod
+    def fit_pca(cls, vectors, dim):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if dim >= vectors.shape[1]:
+            raise ValueError(f"降维后的维度 {dim} 应小于原维度 {vectors.shape[1]}")
+        if len(vectors) <= dim:
+            raise ValueError(f"拟合 PCA 至少需要 {dim + 1} 个样本，实际 {len(vectors)} 个")
+        mean = vectors.mean(axis=0)
+        # 协方差矩阵只有 维度×维度 大小，与样本数无关
+        centered = vectors - mean
+        eigvals, eigvecs = np.linalg.eigh(centered.T @ centered)
+        order = np.argsort(eigvals)[::-1][:dim]
+        explained = float(eigvals[order].sum() / max(eigvals.sum(), 1e-12))
+        return cls("pca", eigvecs[:, order], mean, explained)
+
+    @classmethod
+    def random_projection(cls, in_dim, dim, seed=0):
+        if dim >= in_dim:
+            raise ValueError(f"降维后的维度 {dim} 应小于原维度 {in_dim}")
+        rng = np.random.default_rng(seed)
+        return cls("random", rng.normal(size=(in_dim, dim)) / np.sqrt(dim))
+
+    def transform(self, vectors):
+        """(n, 输入维度) -> (n, 输出维度) 的归一化 float32 矩阵"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.mean is not None:
+            vectors = vectors - self.mean
+        reduced = vectors @ self.components
+        return reduced / np.maximum(np.linalg.norm(reduced, axis=1, keepdims=True), 1e-12)
+
+    def save(self, path):
+        arrays = {"components": self.components, "method": np.array(self.method)}
+        if self.mean is not None:
+            arrays["mean"] = self.mean
+        if self.explained is not None:
+            arrays["explained"] = np.array(self.explained)
+        # 先写临时文件再替换；np.savez 会给没有 .npz 后缀的文件名补上后缀
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(
+                str(data["method"]),
+                data["components"],
+                data["mean"] if "mean" in data else None,
+                float(data["explained"]) if "explained" in data else None,
+            )
+
+    def stats(self):
+        stats = {"method": self.method, "in_dim": self.in_dim, "out_dim": self.out_dim}
+        if self.explained is not None:
+            stats["explained_variance"] = round(self.explained, 4)
+        return stats
+
+
+def fit_reducer(method, vectors, dim=KB_REDUCE_DIM):
+    """按 method 构建降维器；vectors 为用于拟合的原始向量（random 只用到其维度）"""
+    if method == "pca":
+        return Reducer.fit_pca(vectors, dim)
+    if method == "random":
+        return Reducer.random_projection(np.asarray(vectors).shape[1], dim)
+    raise ValueError(f"未知的降维方式: {method}")
+
+
+class ReducedStore(VectorStore):
+    """
+    降维存储：写入和检索时把嵌入模型输出的原始向量投影到低维后交给底层存储，
+    调用方仍传入原始向量。传入的向量已是降维后的维度时（如版本校验用 get 取出的向量检索）原样使用
+    """
+
+    def __init__(self, store, reducer):
+        self.store = store
+        self.reducer = reducer
+        self.name = store.name
+
+    def _reduce(self, embeddings):
+        if embeddings is None:
+            return None
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.shape[-1] == self.reducer.out_dim:
+            return vectors
+        if vectors.shape[-1] != self.reducer.in_dim:
+            raise ValueError(f"向量维度 {vectors.shape[-1]} 与降维器的输入维度 {self.reducer.in_dim} 不一致")
+        return self.reducer.transform(vectors)
+
+    def count(self):
+        return self.store.count()
+
+    def get(self, ids=None, where=None, include=("metadatas", "documents"), limit=None, offset=0):
+        return self.store.get(ids=ids, where=where, include=include, limit=limit, offset=offset)
+
+    def query(self, query_embeddings, n_results=10, where=None, include=None, **kwargs):
+        return self.store.query(self._reduce(query_embeddings), n_results=n_results, where=where, include=include,
+                                **kwargs)
+
+    def upsert(self, ids, documents, embeddings, metadatas):
+        self.store.upsert(ids=ids, documents=documents, embeddings=self._reduce(embeddings), metadatas=metadatas)
+
+    add = upsert
+
+    def update(self, ids, metadatas=None, documents=None, embeddings=None):
+        self.store.update(ids=ids, metadatas=metadatas, documents=documents, embeddings=self._reduce(embeddings))
+
+    def delete(self, ids=None, where=None):
+        self.store.delete(ids=ids, where=where)
+
+    def __getattr__(self, attr):
+        # 分片存储的 route_domains、domain_counts 等
+        return getattr(self.store, attr)
+
+    def stats(self):
+        return dict(self.store.stats(), reducer=self.reducer.stats())
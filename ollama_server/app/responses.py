@@ -0,0 +1,192 @@
+import gzip
+import hashlib
+import json
+import os
+
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import orjson
+except ImportError:  # 未安装时退回标准库 json
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # 未安装时只支持 gzip
+    brotli = None
+
+# 响应体超过该字节数时才压缩，小响应压缩后节省的字节抵不上头部和 CPU 开销
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+# gzip 压缩级别（1-9）与 brotli 质量（0-11），取压缩率与 CPU 耗时的折中
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", "5"))
+# fields 中请求 snippet 时返回的片段前缀长度（字符）
+SNIPPET_CHARS = int(os.environ.get("SNIPPET_CHARS", "80"))
+# /api/knowledge/stats 与 /api/status 允许客户端缓存的秒数
+STATS_CACHE_SECONDS = int(os.environ.get("STATS_CACHE_SECONDS", "5"))
+STATUS_CACHE_SECONDS = int(os.environ.get("STATUS_CACHE_SECONDS", "2"))
+
+
+def dumps(content) -> bytes:
+    """序列化为 UTF-8 JSON，中文不转义"""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    用 orjson 序列化的 JSON 响应。
+    路由直接返回该响应时 FastAPI 不再对返回值做 jsonable_encoder 转换，内容须为 JSON 原生类型
+    """
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def snippet(text, limit=None):
+    limit = SNIPPET_CHARS if limit is None else limit
+    text = text or ""
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+def select_fields(content: dict, fields, docs_key="docs") -> dict:
+    """
+    只保留 fields 中列出的顶层字段，fields 为空时原样返回；success 始终保留。
+    snippets 为 docs_key 中各文档截断后的前缀，供客户端只展示摘要
+    """
+    if not fields:
+        return content
+    selected = {key: content[key] for key in fields if key in content}
+    if "snippets" in fields and docs_key in content:
+        selected["snippets"] = [snippet(doc) for doc in content[docs_key]]
+    if "success" in content:
+        selected["success"] = content["success"]
+    return selected
+
+
+def cached_json(request, content, max_age: int, etag=True) -> Response:
+    """
+    带 ETag 和 Cache-Control 的 JSON 响应；If-None-Match 与当前内容一致时返回 304，不发送响应体。
+    响应体可能被 CompressionMiddleware 压缩，同一内容的压缩与未压缩版本字节不同，因此使用弱 ETag，
+    并总是带上 Vary: Accept-Encoding（包括 304），避免共享缓存把压缩版本返回给不支持的客户端。
+    内容每次请求都会变化（如包含当前时间和实时计数）时 etag 设为 False，只带 Cache-Control
+    """
+    body = dumps(content)
+    headers = {"Cache-Control": f"max-age={max_age}", "Vary": "Accept-Encoding"}
+    if not etag:
+        return Response(body, media_type="application/json", headers=headers)
+    tag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+    headers["ETag"] = "W/" + tag
+    # If-None-Match 可能包含多个（弱）ETag，按弱比较忽略 W/ 前缀
+    tags = set()
+    for item in request.headers.get("if-none-match", "").split(","):
+        item = item.strip()
+        tags.add(item[2:] if item.startswith("W/") else item)
+    if tag in tags or "*" in tags:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def _choose_encoding(accept_encoding: str):
+    """按客户端声明的 Accept-Encoding 选择编码，优先 brotli"""
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def _add_vary(headers):
+    """在 Vary 中加入 Accept-Encoding，已有 Vary 头时合并而不是重复添加"""
+    for i, (name, value) in enumerate(headers):
+        if name.lower() == b"vary":
+            tokens = {token.strip().lower() for token in value.split(b",")}
+            if b"accept-encoding" not in tokens and b"*" not in tokens:
+                headers[i] = (name, value + b", Accept-Encoding")
+            return headers
+    headers.append((b"vary", b"Accept-Encoding"))
+    return headers
+
+
+def _weaken_etag(headers):
+    """压缩后的响应体与原内容字节不同，强 ETag 改为弱 ETag"""
+    return [
+        (name, b"W/" + value if name.lower() == b"etag" and not value.startswith(b"W/") else value)
+        for name, value in headers
+    ]
+
+
+class CompressionMiddleware:
+    """
+    纯 ASGI 中间件：响应体一次发送完、超过 COMPRESS_MIN_BYTES 且客户端支持时用 brotli 或 gzip 压缩。
+    流式响应（/chat/stream 的 NDJSON）不压缩，压缩器的缓冲会推迟每一段回答到达客户端的时间。
+    可压缩的响应无论本次是否压缩都带上 Vary: Accept-Encoding，压缩时强 ETag 改为弱 ETag
+    """
+
+    def __init__(self, app, min_bytes=None):
+        self.app = app
+        self.min_bytes = COMPRESS_MIN_BYTES if min_bytes is None else min_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = ""
+        for name, value in scope.get("headers", []):
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        encoding = _choose_encoding(accept_encoding)
+        start = None
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                # 等到第一段响应体再决定是否压缩
+                start = message
+                return
+            if message["type"] != "http.response.body" or start is None:
+                await send(message)
+                return
+            pending, start = start, None
+            headers = list(pending.get("headers", []))
+            body = message.get("body", b"")
+            names = {name.lower() for name, _ in headers}
+            if message.get("more_body", False) or len(body) < self.min_bytes or b"content-encoding" in names:
+                await send(pending)
+                await send(message)
+                return
+            # 支持压缩的客户端会收到压缩版本，缓存需要按 Accept-Encoding 区分
+            headers = _add_vary(headers)
+            if encoding is None:
+                await send(dict(pending, headers=headers))
+                await send(message)
+                return
+            body = compress(body, encoding)
+            headers = [(name, value) for name, value in _weaken_etag(headers) if name.lower() != b"content-length"]
+            headers += [
+                (b"content-encoding", encoding.encode("latin-1")),
+                (b"content-length", str(len(body)).encode("latin-1")),
+            ]
+            await send(dict(pending, headers=headers))
+            await send(dict(message, body=body))
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,133 @@
+import asyncio
+import os
+import threading
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+from app.bm25_index import BM25Index, bm25_path
+
+# 向量检索和词法检索各自召回的候选数
+HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", "10"))
+# RRF 平滑常数，越大排名靠后的候选权重衰减越慢
+RRF_K = int(os.environ.get("RRF_K", "60"))
+
+
+def rrf_fuse(rankings, k=RRF_K):
+    """
+    倒数排名融合（Reciprocal Rank Fusion）
+
+    Args:
+        rankings: 多路检索结果，每路为按相关度排好序的 id 列表
+        k: 平滑常数
+
+    Returns:
+        [(id, 融合分数), ...]，按分数降序
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
+
+
+class HybridRetriever:
+    """并行执行向量检索与 BM25 检索，并用 RRF 融合两路结果"""
+
+    def __init__(self, collection, embed_model):
+        self.collection = collection
+        self.embed_model = embed_model
+        self._bm25 = None
+        self._bm25_mtime = None
+        self._lock = threading.Lock()
+
+    def _lexical_index(self):
+        # 索引文件被 index_kb 重建后按修改时间自动重新加载
+        path = bm25_path(self.collection.name)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        with self._lock:
+            if mtime != self._bm25_mtime:
+                self._bm25 = BM25Index.load(path)
+                self._bm25_mtime = mtime
+            return self._bm25
+
+    def _vector_search(self, query, n, timings=None):
+        start = time.perf_counter()
+        # 问题向量全程保持为 NumPy 数组，只在交给 Chroma 时转换
+        q_embs = self.embed_model.encode([query])
+        encoded = time.perf_counter()
+        kwargs = {}
+        # 按领域分片存储时只查询问题所属领域的分片
+        route_domains = getattr(self.collection, "route_domains", None)
+        if route_domains is not None:
+            kwargs["domains"] = route_domains(query)
+        result = self.collection.query(query_embeddings=q_embs, n_results=n, **kwargs)
+        if timings is not None:
+            timings.record("embed", encoded - start)
+            timings.record("vector_query", time.perf_counter() - encoded)
+        hits = []
+        if result["ids"] and result["ids"][0]:
+            for i, doc_id in enumerate(result["ids"][0]):
+                hits.append({
+                    "id": doc_id,
+                    "document": result["documents"][0][i],
+                    "metadata": result["metadatas"][0][i] if result["metadatas"] else {},
+                    "distance": result["distances"][0][i] if result["distances"] else None,
+                })
+        return q_embs[0], hits
+
+    def _lexical_search(self, query, n, timings=None):
+        start = time.perf_counter()
+        index = self._lexical_index()
+        hits = index.search(query, n) if index is not None else []
+        if timings is not None:
+            timings.record("bm25", time.perf_counter() - start)
+        return hits
+
+    async def retrieve(self, query, n_results=3, timings=None):
+        """
+        混合检索
+
+        Args:
+            query: 用户问题
+            n_results: 返回的片段数
+            timings: 可选的 RequestTimings，记录 embed/vector_query/bm25 耗时
+
+        Returns:
+            (问题向量, 命中片段列表)，片段包含 id/document/metadata/distance/score
+        """
+        # 每路至少召回 n_results 个候选，否则融合后的结果数受限于 HYBRID_CANDIDATES
+        candidates = max(n_results, HYBRID_CANDIDATES)
+        (q_emb, vector_hits), lexical_hits = await asyncio.gather(
+            run_in_threadpool(self._vector_search, query, candidates, timings),
+            run_in_threadpool(self._lexical_search, query, candidates, timings),
+        )
+        fused = rrf_fuse([
+            [hit["id"] for hit in vector_hits],
+            [doc_id for doc_id, _ in lexical_hits],
+        ])[:n_results]
+
+        by_id = {hit["id"]: hit for hit in vector_hits}
+        # 只被词法检索召回的片段需要从 Chroma 补取正文
+        missing = [doc_id for doc_id, _ in fused if doc_id not in by_id]
+        if missing:
+            extra = await run_in_threadpool(
+                self.collection.get, ids=missing, include=["documents", "metadatas"]
+            )
+            for i, doc_id in enumerate(extra["ids"]):
+                by_id[doc_id] = {
+                    "id": doc_id,
+                    "document": extra["documents"][i],
+                    "metadata": extra["metadatas"][i] or {},
+                    "distance": None,
+                }
+
+        hits = []
+        for doc_id, score in fused:
+            # BM25 索引可能比 Chroma 旧，已删除的片段直接跳过
+            if doc_id in by_id:
+                hits.append(dict(by_id[doc_id], score=score))
+        return q_emb, hits
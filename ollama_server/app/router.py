@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import re
+import threading
+from collections import Counter
+
+from app.ollama_client import MODEL_NAME
+
+logger = logging.getLogger("ollama_server")
+
+# 是否按问题难度选择模型，关闭时全部使用 reasoning 档
+ROUTING_ENABLED = os.environ.get("MODEL_ROUTING", "1") != "0"
+# 简单事实类问题使用的小模型
+ROUTE_FAST_MODEL = os.environ.get("ROUTE_FAST_MODEL", "qwen2.5:1.5b")
+# 超过该长度的问题交给推理模型
+ROUTE_MAX_SIMPLE_CHARS = int(os.environ.get("ROUTE_MAX_SIMPLE_CHARS", "30"))
+# 最相关片段的向量距离超过该值视为检索置信度低，交给推理模型
+# （Chroma 默认 L2 距离，归一化向量下 1.0 约对应余弦相似度 0.5）
+ROUTE_MAX_DISTANCE = float(os.environ.get("ROUTE_MAX_DISTANCE", "1.0"))
+# QAProcessor 识别出这些意图时交给推理模型
+ROUTE_COMPLEX_INTENTS = ("比较", "问题")
+# 意图识别未覆盖的复杂问题：投诉、原因分析、建议等
+ROUTE_COMPLEX_PATTERN = re.compile(
+    os.environ.get("ROUTE_COMPLEX_PATTERN", r"(投诉|不满|为什么|原因|分析|建议|怎么办|区别|对比|比较)")
+)
+
+# 模型分级：每档的模型、num_predict 上限和停止序列，可用 MODEL_TIERS（JSON）整体覆盖
+# “用户：”是会话历史中的轮次前缀，避免模型自行续写下一轮对话
+MODEL_TIERS = {
+    "fast": {"model": ROUTE_FAST_MODEL, "num_predict": 256, "stop": ["用户：", "\n\n\n"]},
+    "reasoning": {"model": MODEL_NAME, "num_predict": 2048, "stop": ["用户："]},
+}
+if os.environ.get("MODEL_TIERS"):
+    MODEL_TIERS = json.loads(os.environ["MODEL_TIERS"])
+
+# 未命中任何规则、以及其他档位不可用时使用的档位
+DEFAULT_TIER = "reasoning"
+SIMPLE_TIER = "fast"
+
+
+class ModelRouter:
+    """
+    生成前为每个请求选择模型档位：简单的事实类问题交给小模型，
+    比较、投诉、长问题、检索置信度低的问题交给推理模型
+    """
+
+    def __init__(self, tiers=None, enabled=ROUTING_ENABLED):
+        self.tiers = dict(tiers or MODEL_TIERS)
+        if DEFAULT_TIER not in self.tiers:
+            # 其他档位不可用时总是回退到 reasoning 档，覆盖配置中没有时使用默认的推理模型
+            logger.warning("MODEL_TIERS 中没有 %s 档，使用默认模型 %s", DEFAULT_TIER, MODEL_NAME)
+            self.tiers[DEFAULT_TIER] = {"model": MODEL_NAME, "num_predict": 2048, "stop": ["用户："]}
+        self.enabled = enabled and SIMPLE_TIER in self.tiers
+        # 生成时报告模型不存在的档位，之后不再路由到该档
+        self.unavailable = set()
+        self.decisions = Counter()
+        # 档位 -> [生成次数, 生成总耗时]
+        self._latency = {}
+        self._lock = threading.Lock()
+
+    def classify(self, query, match=None, hits=None):
+        """
+        每个问题单独判断，不沿用会话上一轮的档位；档位与会话 context 不一致时由调用方以文本重建历史
+
+        Args:
+            query: 用户问题
+            match: FAQ 层 QAProcessor.match_query 的结果（含意图），可为 None
+            hits: 检索结果，使用其中最小的向量距离作为检索置信度
+
+        Returns:
+            (档位名, 原因)
+        """
+        if not self.enabled:
+            return DEFAULT_TIER, "disabled"
+        if SIMPLE_TIER in self.unavailable:
+            return DEFAULT_TIER, "fast_unavailable"
+
+        intents = (match or {}).get("intents") or {}
+        for intent in ROUTE_COMPLEX_INTENTS:
+            if intent in intents:
+                return DEFAULT_TIER, f"intent:{intent}"
+        if ROUTE_COMPLEX_PATTERN.search(query):
+            return DEFAULT_TIER, "complex_pattern"
+        if len(query) > ROUTE_MAX_SIMPLE_CHARS:
+            return DEFAULT_TIER, "long_query"
+        distances = [hit["distance"] for hit in hits or [] if hit.get("distance") is not None]
+        if not distances or min(distances) > ROUTE_MAX_DISTANCE:
+            return DEFAULT_TIER, "low_retrieval_confidence"
+        return SIMPLE_TIER, "simple"
+
+    def route(self, query, match=None, hits=None):
+        """classify 并记录决策，返回 {"tier", "model", "reason", "options"}"""
+        tier, reason = self.classify(query, match, hits)
+        with self._lock:
+            self.decisions[(tier, reason)] += 1
+        return self.describe(tier, reason)
+
+    def describe(self, tier, reason):
+        config = self.tiers[tier]
+        options = {key: config[key] for key in ("num_predict", "stop") if config.get(key)}
+        return {"tier": tier, "model": config["model"], "reason": reason, "options": options}
+
+    def observe(self, tier, seconds):
+        """记录一次生成的耗时"""
+        with self._lock:
+            state = self._latency.setdefault(tier, [0, 0.0])
+            state[0] += 1
+            state[1] += seconds
+
+    def mark_unavailable(self, tier):
+        if tier != DEFAULT_TIER:
+            self.unavailable.add(tier)
+            logger.warning("模型 %s 不可用，%s 档的请求改用 %s 档", self.tiers[tier]["model"], tier, DEFAULT_TIER)
+
+    def stats(self):
+        with self._lock:
+            decisions = dict(self.decisions)
+            latency = {tier: round(total / count, 3) for tier, (count, total) in self._latency.items()}
+        by_tier = Counter()
+        for (tier, _), count in decisions.items():
+            by_tier[tier] += count
+        return {
+            "enabled": self.enabled,
+            "tiers": {name: config["model"] for name, config in self.tiers.items()},
+            "unavailable": sorted(self.unavailable),
+            "requests": dict(by_tier),
+            "avg_generation_seconds": latency,
+            "reasons": {f"{tier}:{reason}": count for (tier, reason), count in sorted(decisions.items())},
+        }
@@ -0,0 +1,185 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+# 同时进行的生成数，CPU 上的 Ollama 通常只能有效并发 1~2 个
+GEN_CONCURRENCY = int(os.environ.get("GEN_CONCURRENCY", "1"))
+# 等待队列长度上限，超过后直接拒绝
+GEN_QUEUE_SIZE = int(os.environ.get("GEN_QUEUE_SIZE", "8"))
+# 请求未指定截止时间时的默认排队+生成时限（秒）
+GEN_DEFAULT_TIMEOUT = float(os.environ.get("GEN_DEFAULT_TIMEOUT", "60"))
+
+# 优先级：数值越小越优先，交互式对话优先于批量任务
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+
+class SchedulerRejected(Exception):
+    """请求未被接纳：队列已满(429)或排队超过截止时间(503)"""
+
+    def __init__(self, reason, status_code, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class GenerationScheduler:
+    """
+    LLM 生成的准入控制：限制并发数，超出的请求按优先级进入有界等待队列，
+    队列满时快速拒绝，排队超过截止时间的请求直接放弃
+    """
+
+    def __init__(self, concurrency=GEN_CONCURRENCY, max_queue=GEN_QUEUE_SIZE):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self._active = 0
+        # 堆元素为 [优先级, 序号, future]，同优先级先到先得
+        self._waiters = []
+        self._seq = itertools.count()
+
+        self.admitted = 0
+        self.rejected = 0
+        self.expired = 0
+        self._wait_times = deque(maxlen=1000)
+        # 生成耗时的指数滑动平均，用于估算 Retry-After
+        self._avg_duration = 10.0
+
+    @property
+    def active(self):
+        return self._active
+
+    @property
+    def queue_depth(self):
+        return len(self._waiters)
+
+    def retry_after(self):
+        """按当前排队长度和平均生成耗时估算客户端应等待的秒数"""
+        backlog = len(self._waiters) + 1
+        return max(1, math.ceil(backlog * self._avg_duration / self.concurrency))
+
+    async def acquire(self, priority="interactive", deadline=None, flight=None):
+        """
+        获取一个生成名额
+
+        Args:
+            priority: 优先级名称，见 PRIORITIES
+            deadline: time.monotonic() 时间戳，排队超过该时刻则放弃
+            flight: 合并请求的 Flight，给出时忽略 priority 和 deadline；
+                排队期间有等待方加入时按其更高的优先级重新排序、按更晚的截止时间继续等待
+        """
+        if flight is not None:
+            priority, deadline = flight.priority, flight.deadline
+        rank = PRIORITIES[priority]
+        start = time.monotonic()
+        if deadline is None:
+            deadline = start + GEN_DEFAULT_TIMEOUT
+
+        if self._active < self.concurrency and not self._waiters:
+            self._active += 1
+            self._admit(0.0)
+            return
+
+        if len(self._waiters) >= self.max_queue and not self._evict_lower(rank):
+            self.rejected += 1
+            raise SchedulerRejected("queue_full", 429, self.retry_after())
+
+        fut = asyncio.get_running_loop().create_future()
+        entry = [rank, next(self._seq), fut]
+        heapq.heappush(self._waiters, entry)
+        if flight is not None:
+            flight.on_change = lambda: self._promote(entry, PRIORITIES[flight.priority])
+        try:
+            while True:
+                try:
+                    # shield：等待超时后截止时间可能已被推迟，future 需要留在队列中继续等待
+                    await asyncio.wait_for(asyncio.shield(fut), timeout=max(0.0, deadline - time.monotonic()))
+                    break
+                except asyncio.TimeoutError:
+                    if flight is None or flight.deadline <= deadline:
+                        raise
+                    deadline = flight.deadline
+        except BaseException as e:
+            if fut.done() and not fut.cancelled() and fut.exception() is None:
+                # 名额已分配给本请求但等待方已被取消，转交给下一个请求
+                self.release()
+            else:
+                self._discard(entry)
+            if isinstance(e, asyncio.TimeoutError):
+                self.expired += 1
+                raise SchedulerRejected("queue_timeout", 503, self.retry_after()) from None
+            raise
+        finally:
+            if flight is not None:
+                flight.on_change = None
+        self._admit(time.monotonic() - start)
+
+    def release(self):
+        self._active -= 1
+        while self._active < self.concurrency and self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():
+                continue
+            self._active += 1
+            fut.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, priority="interactive", deadline=None, flight=None):
+        await self.acquire(priority, deadline, flight)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._avg_duration = 0.8 * self._avg_duration + 0.2 * (time.monotonic() - start)
+            self.release()
+
+    def stats(self):
+        waits = sorted(self._wait_times)
+
+        def pct(p):
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))], 3) if waits else 0.0
+
+        return {
+            "concurrency": self.concurrency,
+            "active": self._active,
+            "queue_depth": len(self._waiters),
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "expired": self.expired,
+            "wait_p50": pct(0.5),
+            "wait_p95": pct(0.95),
+            "wait_max": round(waits[-1], 3) if waits else 0.0,
+            "avg_generation_seconds": round(self._avg_duration, 3),
+        }
+
+    def _admit(self, waited):
+        self.admitted += 1
+        self._wait_times.append(waited)
+
+    def _evict_lower(self, rank):
+        """队列已满时，挤掉排在最后的更低优先级请求为高优先级请求腾出位置"""
+        victim = max(self._waiters, key=lambda e: (e[0], e[1]), default=None)
+        if victim is None or victim[0] <= rank:
+            return False
+        self._discard(victim)
+        victim[2].set_exception(SchedulerRejected("preempted", 429, self.retry_after()))
+        self.rejected += 1
+        return True
+
+    def _promote(self, entry, rank):
+        """排队中的请求提高优先级，序号不变，仍排在同优先级中更早到达的请求之后"""
+        if rank < entry[0] and entry in self._waiters:
+            entry[0] = rank
+            heapq.heapify(self._waiters)
+
+    def _discard(self, entry):
+        try:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+        except ValueError:
+            pass
@@ -0,0 +1,223 @@
+import os
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+# 多轮会话配置，均可通过环境变量覆盖
+# 是否按 user_id 保留多轮会话
+SESSIONS_ENABLED = os.environ.get("SESSIONS_ENABLED", "1") != "0"
+# 同时保留的会话数上限，超出时淘汰最久未使用的会话
+SESSION_MAX_USERS = int(os.environ.get("SESSION_MAX_USERS", "500"))
+# 会话空闲多久后过期（秒）
+SESSION_TTL = float(os.environ.get("SESSION_TTL", "1800"))
+# 以文本形式拼入 prompt 的最近对话轮数
+SESSION_MAX_TURNS = int(os.environ.get("SESSION_MAX_TURNS", "4"))
+# Ollama context token 数上限，超过后丢弃 context，改用文本历史重新开始，
+# 应小于模型的 num_ctx，避免 Ollama 截断
+SESSION_MAX_CONTEXT_TOKENS = int(os.environ.get("SESSION_MAX_CONTEXT_TOKENS", "3000"))
+# 会话淘汰后保留的摘要条数与摘要长度（字符）
+SESSION_MAX_SUMMARIES = int(os.environ.get("SESSION_MAX_SUMMARIES", "5000"))
+SESSION_SUMMARY_CHARS = int(os.environ.get("SESSION_SUMMARY_CHARS", "300"))
+# 不超过该长度的问题视为追问（如“那利率呢”），检索时带上上一轮的问题
+FOLLOWUP_MAX_CHARS = int(os.environ.get("FOLLOWUP_MAX_CHARS", "12"))
+
+_THINK_RE = re.compile(r"<think>.*?</think>", re.S)
+
+
+def strip_think(text):
+    """去掉 deepseek-r1 输出中的 <think> 推理过程"""
+    return _THINK_RE.sub("", text).strip()
+
+
+class Session:
+    """
+    单个用户的会话：最近几轮问答、上一次生成返回的 Ollama context，
+    以及会话曾被淘汰时留下的摘要
+    """
+
+    def __init__(self, user_id, summary=""):
+        self.user_id = user_id
+        self.summary = summary
+        self.turns = []
+        # context 中已包含的轮数；FAQ、缓存等未经过 LLM 的回答不在 context 里，下次生成时以文本补上
+        self.synced = 0
+        # 用 array 保存 token id，每个 token 4 字节
+        self.context = None
+        # 生成 context 的模型档位，context 只对该模型有效
+        self.tier = None
+        self.updated = time.monotonic()
+
+    @property
+    def is_fresh(self):
+        """没有任何历史，回答与用户无关，可以使用语义缓存和请求合并"""
+        return not self.turns and not self.summary
+
+    def retrieval_query(self, query):
+        """追问通常省略主语，检索时把上一轮的问题拼在前面"""
+        if self.turns and len(query) <= FOLLOWUP_MAX_CHARS:
+            return f"{self.turns[-1][0]} {query}"
+        return query
+
+    def build_prompt(self, prompt, use_context=True, tier=None):
+        """
+        有 context 时只发送 context 之外的新内容；没有 context 时用摘要和最近几轮对话重建历史
+
+        Args:
+            use_context: 为 False 时总是以文本重建历史（例如改用命令行生成时）
+            tier: 本轮生成使用的模型档位；与生成 context 的档位不同时 context 无效，以文本重建历史
+
+        Returns:
+            (prompt, context token 列表或 None)
+        """
+        if tier is not None and tier != self.tier:
+            use_context = False
+        if use_context and self.context is not None:
+            history = self._format_turns(self.turns[self.synced:])
+            return history + prompt, self.context.tolist()
+        history = ""
+        if self.summary:
+            history += f"此前对话摘要：{self.summary}\n"
+        history += self._format_turns(self.turns[-SESSION_MAX_TURNS:])
+        return history + prompt, None
+
+    @staticmethod
+    def _format_turns(turns):
+        if not turns:
+            return ""
+        lines = ["此前的对话："]
+        for query, answer in turns:
+            lines.append(f"用户：{query}")
+            lines.append(f"助手：{answer}")
+        return "\n".join(lines) + "\n"
+
+    def summarize(self, turns=None):
+        """抽取式摘要：用户问过的问题和最后一个回答的开头，不调用 LLM"""
+        turns = self.turns if turns is None else turns
+        parts = [self.summary] if self.summary else []
+        if turns:
+            parts.append("用户问过：" + "；".join(query for query, _ in turns))
+            parts.append("最近回答：" + turns[-1][1][:120])
+        # 超长时保留最新的内容
+        return "。".join(parts)[-SESSION_SUMMARY_CHARS:]
+
+
+class SessionStore:
+    """
+    按 user_id 保存会话，LRU + TTL 淘汰；会话被淘汰时只留下一段摘要，
+    同一用户再次提问时以摘要作为历史，而不是从零开始
+    """
+
+    def __init__(self, max_users=SESSION_MAX_USERS, ttl=SESSION_TTL,
+                 max_context_tokens=SESSION_MAX_CONTEXT_TOKENS, max_summaries=SESSION_MAX_SUMMARIES):
+        self.max_users = max_users
+        self.ttl = ttl
+        self.max_context_tokens = max_context_tokens
+        self.max_summaries = max_summaries
+        self._sessions = OrderedDict()
+        self._summaries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.evictions = 0
+        self.resumed = 0
+        self.context_reused = 0
+        self.context_reset = 0
+        self.tier_switches = 0
+
+    def get(self, user_id):
+        """取出（或新建）用户的会话"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(user_id)
+            if session is not None:
+                self._sessions.move_to_end(user_id)
+                session.updated = now
+                return session
+            summary = self._summaries.pop(user_id, "")
+            if summary:
+                self.resumed += 1
+            session = Session(user_id, summary)
+            self._sessions[user_id] = session
+            while len(self._sessions) > self.max_users:
+                self._evict(next(iter(self._sessions)))
+            return session
+
+    def record(self, session, query, answer, context=None, generated=False, tier=None):
+        """
+        记录一轮问答
+
+        Args:
+            context: 本轮生成返回的 Ollama context，已包含此前全部对话
+            generated: 本轮是否由 LLM 生成；未经 LLM 的回答保留原 context，下次生成时以文本补上
+            tier: 本轮生成使用的模型档位
+        """
+        with self._lock:
+            session.turns.append((query, strip_think(answer)))
+            if generated:
+                if context and len(context) <= self.max_context_tokens:
+                    session.context = array("i", context)
+                    session.synced = len(session.turns)
+                    session.tier = tier
+                else:
+                    if session.context is not None:
+                        self.context_reset += 1
+                    session.context = None
+                    session.synced = 0
+            # 文本历史只保留最近几轮（有 context 时，尚未并入 context 的轮次除外），更早的并入摘要
+            unsynced = len(session.turns) - session.synced if session.context is not None else 0
+            keep = max(SESSION_MAX_TURNS, unsynced)
+            drop = len(session.turns) - keep
+            if drop > 0:
+                session.summary = session.summarize(session.turns[:drop])
+                session.turns = session.turns[drop:]
+                session.synced = max(0, session.synced - drop)
+            session.updated = time.monotonic()
+
+    def note_context_reuse(self):
+        with self._lock:
+            self.context_reused += 1
+
+    def note_tier_switch(self):
+        """本轮的模型档位与 context 不一致，以文本重建历史"""
+        with self._lock:
+            self.tier_switches += 1
+
+    def _expire(self, now):
+        # 会话按最近使用顺序排列，过期的都在最前面
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if now - session.updated <= self.ttl:
+                break
+            self._evict(user_id)
+
+    def _evict(self, user_id):
+        session = self._sessions.pop(user_id)
+        self.evictions += 1
+        summary = session.summarize()
+        if summary:
+            self._summaries[user_id] = summary
+            self._summaries.move_to_end(user_id)
+            while len(self._summaries) > self.max_summaries:
+                self._summaries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+            self._summaries.clear()
+
+    def stats(self):
+        with self._lock:
+            context_tokens = sum(len(s.context) for s in self._sessions.values() if s.context is not None)
+            return {
+                "sessions": len(self._sessions),
+                "max_users": self.max_users,
+                "summaries": len(self._summaries),
+                "context_tokens": context_tokens,
+                "evictions": self.evictions,
+                "resumed_from_summary": self.resumed,
+                "context_reused": self.context_reused,
+                "context_reset": self.context_reset,
+                "tier_switches": self.tier_switches,
+            }
@@ -0,0 +1,269 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app.domains import GENERAL_DOMAIN, GENERAL_SLUG, domain_slugs, query_domains
+from app.vector_store import VectorStore, as_lists
+
+# 并行查询各领域分片的线程数
+SHARD_QUERY_THREADS = int(os.environ.get("SHARD_QUERY_THREADS", "4"))
+# 只查询问题所属领域时，结果不足或最相关片段的距离超过该值则补查其余分片
+SHARD_FALLBACK_DISTANCE = float(os.environ.get("SHARD_FALLBACK_DISTANCE", "1.0"))
+
+_executor = ThreadPoolExecutor(max_workers=SHARD_QUERY_THREADS, thread_name_prefix="kb-shard")
+
+
+def _merge_get(results, include):
+    merged = {"ids": []}
+    for key in include:
+        merged[key] = []
+    for result in results:
+        merged["ids"].extend(result["ids"])
+        for key in include:
+            merged[key].extend(list(result[key]))
+    return merged
+
+
+class ShardedCollection(VectorStore):
+    """
+    按业务领域分片的知识库：每个领域一个 Chroma 集合（{name}_{领域标识}），片段按元数据中的 domain 写入对应分片。
+    实现了知识库代码用到的 Chroma 集合接口（count/get/query/upsert/update/delete），
+    检索时只并行查询问题所属的领域，结果按向量距离合并
+    """
+
+    sharded = True
+
+    def __init__(self, client, name, create=True):
+        self.name = name
+        self.slugs = domain_slugs()
+        self.shards = {}
+        for slug in self.slugs.values():
+            shard_name = f"{name}_{slug}"
+            self.shards[slug] = (
+                client.get_or_create_collection(shard_name) if create else client.get_collection(shard_name)
+            )
+        # 各分片的片段数：打开时读取一次，之后按本进程写入的增减维护，
+        # 其他进程写入后由 ActiveCollection 在内容代数变化时调用 refresh_counts 重新读取
+        self._counts = {}
+        self._lock = threading.Lock()
+
+        self.queries = 0
+        self.shards_queried = 0
+        self.fallbacks = 0
+        self.refresh_counts()
+
+    def _slug(self, meta):
+        return self.slugs.get((meta or {}).get("domain"), GENERAL_SLUG)
+
+    def refresh_counts(self):
+        """重新读取各分片的片段数"""
+        counts = {slug: shard.count() for slug, shard in self.shards.items()}
+        with self._lock:
+            self._counts = counts
+
+    def _add_count(self, slug, delta):
+        if delta:
+            with self._lock:
+                self._counts[slug] = max(0, self._counts.get(slug, 0) + delta)
+
+    def _cached_counts(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def _targets(self, where):
+        # where 按 domain 过滤时只访问该领域的分片
+        if where and "domain" in where:
+            return [self.slugs.get(where["domain"], GENERAL_SLUG)]
+        return list(self.shards)
+
+    def count(self):
+        with self._lock:
+            return sum(self._counts.values())
+
+    def domain_counts(self):
+        """各领域的片段数（按写入增减维护，不访问分片）"""
+        counts = self._cached_counts()
+        return {domain: counts.get(slug, 0) for domain, slug in self.slugs.items()}
+
+    def get(self, ids=None, where=None, include=("metadatas", "documents"), limit=None, offset=0):
+        include = list(include)
+        targets = self._targets(where)
+        if ids is not None or (limit is None and not offset):
+            return _merge_get(
+                [self.shards[slug].get(ids=ids, where=where, include=include) for slug in targets], include
+            )
+        # 分页：按分片顺序拼接，直接用各分片自己的 offset/limit 取数据。
+        # 只有整个被跳过的分片才需要知道匹配数，按 where 过滤时最多取 offset 个 id，不扫描整个分片
+        results = []
+        for slug in targets:
+            shard = self.shards[slug]
+            if limit is None:
+                page = shard.get(where=where, include=include)
+                skipped = min(offset, len(page["ids"]))
+                page = {key: list(page[key])[skipped:] for key in ["ids"] + include}
+            else:
+                page = shard.get(where=where, include=include, limit=limit, offset=offset)
+                if page["ids"] or not offset:
+                    skipped = offset
+                else:
+                    # 本分片的匹配数不超过 offset，整个跳过
+                    skipped = shard.count() if not where else len(
+                        shard.get(where=where, include=[], limit=offset)["ids"]
+                    )
+            offset = max(0, offset - skipped)
+            if page["ids"]:
+                results.append(page)
+                if limit is not None:
+                    limit -= len(page["ids"])
+                    if limit <= 0:
+                        break
+        return _merge_get(results, include)
+
+    def route_domains(self, query):
+        """问题涉及的领域，为空表示查询全部分片"""
+        return query_domains(query)
+
+    def query(self, query_embeddings, n_results=10, where=None, include=None, domains=None):
+        """
+        Args:
+            domains: 问题所属的领域；为空时查询全部分片。结果不足 n_results
+                或最小距离超过 SHARD_FALLBACK_DISTANCE 时补查其余分片
+
+        Returns:
+            与 Chroma collection.query 相同的结构
+        """
+        include = list(include or ("metadatas", "documents", "distances"))
+        # 各分片共用同一份列表，只转换一次
+        query_embeddings = as_lists(query_embeddings)
+        counts = self._cached_counts()
+        if domains and not where:
+            first = {self.slugs[d] for d in domains if d in self.slugs} | {self.slugs[GENERAL_DOMAIN]}
+        else:
+            first = set(self._targets(where))
+        first = [slug for slug in self.shards if slug in first and counts.get(slug)]
+
+        merged = self._fan_out(first, query_embeddings, n_results, where, include)
+        rest = [slug for slug in self.shards if slug not in first and counts.get(slug)]
+        if rest and domains and not where and self._needs_fallback(merged, n_results):
+            with self._lock:
+                self.fallbacks += 1
+            more = self._fan_out(rest, query_embeddings, n_results, where, include)
+            merged = [self._top(a + b, n_results) for a, b in zip(merged, more)]
+        with self._lock:
+            self.queries += 1
+
+        result = {"ids": [[row["id"] for row in rows] for rows in merged]}
+        for key, field in (("documents", "document"), ("metadatas", "metadata"), ("distances", "distance")):
+            result[key] = [[row[field] for row in rows] for rows in merged] if key in include else None
+        return result
+
+    def _fan_out(self, slugs, query_embeddings, n_results, where, include):
+        """并行查询多个分片，返回每个问题向量的候选 [{"id", "document", "metadata", "distance"}]"""
+        if "distances" not in include:
+            include = include + ["distances"]
+        with self._lock:
+            self.shards_queried += len(slugs)
+        results = list(_executor.map(
+            lambda slug: self.shards[slug].query(
+                query_embeddings=query_embeddings, n_results=n_results, where=where, include=include
+            ),
+            slugs,
+        ))
+        merged = []
+        for i in range(len(query_embeddings)):
+            rows = []
+            for result in results:
+                for j, doc_id in enumerate(result["ids"][i]):
+                    rows.append({
+                        "id": doc_id,
+                        "document": result["documents"][i][j] if result.get("documents") else None,
+                        "metadata": result["metadatas"][i][j] if result.get("metadatas") else None,
+                        "distance": result["distances"][i][j],
+                    })
+            merged.append(self._top(rows, n_results))
+        return merged
+
+    @staticmethod
+    def _top(rows, n):
+        return sorted(rows, key=lambda row: row["distance"])[:n]
+
+    @staticmethod
+    def _needs_fallback(merged, n_results):
+        return any(len(rows) < n_results or rows[0]["distance"] > SHARD_FALLBACK_DISTANCE for rows in merged)
+
+    def upsert(self, ids, documents, embeddings, metadatas):
+        groups = {}
+        for i, meta in enumerate(metadatas):
+            groups.setdefault(self._slug(meta), []).append(i)
+        for slug, idx in groups.items():
+            group_ids = [ids[i] for i in idx]
+            target = self.shards[slug]
+            # 领域变化的片段从原分片中移除，每个片段只存在于一个分片中
+            for other, shard in self.shards.items():
+                if other == slug or not self._counts.get(other):
+                    continue
+                moved = shard.get(ids=group_ids, include=[])["ids"]
+                if moved:
+                    shard.delete(ids=moved)
+                    self._add_count(other, -len(moved))
+            existing = target.get(ids=group_ids, include=[])["ids"]
+            target.upsert(
+                ids=group_ids,
+                documents=[documents[i] for i in idx],
+                embeddings=as_lists([embeddings[i] for i in idx]),
+                metadatas=[metadatas[i] for i in idx],
+            )
+            # 分片中原来没有的 id 才增加片段数
+            self._add_count(slug, len(set(group_ids)) - len(existing))
+
+    add = upsert
+
+    def update(self, ids, metadatas=None, documents=None, embeddings=None):
+        """
+        调用方保证片段的领域不变（领域变化的片段应重新 upsert）。
+        给出 metadatas 时按其中的 domain 定位分片，否则按 id 查找片段所在的分片
+        """
+        if metadatas is not None:
+            groups = {}
+            for i, meta in enumerate(metadatas):
+                groups.setdefault(self._slug(meta), []).append(i)
+        else:
+            groups = self._locate(ids)
+        for slug, idx in groups.items():
+            kwargs = {}
+            if metadatas is not None:
+                kwargs["metadatas"] = [metadatas[i] for i in idx]
+            if documents is not None:
+                kwargs["documents"] = [documents[i] for i in idx]
+            if embeddings is not None:
+                kwargs["embeddings"] = as_lists([embeddings[i] for i in idx])
+            self.shards[slug].update(ids=[ids[i] for i in idx], **kwargs)
+
+    def _locate(self, ids):
+        """分片 -> ids 中位于该分片的下标；不存在的 id 忽略"""
+        positions = {}
+        for i, chunk_id in enumerate(ids):
+            positions.setdefault(chunk_id, []).append(i)
+        groups = {}
+        for slug, shard in self.shards.items():
+            for chunk_id in shard.get(ids=list(positions), include=[])["ids"]:
+                groups.setdefault(slug, []).extend(positions[chunk_id])
+        return groups
+
+    def delete(self, ids=None, where=None):
+        for slug in self._targets(where):
+            shard = self.shards[slug]
+            # 先取出实际存在的 id，按删除的数量减少片段数
+            removed = shard.get(ids=ids, where=where, include=[])["ids"]
+            if removed:
+                shard.delete(ids=removed)
+                self._add_count(slug, -len(removed))
+
+    def stats(self):
+        return {
+            "store": "chroma_sharded",
+            "domains": self.domain_counts(),
+            "queries": self.queries,
+            "avg_shards_per_query": round(self.shards_queried / self.queries, 2) if self.queries else 0.0,
+            "fallbacks": self.fallbacks,
+        }
@@ -0,0 +1,162 @@
+import asyncio
+import hashlib
+import re
+
+from app.scheduler import PRIORITIES
+
+_PUNCT_RE = re.compile(r"[\s?？!！.。,，:：;；]+")
+
+
+def flight_key(query, context):
+    """归一化后的问题 + 背景知识哈希，相同 key 的请求生成结果必然相同"""
+    normalized = _PUNCT_RE.sub(" ", query.lower()).strip()
+    return hashlib.sha1(f"{normalized}\0{context}".encode("utf-8")).hexdigest()
+
+
+class StreamBuffer:
+    """
+    进行中生成的可见输出：订阅者先收到已生成的部分，再实时收到后续片段，
+    使加入进行中生成的请求也能流式输出
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+        self._changed = asyncio.Event()
+
+    def publish(self, text):
+        self.chunks.append(text)
+        self._notify()
+
+    def close(self):
+        self.closed = True
+        self._notify()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def subscribe(self):
+        i = 0
+        while True:
+            while i < len(self.chunks):
+                yield self.chunks[i]
+                i += 1
+            if self.closed:
+                return
+            await self._changed.wait()
+
+
+async def run_with_relay(aw, buffer, on_delta):
+    """等待 aw 完成，同时把 buffer 中的输出逐段转交给 on_delta"""
+    if buffer is None or on_delta is None:
+        return await aw
+
+    async def relay():
+        async for chunk in buffer.subscribe():
+            on_delta(chunk)
+
+    relay_task = asyncio.ensure_future(relay())
+    try:
+        result = await aw
+        # 生成结束时 buffer 已关闭，等待剩余片段转交完毕
+        await relay_task
+        return result
+    finally:
+        relay_task.cancel()
+
+
+class Flight:
+    """
+    一次生成的调度参数。合并的请求共享同一次生成，取全部等待方中最晚的截止时间和最高的优先级：
+    排队期间有等待方加入时，生成名额的排队按新的优先级重新排序、按新的截止时间继续等待；
+    生成开始后的时限按开始时的截止时间计算，之后加入的等待方不再延长
+    """
+
+    def __init__(self, deadline, priority="interactive"):
+        self.deadline = deadline
+        self.priority = priority
+        # 排队中由 GenerationScheduler 设置，参数变化时调用
+        self.on_change = None
+
+    def join(self, deadline, priority):
+        changed = False
+        if deadline is not None and (self.deadline is None or deadline > self.deadline):
+            self.deadline = deadline
+            changed = True
+        if PRIORITIES[priority] < PRIORITIES[self.priority]:
+            self.priority = priority
+            changed = True
+        if changed and self.on_change is not None:
+            self.on_change()
+
+
+class SingleFlight:
+    """
+    合并相同 key 的并发请求：第一个请求执行生成，其余请求等待并共享同一结果。
+    每个等待方可以被单独取消，只有所有等待方都离开时才取消底层生成
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.executions = 0
+        # 因合并而省下的生成次数
+        self.saved = 0
+
+    @property
+    def in_flight(self):
+        return len(self._calls)
+
+    async def do(self, key, fn, timeout=None, buffer=None, on_delta=None, flight=None):
+        """
+        Args:
+            key: 合并键
+            fn: 无参协程函数，只有第一个请求会调用
+            timeout: 本等待方最多等待的秒数，超时只影响自己
+            buffer: fn 写入输出的 StreamBuffer，由发起方提供；加入进行中的生成时使用发起方的 buffer
+            on_delta: 流式输出回调，逐段收到生成中的输出（加入时先补发已生成的部分）
+            flight: 本等待方的 Flight；发起方的 Flight 由 fn 用于排队和计算生成时限，
+                加入进行中的生成时把本等待方的截止时间和优先级合并进去
+
+        Returns:
+            (结果, 是否为共享结果)
+        """
+        call = self._calls.get(key)
+        shared = call is not None
+        if call is not None and flight is not None and call["flight"] is not None:
+            call["flight"].join(flight.deadline, flight.priority)
+        if call is None:
+            call = {"task": asyncio.ensure_future(fn()), "waiters": 0, "buffer": buffer, "flight": flight}
+            self._calls[key] = call
+            call["task"].add_done_callback(lambda _: self._forget(key, call))
+            if buffer is not None:
+                # 生成结束、出错或被取消时都关闭 buffer，订阅者随之结束
+                call["task"].add_done_callback(lambda _: buffer.close())
+            self.executions += 1
+        else:
+            self.saved += 1
+
+        call["waiters"] += 1
+        try:
+            # shield 保证单个等待方被取消时不会取消共享的生成
+            result = await asyncio.wait_for(
+                run_with_relay(asyncio.shield(call["task"]), call["buffer"], on_delta), timeout
+            )
+            return result, shared
+        finally:
+            call["waiters"] -= 1
+            if call["waiters"] == 0 and not call["task"].done():
+                # 没有人再等待这个结果，取消生成以释放资源
+                call["task"].cancel()
+                self._forget(key, call)
+
+    def stats(self):
+        return {
+            "in_flight": len(self._calls),
+            "executions": self.executions,
+            "generations_saved": self.saved,
+        }
+
+    def _forget(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
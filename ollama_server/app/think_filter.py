@@ -0,0 +1,108 @@
+OPEN_TAG = "<think>"
+CLOSE_TAG = "</think>"
+
+
+def _partial_tag_len(text, tag):
+    """text 末尾可能是 tag 前缀的最大长度，这部分需要等下一个片段才能确定"""
+    for k in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:k]):
+            return k
+    return 0
+
+
+class ThinkFilter:
+    """
+    流式过滤 deepseek-r1 输出中 <think>...</think> 的推理内容，只放行可见的回答。
+    标签可能被拆在相邻的两个片段里，因此疑似标签前缀的内容会暂存到下一个片段
+    """
+
+    def __init__(self, show=False, hold=False):
+        """
+        Args:
+            show: 为 True 时原样放行（包括推理内容），仍然统计推理内容的长度
+            hold: 推理模型使用。聊天模板可能已经打开了 <think>，输出中只有结束标签，
+                因此见到第一个标签之前暂存全部输出：先见到 </think> 时之前的内容算作推理，
+                先见到 <think> 或生成结束都没有标签时按可见内容放行
+        """
+        self.show = show
+        self.holding = hold
+        self.in_think = False
+        self.reasoning_chars = 0
+        self.visible_chars = 0
+        self._pending = ""
+        self._started = False
+
+    def feed(self, text):
+        """输入一个生成片段，返回其中可见的部分（可能为空）"""
+        visible = self._parse(text)
+        return self._emit(text if self.show else visible)
+
+    @property
+    def held_chars(self):
+        """等待第一个标签时暂存的字符数，多半是推理内容"""
+        return len(self._pending) if self.holding else 0
+
+    def release(self):
+        """
+        不再等待第一个标签，例如 Ollama 把推理内容放在单独的 thinking 字段、输出中不会有标签；
+        暂存的内容随下一个片段放行
+        """
+        self.holding = False
+
+    def _parse(self, text):
+        self._pending += text
+        out = []
+        while self._pending:
+            if self.in_think:
+                idx = self._pending.find(CLOSE_TAG)
+                if idx >= 0:
+                    self.reasoning_chars += idx
+                    self._pending = self._pending[idx + len(CLOSE_TAG):]
+                    self.in_think = False
+                    continue
+                keep = _partial_tag_len(self._pending, CLOSE_TAG)
+                self.reasoning_chars += len(self._pending) - keep
+                self._pending = self._pending[len(self._pending) - keep:]
+                break
+
+            idx = self._pending.find(OPEN_TAG)
+            stray = self._pending.find(CLOSE_TAG)
+            if stray >= 0 and (idx < 0 or stray < idx):
+                if self.holding:
+                    # 模板已经打开了 <think>：结束标签之前暂存的内容都是推理
+                    self.reasoning_chars += stray
+                    self.holding = False
+                else:
+                    # 已经输出过可见内容之后出现的多余结束标签，只丢弃标签本身
+                    out.append(self._pending[:stray])
+                self._pending = self._pending[stray + len(CLOSE_TAG):]
+                continue
+            if idx >= 0:
+                out.append(self._pending[:idx])
+                self._pending = self._pending[idx + len(OPEN_TAG):]
+                self.in_think = True
+                self.holding = False
+                continue
+            if self.holding:
+                break
+            keep = max(_partial_tag_len(self._pending, OPEN_TAG), _partial_tag_len(self._pending, CLOSE_TAG))
+            out.append(self._pending[:len(self._pending) - keep])
+            self._pending = self._pending[len(self._pending) - keep:]
+            break
+        return "".join(out)
+
+    def finish(self):
+        """生成结束时调用，返回暂存的剩余可见内容"""
+        rest, self._pending = self._pending, ""
+        if self.in_think:
+            self.reasoning_chars += len(rest)
+            rest = ""
+        return "" if self.show else self._emit(rest)
+
+    def _emit(self, text):
+        if not self._started:
+            # 推理结束后回答前通常有空行
+            text = text.lstrip()
+            self._started = bool(text)
+        self.visible_chars += len(text)
+        return text
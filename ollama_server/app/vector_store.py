@@ -0,0 +1,452 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，改用 msvcrt
+    fcntl = None
+    try:
+        import msvcrt
+    except ImportError:
+        msvcrt = None
+
+logger = logging.getLogger("ollama_server")
+
+# 内存映射存储：读取端检查其他进程写入的间隔（秒）
+MMAP_SYNC_SECONDS = float(os.environ.get("MMAP_SYNC_SECONDS", "1.0"))
+# 精确检索时每次转换为 float32 参与矩阵乘法的行数；块小一些能留在 CPU 缓存中，转换更快
+MMAP_QUERY_BLOCK = int(os.environ.get("MMAP_QUERY_BLOCK", "4096"))
+
+
+@contextmanager
+def file_lock(path, exclusive=True):
+    """
+    跨进程的文件锁。Linux/macOS 用 flock，支持共享锁；
+    Windows 用 msvcrt.locking 锁住文件第一个字节，只有排他锁，共享锁同样按排他锁处理；
+    两者都不可用时不加锁，只打印一次警告
+    """
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        elif msvcrt is not None:
+            f.seek(0)
+            while True:
+                try:
+                    # LK_LOCK 重试约 10 秒仍拿不到锁时抛出 OSError，继续等待
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            _warn_no_lock()
+            yield
+
+
+_warned_no_lock = False
+
+
+def _warn_no_lock():
+    global _warned_no_lock
+    if not _warned_no_lock:
+        _warned_no_lock = True
+        logger.warning("当前平台不支持文件锁，多个进程同时写入知识库时可能互相覆盖")
+
+
+def as_lists(embeddings):
+    """
+    NumPy 向量在交给 Chroma 前转为嵌套列表（chromadb 0.4 只接受列表）；
+    服务端其余部分和 MmapStore 始终传递 NumPy 数组，不做列表往返
+    """
+    if embeddings is None or isinstance(embeddings, list) and (not embeddings or isinstance(embeddings[0], list)):
+        return embeddings
+    return np.asarray(embeddings, dtype=np.float32).tolist()
+
+
+class VectorStore:
+    """
+    知识库存储接口，沿用 Chroma 集合的调用方式（ids/documents/metadatas/embeddings 参数与返回结构），
+    检索、批量导入、index_kb 和版本校验都只依赖这些方法
+    """
+
+    name = "base"
+
+    def count(self):
+        raise NotImplementedError
+
+    def get(self, ids=None, where=None, include=("metadatas", "documents"), limit=None, offset=0):
+        raise NotImplementedError
+
+    def query(self, query_embeddings, n_results=10, where=None, include=None):
+        raise NotImplementedError
+
+    def upsert(self, ids, documents, embeddings, metadatas):
+        raise NotImplementedError
+
+    def update(self, ids, metadatas=None, documents=None, embeddings=None):
+        raise NotImplementedError
+
+    def delete(self, ids=None, where=None):
+        raise NotImplementedError
+
+    def stats(self):
+        return {"store": type(self).__name__}
+
+
+class ChromaStore(VectorStore):
+    """Chroma 集合（SQLite + HNSW 近似检索）"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.name = collection.name
+
+    def count(self):
+        return self.collection.count()
+
+    def get(self, ids=None, where=None, include=("metadatas", "documents"), limit=None, offset=0):
+        return self.collection.get(ids=ids, where=where, include=list(include), limit=limit, offset=offset)
+
+    def query(self, query_embeddings, n_results=10, where=None, include=None):
+        kwargs = {"where": where} if where else {}
+        if include is not None:
+            kwargs["include"] = list(include)
+        return self.collection.query(query_embeddings=as_lists(query_embeddings), n_results=n_results, **kwargs)
+
+    def upsert(self, ids, documents, embeddings, metadatas):
+        self.collection.upsert(ids=ids, documents=documents, embeddings=as_lists(embeddings), metadatas=metadatas)
+
+    def update(self, ids, metadatas=None, documents=None, embeddings=None):
+        kwargs = {key: value for key, value in
+                  (("metadatas", metadatas), ("documents", documents), ("embeddings", as_lists(embeddings)))
+                  if value is not None}
+        self.collection.update(ids=ids, **kwargs)
+
+    def delete(self, ids=None, where=None):
+        self.collection.delete(ids=ids, where=where)
+
+
+class MmapStore(VectorStore):
+    """
+    进程内精确检索：归一化向量以 float16 保存在内存映射文件中，检索为一次矩阵乘法加 argpartition 取 top-k；
+    正文和元数据保存在 JSON Lines 附属文件中，按偏移量读取命中的几条。
+    向量、偏移量和删除标记都通过 mmap 读取，多个 uvicorn worker 共享同一份操作系统页缓存。
+
+    文件只追加：upsert 在末尾追加新行并把旧行标记为删除，delete 只写删除标记；
+    写入时持有文件锁，manifest（store.json）记录已提交的行数，读取端发现行数增加后增量加载新行。
+    删除标记累积较多时，构建一个新版本即可压缩
+    """
+
+    def __init__(self, path, name, dim=None):
+        self.path = path
+        self.name = name
+        os.makedirs(path, exist_ok=True)
+        self._files = {
+            key: os.path.join(path, fname) for key, fname in (
+                ("manifest", "store.json"), ("vectors", "vectors.f16"), ("deleted", "deleted.u8"),
+                ("offsets", "offsets.u64"), ("records", "records.jsonl"), ("keys", "keys.jsonl"),
+                ("lock", "store.lock"),
+            )
+        }
+        for key in ("vectors", "deleted", "offsets", "records", "keys", "lock"):
+            open(self._files[key], "ab").close()
+        manifest = self._read_manifest()
+        self.dim = manifest.get("dim") or dim
+        self._rows = 0
+        self._keys_pos = 0
+        self._ids = []
+        # id -> 最新的行号；source -> 行号集合，供 where={"source": ...} 使用
+        self._row_of = {}
+        self._rows_of_source = {}
+        # (向量, 删除标记, 记录偏移量) 三个映射作为一个整体替换，检索时不持锁也能读到一致的视图
+        self._view = None
+        self._mtime = None
+        self._checked = 0.0
+        self._lock = threading.RLock()
+        self._sync(force=True)
+
+    # ---- 读取端 ----
+
+    def _read_manifest(self):
+        try:
+            with open(self._files["manifest"], encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _sync(self, force=False):
+        """加载其他进程（或本进程）新提交的行"""
+        now = time.monotonic()
+        if not force and now - self._checked < MMAP_SYNC_SECONDS:
+            return
+        with self._lock:
+            self._checked = now
+            try:
+                mtime = os.path.getmtime(self._files["manifest"])
+            except OSError:
+                return
+            if not force and mtime == self._mtime:
+                return
+            self._mtime = mtime
+            manifest = self._read_manifest()
+            rows = manifest.get("rows", 0)
+            self.dim = manifest.get("dim", self.dim)
+            if rows > self._rows:
+                with open(self._files["keys"], "rb") as f:
+                    f.seek(self._keys_pos)
+                    for row in range(self._rows, rows):
+                        line = f.readline()
+                        chunk_id, source = json.loads(line)
+                        self._ids.append(chunk_id)
+                        self._row_of[chunk_id] = row
+                        self._rows_of_source.setdefault(source, set()).add(row)
+                    self._keys_pos = f.tell()
+                self._rows = rows
+            if self._rows:
+                # 只读映射，页面由操作系统在进程间共享；写入端对删除标记的修改对映射立即可见
+                self._view = (
+                    np.memmap(self._files["vectors"], dtype=np.float16, mode="r", shape=(self._rows, self.dim)),
+                    np.memmap(self._files["deleted"], dtype=np.uint8, mode="r", shape=(self._rows,)),
+                    np.memmap(self._files["offsets"], dtype=np.uint64, mode="r", shape=(self._rows,)),
+                )
+
+    def _live(self, row):
+        return row is not None and not self._view[1][row]
+
+    def _record(self, row):
+        with open(self._files["records"], "rb") as f:
+            f.seek(int(self._view[2][row]))
+            return json.loads(f.readline())
+
+    def _match(self, ids=None, where=None):
+        """满足条件的有效行号，按行号升序"""
+        if self._view is None:
+            return []
+        if ids is not None:
+            rows = sorted(row for row in {self._row_of.get(chunk_id) for chunk_id in ids} if self._live(row))
+        elif where and "source" in where:
+            rows = sorted(row for row in self._rows_of_source.get(where["source"], ()) if self._live(row))
+        else:
+            rows = np.flatnonzero(self._view[1] == 0).tolist()
+        other = {key: value for key, value in (where or {}).items() if key != "source"}
+        if other:
+            rows = [row for row in rows
+                    if all(self._record(row)["metadata"].get(key) == value for key, value in other.items())]
+        return rows
+
+    def count(self):
+        self._sync()
+        return int(self._view[1].size - np.count_nonzero(self._view[1])) if self._view is not None else 0
+
+    def get(self, ids=None, where=None, include=("metadatas", "documents"), limit=None, offset=0):
+        self._sync()
+        with self._lock:
+            rows = self._match(ids, where)[offset:]
+            if limit is not None:
+                rows = rows[:limit]
+            return self._rows_result(rows, include)
+
+    def _rows_result(self, rows, include):
+        result = {"ids": [self._ids[row] for row in rows]}
+        if "documents" in include or "metadatas" in include:
+            records = [self._record(row) for row in rows]
+            if "documents" in include:
+                result["documents"] = [record["document"] for record in records]
+            if "metadatas" in include:
+                result["metadatas"] = [record["metadata"] for record in records]
+        if "embeddings" in include:
+            result["embeddings"] = [self._view[0][row].astype(np.float32).tolist() for row in rows]
+        return result
+
+    def query(self, query_embeddings, n_results=10, where=None, include=None):
+        """
+        精确 top-k；distances 为归一化向量的平方 L2 距离（2 - 2·cos），与 Chroma 默认的 l2 度量一致
+        """
+        include = list(include or ("metadatas", "documents", "distances"))
+        self._sync()
+        # 不持锁：并发的检索各自读取同一份只读映射
+        with self._lock:
+            view = self._view
+            candidates = np.asarray(self._match(where=where), dtype=np.int64) if where else None
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        # 不原地修改调用方传入的数组
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for q in queries:
+            rows, scores = self._top_k(view, q, n_results, candidates)
+            part = self._rows_result(rows, include)
+            result["ids"].append(part["ids"])
+            result["documents"].append(part.get("documents"))
+            result["metadatas"].append(part.get("metadatas"))
+            result["distances"].append([2.0 - 2.0 * score for score in scores])
+        for key in ("documents", "metadatas", "distances"):
+            if key not in include:
+                result[key] = None
+        return result
+
+    @staticmethod
+    def _top_k(view, q, k, candidates=None):
+        if view is None:
+            return [], []
+        vectors, deleted, _ = view
+        if candidates is not None:
+            scores = vectors[candidates].astype(np.float32) @ q
+            rows = candidates
+        else:
+            # 分块转换为 float32 后做矩阵乘法（numpy 的 float16 矩阵乘法没有 BLAS 加速）
+            scores = np.empty(len(vectors), dtype=np.float32)
+            for start in range(0, len(vectors), MMAP_QUERY_BLOCK):
+                block = vectors[start:start + MMAP_QUERY_BLOCK]
+                scores[start:start + len(block)] = block.astype(np.float32) @ q
+            scores[deleted.view(bool)] = -np.inf
+            rows = None
+        k = min(k, int(np.count_nonzero(np.isfinite(scores))))
+        if k <= 0:
+            return [], []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        picked = rows[top] if rows is not None else top
+        return [int(row) for row in picked], [float(scores[i]) for i in top]
+
+    # ---- 写入端 ----
+
+    @contextmanager
+    def _write_lock(self):
+        # 服务端批量导入与 index_kb 可能同时写入，用文件锁串行化
+        with self._lock, file_lock(self._files["lock"]):
+            self._sync(force=True)
+            self._truncate_uncommitted()
+            yield
+
+    def _truncate_uncommitted(self):
+        """
+        截掉各文件中未提交的尾部：写入中途出错或进程崩溃时追加的字节没有记入 manifest，
+        不截掉的话下一次追加的行会与其他文件错位
+        """
+        manifest = self._read_manifest()
+        rows = manifest.get("rows", 0)
+        records_bytes = manifest.get("records_bytes")
+        if records_bytes is None:
+            # 旧版本的 manifest 没有记录文件长度，按最后一行记录的结尾计算
+            records_bytes = 0
+            if rows:
+                with open(self._files["records"], "rb") as f:
+                    f.seek(int(self._view[2][rows - 1]))
+                    f.readline()
+                    records_bytes = f.tell()
+        sizes = {
+            "vectors": rows * (self.dim or 0) * 2,
+            "deleted": rows,
+            "offsets": rows * 8,
+            "records": records_bytes,
+            # _sync 读到的最后一个已提交 id 的结尾
+            "keys": manifest.get("keys_bytes", self._keys_pos),
+        }
+        for key, size in sizes.items():
+            if os.path.getsize(self._files[key]) > size:
+                with open(self._files[key], "r+b") as f:
+                    f.truncate(size)
+
+    def upsert(self, ids, documents, embeddings, metadatas):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        with self._write_lock():
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"向量维度 {vectors.shape[1]} 与存储的维度 {self.dim} 不一致")
+            replaced = [self._row_of[chunk_id] for chunk_id in ids if chunk_id in self._row_of]
+
+            with open(self._files["records"], "ab") as f:
+                offsets = []
+                for chunk_id, doc, meta in zip(ids, documents, metadatas):
+                    offsets.append(f.tell())
+                    line = json.dumps({"document": doc, "metadata": meta or {}}, ensure_ascii=False)
+                    f.write(line.encode("utf-8") + b"\n")
+            with open(self._files["keys"], "ab") as f:
+                for chunk_id, meta in zip(ids, metadatas):
+                    line = json.dumps([chunk_id, (meta or {}).get("source")], ensure_ascii=False)
+                    f.write(line.encode("utf-8") + b"\n")
+            with open(self._files["vectors"], "ab") as f:
+                f.write(vectors.astype(np.float16).tobytes())
+            with open(self._files["offsets"], "ab") as f:
+                f.write(np.asarray(offsets, dtype=np.uint64).tobytes())
+            with open(self._files["deleted"], "ab") as f:
+                f.write(bytes(len(ids)))
+            self._commit(self._rows + len(ids))
+            self._sync(force=True)
+            # 新行提交后再删除旧行，读取端不会看到片段缺失
+            self._mark_deleted(replaced)
+
+    add = upsert
+
+    def update(self, ids, metadatas=None, documents=None, embeddings=None):
+        """追加一份新行：未提供的字段沿用原值"""
+        self._sync()
+        with self._lock:
+            rows = [self._row_of.get(chunk_id) for chunk_id in ids]
+            keep = [i for i, row in enumerate(rows) if self._live(row)]
+            if not keep:
+                return
+            records = [self._record(rows[i]) for i in keep]
+            self.upsert(
+                ids=[ids[i] for i in keep],
+                documents=[documents[i] for i in keep] if documents is not None
+                else [record["document"] for record in records],
+                embeddings=[embeddings[i] for i in keep] if embeddings is not None
+                else self._view[0][[rows[i] for i in keep]].astype(np.float32),
+                metadatas=[metadatas[i] for i in keep] if metadatas is not None
+                else [record["metadata"] for record in records],
+            )
+
+    def delete(self, ids=None, where=None):
+        with self._write_lock():
+            self._mark_deleted(self._match(ids, where) if ids is not None or where else [])
+
+    def _mark_deleted(self, rows):
+        if not rows:
+            return
+        with open(self._files["deleted"], "r+b") as f:
+            for row in rows:
+                f.seek(row)
+                f.write(b"\x01")
+        # 更新 manifest 的修改时间，通知读取端
+        self._commit(self._rows)
+
+    def _commit(self, rows):
+        tmp_path = f"{self._files['manifest']}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "rows": rows,
+                "dim": self.dim,
+                # 已提交部分的长度，写入前据此截掉未提交的尾部
+                "records_bytes": os.path.getsize(self._files["records"]),
+                "keys_bytes": os.path.getsize(self._files["keys"]),
+                "updated_at": time.time(),
+            }, f)
+        os.replace(tmp_path, self._files["manifest"])
+
+    def stats(self):
+        self._sync()
+        deleted = int(np.count_nonzero(self._view[1])) if self._view is not None else 0
+        return {
+            "store": "mmap",
+            "rows": self._rows,
+            "live": self._rows - deleted,
+            "deleted": deleted,
+            "dim": self.dim,
+            "vector_bytes": self._rows * (self.dim or 0) * 2,
+        }
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import os
+import signal
+import threading
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+from app.cancellation import time_left
+from app.ollama_client import generate_response_async, is_error_response
+from app.scheduler import SchedulerRejected
+
+# 启动预热时是否执行一次极短的生成，让 Ollama 提前把模型加载进内存
+WARMUP_GENERATION = os.environ.get("WARMUP_GENERATION", "1") != "0"
+# 预热生成的超时时间（秒），首次加载 7B 模型可能较慢
+WARMUP_TIMEOUT = float(os.environ.get("WARMUP_TIMEOUT", "120"))
+WARMUP_PROMPT = "请只回复一个字：好"
+# 收到 SIGTERM 后先让 /ready 返回 503 的时长（秒），给负载均衡摘除实例留出时间，
+# 之后才停止接收新连接并等待进行中的请求完成
+SHUTDOWN_DRAIN_SECONDS = float(os.environ.get("SHUTDOWN_DRAIN_SECONDS", "0"))
+
+logger = logging.getLogger("ollama_server")
+
+
+class Readiness:
+    """
+    服务就绪状态：启动预热完成后就绪，收到 SIGTERM 后进入排空状态，
+    /ready 只在就绪且未排空时返回 200
+    """
+
+    def __init__(self):
+        self.warmed_up = False
+        self.draining = False
+        self.warmup = {}
+
+    @property
+    def ready(self):
+        return self.warmed_up and not self.draining
+
+    async def run_warmup(self, embed_model, scheduler, generation=WARMUP_GENERATION, timeout=WARMUP_TIMEOUT):
+        """执行一次 encode 和一次极短的生成，使第一个真实请求不必承担冷启动开销"""
+        try:
+            start = time.perf_counter()
+            await run_in_threadpool(embed_model.encode, ["预热"])
+            self.warmup["encode_seconds"] = round(time.perf_counter() - start, 3)
+
+            if generation:
+                start = time.perf_counter()
+                deadline = time.monotonic() + timeout
+                try:
+                    # 与普通请求共用生成名额，预热期间的真实请求按优先级先执行
+                    async with scheduler.slot("batch", deadline):
+                        answer = await generate_response_async(WARMUP_PROMPT, timeout=time_left(deadline))
+                    ok = not is_error_response(answer)
+                except SchedulerRejected:
+                    ok = False
+                self.warmup["generation_seconds"] = round(time.perf_counter() - start, 3)
+                self.warmup["generation_ok"] = ok
+                if not ok:
+                    # Ollama 不可用时仍然就绪：FAQ、缓存和检索接口可以正常服务
+                    logger.warning("预热生成失败，Ollama 可能尚未启动")
+        except Exception as e:
+            self.warmup["error"] = str(e)
+            logger.exception("预热失败，服务保持未就绪")
+            return
+        self.warmed_up = True
+        logger.info("预热完成 pid=%s %s", os.getpid(), self.warmup)
+
+    def install_drain_handler(self, delay=SHUTDOWN_DRAIN_SECONDS):
+        """
+        接管 SIGTERM：立即标记为排空（/ready 返回 503），delay 秒后再交给
+        uvicorn 原有的处理函数，由它停止接收新连接并等待进行中的请求完成
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return
+        previous = signal.getsignal(signal.SIGTERM)
+        if not callable(previous):
+            return
+        loop = asyncio.get_running_loop()
+
+        def handle(sig, frame):
+            if self.draining:
+                # 重复收到 SIGTERM 时不再等待
+                previous(sig, frame)
+                return
+            self.draining = True
+            logger.info("收到 SIGTERM，%.1f 秒后开始优雅退出 pid=%s", delay, os.getpid())
+            loop.call_soon_threadsafe(loop.call_later, delay, previous, sig, None)
+
+        signal.signal(signal.SIGTERM, handle)
+
+    def stats(self):
+        return {
+            "ready": self.ready,
+            "warmed_up": self.warmed_up,
+            "draining": self.draining,
+            "warmup": dict(self.warmup),
+            "pid": os.getpid(),
+        }
@@ -0,0 +1,99 @@
+"""
+嵌入后端基准测试：比较 torch / onnx(fp32) / onnx(int8) 的加载耗时、encode 吞吐量和内存占用
+
+在 ollama_server 目录下运行：
+    python -m benchmarks.bench_embeddings --texts 2000 --threads 4
+
+每个后端在独立的子进程中运行，RSS 互不影响
+"""
+
+import argparse
+import multiprocessing
+import resource
+import time
+
+SAMPLE_TEXTS = [
+    "LPR 是贷款市场报价利率，房贷利率以 LPR 为基准加点确定。",
+    "大额存单起存金额为 20 万元，可以提前支取但按活期计息。",
+    "征信报告可以在人民银行征信中心网站或手机银行查询。",
+    "信用卡逾期超过 90 天会在征信报告中留下不良记录。",
+    "手机银行单笔转账限额可以在安全中心自行调整。",
+    "Branch opening hours are 9:00 to 17:00 on weekdays.",
+]
+
+
+def _rss_mb():
+    """当前常驻内存（MB），优先读取 /proc，其他平台退化为峰值 RSS"""
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_backend(name, quantized, n_texts, batch_size, threads, queue):
+    rss_start = _rss_mb()
+    start = time.perf_counter()
+    from app.embeddings import get_embedding_backend
+
+    kwargs = {"threads": threads}
+    if name == "onnx":
+        kwargs["quantized"] = quantized
+    backend = get_embedding_backend(name, **kwargs)
+    load_seconds = time.perf_counter() - start
+    rss_loaded = _rss_mb()
+
+    texts = [f"{SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)]}（{i}）" for i in range(n_texts)]
+    backend.encode(texts[:batch_size], batch_size=batch_size)  # 预热
+    start = time.perf_counter()
+    backend.encode(texts, batch_size=batch_size)
+    encode_seconds = time.perf_counter() - start
+
+    queue.put({
+        "load_s": load_seconds,
+        "texts_per_s": n_texts / encode_seconds,
+        "rss_start_mb": rss_start,
+        "rss_loaded_mb": rss_loaded,
+        "peak_rss_mb": _peak_rss_mb(),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="嵌入后端吞吐量与内存基准测试")
+    parser.add_argument("--texts", type=int, default=2000, help="encode 的文本条数")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=0, help="推理线程数，0 为默认")
+    parser.add_argument("--backends", default="torch,onnx-fp32,onnx-int8", help="逗号分隔")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    rows = []
+    for label in args.backends.split(","):
+        name = label.split("-")[0]
+        quantized = label.endswith("int8")
+        queue = ctx.Queue()
+        proc = ctx.Process(
+            target=_run_backend, args=(name, quantized, args.texts, args.batch_size, args.threads, queue)
+        )
+        proc.start()
+        result = queue.get()
+        proc.join()
+        rows.append((label, result))
+
+    print(f"{'后端':<12}{'加载(s)':>10}{'吞吐(条/s)':>14}{'加载后RSS(MB)':>16}{'峰值RSS(MB)':>14}")
+    for label, r in rows:
+        print(
+            f"{label:<12}{r['load_s']:>10.2f}{r['texts_per_s']:>14.1f}"
+            f"{r['rss_loaded_mb']:>16.1f}{r['peak_rss_mb']:>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
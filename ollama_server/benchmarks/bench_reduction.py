@@ -0,0 +1,120 @@
+"""
+降维召回报告：在真实语料上比较不同降维方式和维度下的 recall@k、每条向量的存储字节数和单次检索耗时，
+用于选择 KB_REDUCE / KB_REDUCE_DIM
+
+在 ollama_server 目录下运行：
+    python -m benchmarks.bench_reduction --docs ./docs --ndjson export.ndjson --dims 64,96,128,192 --k 5
+
+语料为文档目录按 index_kb 的方式切出的片段、--ndjson 中每行 {"text": ...} 的文档以及 SmartQAApp 精选 FAQ 的回答；
+问题为 FAQ 的问法加上随机片段的第一句。基准为原始维度 float32 的精确 top-k，
+各配置都以 float16 存储、用 MmapStore 的检索路径计算 top-k，fp16 一行即只做 float16 存储不降维的结果。
+PCA 在语料上拟合，与构建版本时相同
+"""
+
+import argparse
+import json
+import os
+import random
+import time
+
+import numpy as np
+
+from app.chunking import iter_chunks, iter_sentences
+from app.embeddings import get_embedding_backend
+from app.faq_tier import SMARTQA_DIR
+from app.reduction import KB_REDUCE_FIT_SAMPLES, fit_reducer
+from app.vector_store import MmapStore
+
+
+def _corpus(docs_dir, ndjson_paths):
+    texts = []
+    if docs_dir and os.path.isdir(docs_dir):
+        for root, dirs, files in os.walk(docs_dir):
+            dirs.sort()
+            for fname in sorted(files):
+                with open(os.path.join(root, fname), encoding="utf-8") as f:
+                    texts += [chunk.text for chunk in iter_chunks(f)]
+    for path in ndjson_paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    texts += [chunk.text for chunk in iter_chunks(json.loads(line)["text"].splitlines(True))]
+    faq = []
+    try:
+        with open(os.path.join(SMARTQA_DIR, "data", "knowledge_base.json"), encoding="utf-8") as f:
+            faq = json.load(f)
+    except (OSError, ValueError):
+        pass
+    texts += [item["answer"] for item in faq]
+    return texts, [item["question"] for item in faq]
+
+
+def _search(vectors16, queries, k):
+    view = (vectors16, np.zeros(len(vectors16), dtype=np.uint8), None)
+    started = time.perf_counter()
+    results = [set(MmapStore._top_k(view, q, k)[0]) for q in queries]
+    return results, (time.perf_counter() - started) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="降维召回报告")
+    parser.add_argument("--docs", default="./docs", help="文档目录")
+    parser.add_argument("--ndjson", nargs="*", default=[], help="额外语料，每行一个 {\"text\": ...}")
+    parser.add_argument("--dims", default="32,64,128,192", help="降维后的维度，逗号分隔")
+    parser.add_argument("--methods", default="pca,random")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200, help="从片段中抽取的问题数（另加 FAQ 问法）")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出")
+    args = parser.parse_args()
+
+    texts, faq_questions = _corpus(args.docs, args.ndjson)
+    rng = random.Random(0)
+    sampled = rng.sample(texts, min(args.queries, len(texts)))
+    queries = faq_questions + [next(iter_sentences(text.splitlines(True))).text for text in sampled]
+    k = min(args.k, len(texts))
+    if not k:
+        raise SystemExit("语料为空")
+
+    model = get_embedding_backend()
+    started = time.perf_counter()
+    docs = model.encode(texts, batch_size=128)
+    q = model.encode(queries, batch_size=128)
+    print(f"语料 {len(texts)} 个片段，问题 {len(queries)} 个，encode {time.perf_counter() - started:.1f} 秒，"
+          f"原始维度 {docs.shape[1]}")
+
+    scores = q @ docs.T
+    truth = [set(np.argsort(-row)[:k].tolist()) for row in scores]
+    truth_top1 = scores.argmax(axis=1)
+
+    def evaluate(method, dim, stored, queries_reduced, extra=None):
+        found, ms = _search(stored, queries_reduced, k)
+        recall = sum(len(a & b) for a, b in zip(found, truth)) / (k * len(truth))
+        top1 = np.mean([int(truth_top1[i]) in found[i] for i in range(len(truth))])
+        row = {"method": method, "dim": dim, f"recall@{k}": round(recall, 4), "top1_in_k": round(float(top1), 4),
+               "bytes_per_vector": dim * 2, "query_ms": round(ms, 3)}
+        row.update(extra or {})
+        return row
+
+    rows = [evaluate("fp16", docs.shape[1], docs.astype(np.float16), q)]
+    fit_sample = docs[rng.sample(range(len(docs)), min(len(docs), KB_REDUCE_FIT_SAMPLES))]
+    for method in args.methods.split(","):
+        for dim in (int(d) for d in args.dims.split(",")):
+            try:
+                reducer = fit_reducer(method, fit_sample, dim)
+            except ValueError as e:
+                print(f"跳过 {method} {dim}：{e}")
+                continue
+            extra = {"explained_variance": round(reducer.explained, 4)} if reducer.explained is not None else {}
+            rows.append(evaluate(method, dim, reducer.transform(docs).astype(np.float16), reducer.transform(q), extra))
+
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+        return
+    print(f"\n{'方式':<8}{'维度':>6}{f'recall@{k}':>11}{'top1∈k':>9}{'字节/向量':>10}{'检索(ms)':>10}{'方差占比':>9}")
+    for row in rows:
+        print(f"{row['method']:<10}{row['dim']:>6}{row[f'recall@{k}']:>11}{row['top1_in_k']:>9}"
+              f"{row['bytes_per_vector']:>12}{row['query_ms']:>11}{row.get('explained_variance', ''):>11}")
+
+
+if __name__ == "__main__":
+    main()
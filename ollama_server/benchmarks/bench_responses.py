@@ -0,0 +1,127 @@
+"""
+响应序列化基准测试：比较 FastAPI 默认路径（jsonable_encoder + json.dumps）与 orjson 的序列化耗时，
+以及完整内容、字段裁剪（id + snippet）和 gzip / brotli 压缩后的响应体大小
+
+在 ollama_server 目录下运行：
+    python -m benchmarks.bench_responses --results 5 --chunk-chars 300
+
+负载为仿照 /api/knowledge/search 与 /api/chat/ask 构造的中文响应，片段内容取自 SmartQAApp 精选 FAQ 的回答，
+不需要启动服务。片段总字符数超过 FAQ 回答总长（约 2700 字）后内容会循环重复，压缩率偏乐观
+"""
+
+import argparse
+import json
+import os
+import time
+
+from fastapi.encoders import jsonable_encoder
+
+from app import responses
+from app.faq_tier import SMARTQA_DIR
+from app.responses import compress, select_fields, snippet
+from benchmarks.bench_embeddings import SAMPLE_TEXTS
+
+
+def _corpus():
+    try:
+        with open(os.path.join(SMARTQA_DIR, "data", "knowledge_base.json"), encoding="utf-8") as f:
+            return "".join(item["answer"] for item in json.load(f))
+    except (OSError, ValueError, KeyError):
+        return "".join(SAMPLE_TEXTS)
+
+
+CORPUS = _corpus()
+
+
+def _text(i, chars):
+    start = i * chars % len(CORPUS)
+    text = CORPUS[start:start + chars]
+    while len(text) < chars:
+        text += CORPUS[:chars - len(text)]
+    return text
+
+
+def _search_payload(n, chars, fields=None):
+    fields = fields or ("id", "content", "metadata")
+    items = []
+    for i in range(n):
+        item = {
+            "id": f"银行业务手册.txt_{i}",
+            "content": _text(i, chars),
+            "snippet": snippet(_text(i, chars)),
+            "metadata": {"source": "银行业务手册.txt", "para_id": i, "domain": "贷款服务",
+                         "file_hash": "9f86d081884c7d659a2feaa0c55ad015", "chunk_hash": f"{i:032x}"},
+            "score": 0.01639,
+        }
+        items.append({key: item[key] for key in fields})
+    return {"success": True, "results": items, "count": len(items)}
+
+
+def _chat_payload(n, chars, fields=None):
+    docs = [_text(i, chars) for i in range(n)]
+    return select_fields({
+        "success": True,
+        "answer": _text(n, 200),
+        "used_knowledge": True,
+        "knowledge_items": docs,
+        "knowledge_ids": [f"银行业务手册.txt_{i}" for i in range(n)],
+        "cached": False,
+        "tier": "llm",
+        "shared": False,
+        "faq": None,
+        "context_tokens_saved": 0,
+        "generation": {"prompt_eval_count": 512, "eval_count": 180, "total_seconds": 3.21,
+                       "reasoning_chars": 0, "first_token_seconds": 0.412},
+        "processing_time": 3.318,
+    }, fields, docs_key="knowledge_items")
+
+
+def _default_render(content):
+    # FastAPI 对返回的 dict 先做 jsonable_encoder，再由 JSONResponse.render 序列化
+    return json.dumps(
+        jsonable_encoder(content), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def _per_call_us(fn, content, repeat):
+    fn(content)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(content)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="响应序列化耗时与响应体大小基准测试")
+    parser.add_argument("--results", type=int, default=5, help="搜索结果 / 背景知识条数")
+    parser.add_argument("--chunk-chars", type=int, default=300, help="每条知识片段的字符数")
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    payloads = [
+        ("search 完整", _search_payload(args.results, args.chunk_chars)),
+        ("search id+snippet", _search_payload(args.results, args.chunk_chars, fields=("id", "snippet"))),
+        ("ask 完整", _chat_payload(args.results, args.chunk_chars)),
+        ("ask 裁剪", _chat_payload(args.results, args.chunk_chars,
+                                 fields=["answer", "knowledge_ids", "snippets", "tier"])),
+    ]
+    encodings = ["gzip"] + (["br"] if responses.brotli is not None else [])
+    if responses.orjson is None:
+        print("未安装 orjson，FastJSONResponse 退回标准库 json")
+
+    header = f"{'负载':<20}{'默认(us)':>10}{'orjson(us)':>12}{'原始(B)':>10}"
+    header += "".join(f"{enc + '(B)':>10}{enc + '(us)':>10}" for enc in encodings)
+    print(header)
+    for label, content in payloads:
+        body = responses.dumps(content)
+        row = (
+            f"{label:<20}{_per_call_us(_default_render, content, args.repeat):>10.1f}"
+            f"{_per_call_us(responses.dumps, content, args.repeat):>12.1f}{len(body):>10}"
+        )
+        for enc in encodings:
+            row += f"{len(compress(body, enc)):>10}{_per_call_us(lambda b: compress(b, enc), body, args.repeat // 10):>10.1f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+向量存储基准测试：比较 Chroma（PersistentClient）与内存映射 float16 精确检索（MmapStore）
+在不同规模下的写入耗时、检索延迟、recall@k 和磁盘占用
+
+在 ollama_server 目录下运行：
+    python -m benchmarks.bench_vector_store --sizes 10000,100000,1000000 --dim 384
+
+向量为随机生成的归一化向量，按块由固定种子生成，计算真实 top-k 时无需把全部向量留在内存中；
+每个 (存储, 规模) 在独立的子进程中运行，RSS 互不影响。Chroma 写入 100 万条耗时很长，可用 --chroma-max 跳过
+"""
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.bench_embeddings import _peak_rss_mb, _rss_mb
+
+# 生成与写入向量的块大小
+BLOCK = 10000
+# Chroma 单次 add 的条数上限约为 5461
+CHROMA_BATCH = 5000
+
+
+def _block(i, dim):
+    rng = np.random.default_rng(i)
+    vectors = rng.normal(size=(BLOCK, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _blocks(size, dim):
+    """按块生成 (起始下标, 向量)"""
+    for i, start in enumerate(range(0, size, BLOCK)):
+        yield start, _block(i, dim)[:size - start]
+
+
+def _queries(n, dim):
+    rng = np.random.default_rng(10 ** 6)
+    queries = rng.normal(size=(n, dim)).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def _ground_truth(size, dim, queries, k):
+    """float32 精确 top-k，逐块合并"""
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_ids = np.zeros((len(queries), k), dtype=np.int64)
+    for start, vectors in _blocks(size, dim):
+        scores = queries @ vectors.T
+        ids = np.broadcast_to(np.arange(start, start + len(vectors)), scores.shape)
+        all_scores = np.concatenate([best_scores, scores], axis=1)
+        all_ids = np.concatenate([best_ids, ids], axis=1)
+        top = np.argpartition(-all_scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(all_scores, top, axis=1)
+        best_ids = np.take_along_axis(all_ids, top, axis=1)
+    return [set(f"c{i}" for i in row) for row in best_ids]
+
+
+def _dir_mb(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, fname)) for fname in files)
+    return total / 1024 / 1024
+
+
+def _open_store(name, path):
+    if name == "mmap":
+        from app.vector_store import MmapStore
+
+        return MmapStore(path, "bench")
+    import chromadb
+    from app.vector_store import ChromaStore
+
+    return ChromaStore(chromadb.PersistentClient(path=path).get_or_create_collection("bench"))
+
+
+def _run(name, size, dim, n_queries, k, workdir, queue):
+    path = os.path.join(workdir, f"{name}_{size}")
+    store = _open_store(name, path)
+    batch = BLOCK if name == "mmap" else CHROMA_BATCH
+
+    start = time.perf_counter()
+    for block_start, vectors in _blocks(size, dim):
+        for offset in range(0, len(vectors), batch):
+            part = vectors[offset:offset + batch]
+            first = block_start + offset
+            ids = [f"c{i}" for i in range(first, first + len(part))]
+            store.upsert(
+                ids=ids,
+                documents=[f"片段 {i}" for i in range(first, first + len(part))],
+                embeddings=part.tolist(),
+                metadatas=[{"source": f"s{i // 100}", "para_id": i % 100} for i in range(first, first + len(part))],
+            )
+    build_seconds = time.perf_counter() - start
+    del store
+
+    # 重新打开，模拟服务启动
+    rss_start = _rss_mb()
+    start = time.perf_counter()
+    store = _open_store(name, path)
+    open_seconds = time.perf_counter() - start
+
+    queries = _queries(n_queries, dim)
+    truth = _ground_truth(size, dim, queries, k)
+    store.query(query_embeddings=[queries[0].tolist()], n_results=k)  # 预热
+    latencies, recall = [], 0.0
+    for q, expected in zip(queries, truth):
+        start = time.perf_counter()
+        result = store.query(query_embeddings=[q.tolist()], n_results=k)
+        latencies.append(time.perf_counter() - start)
+        recall += len(expected & set(result["ids"][0])) / k
+    latencies = np.array(latencies) * 1000
+
+    queue.put({
+        "build_s": build_seconds,
+        "open_s": open_seconds,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "recall": recall / n_queries,
+        "disk_mb": _dir_mb(path),
+        "rss_delta_mb": _rss_mb() - rss_start,
+        "peak_rss_mb": _peak_rss_mb(),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量存储检索延迟与召回率基准测试")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="逗号分隔的向量条数")
+    parser.add_argument("--dim", type=int, default=384, help="向量维度")
+    parser.add_argument("--queries", type=int, default=100, help="检索次数")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--stores", default="chroma,mmap", help="逗号分隔")
+    parser.add_argument("--chroma-max", type=int, default=100000, help="超过该条数时跳过 Chroma")
+    parser.add_argument("--workdir", default=None, help="数据目录，默认使用临时目录并在结束后删除")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_vector_store_")
+    ctx = multiprocessing.get_context("spawn")
+    rows = []
+    try:
+        for size in (int(s) for s in args.sizes.split(",")):
+            for name in args.stores.split(","):
+                if name == "chroma" and size > args.chroma_max:
+                    print(f"跳过 chroma @ {size}（--chroma-max {args.chroma_max}）")
+                    continue
+                queue = ctx.Queue()
+                proc = ctx.Process(target=_run, args=(name, size, args.dim, args.queries, args.k, workdir, queue))
+                proc.start()
+                result = queue.get()
+                proc.join()
+                rows.append((name, size, result))
+                print(f"完成 {name} @ {size}")
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(
+        f"{'存储':<8}{'条数':>10}{'写入(s)':>10}{'打开(s)':>10}{'p50(ms)':>10}{'p95(ms)':>10}"
+        f"{'recall@' + str(args.k):>11}{'磁盘(MB)':>10}{'检索后RSS增量(MB)':>20}"
+    )
+    for name, size, r in rows:
+        print(
+            f"{name:<8}{size:>10}{r['build_s']:>10.1f}{r['open_s']:>10.2f}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}"
+            f"{r['recall']:>11.3f}{r['disk_mb']:>10.1f}{r['rss_delta_mb']:>20.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+模拟 Ollama HTTP API，用于在没有 7B 模型的机器上压测 ollama_server
+
+    python -m loadtest.fake_ollama --port 11500 --tokens-per-second 20 --first-token-delay 0.5 --error-rate 0.02
+    python -m loadtest.fake_ollama --instances 3 --models "deepseek-r1:7b;qwen2.5:1.5b;deepseek-r1:7b,qwen2.5:1.5b"
+
+实现 /api/generate（流式与非流式）、/api/tags、/api/ps、/api/version。生成速度按以下参数模拟：
+- prompt 评估耗时：--first-token-delay 加上 prompt 长度 / --prompt-tokens-per-second
+- 之后每个 token 间隔 1 / --tokens-per-second
+- 同时进行的生成数受 --parallel 限制（对应 OLLAMA_NUM_PARALLEL），超出的请求排队
+- 推理模型（名称含 r1）先输出 --think-tokens 个 <think> 中的推理 token
+- 模型未加载时先等待 --load-seconds 秒加载，--keep-alive 秒内没有使用则卸载（/api/ps 中消失）
+
+故障注入：--error-rate 返回 500，--drop-rate 在输出中途断开连接，--stall-rate 输出一半后停止 --stall-seconds 秒。
+运行中可以 POST /fake/config 修改这些比例，如 {"error_rate": 1} 模拟某个实例故障。
+
+--instances N 在同一进程中启动 N 个相互独立的实例，端口从 --port 起连续分配，用于测试 OLLAMA_BACKENDS 后端池；
+--models 中用分号分隔各实例的模型列表
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+ANSWER_TEXT = (
+    "根据背景知识，您可以通过手机银行、网上银行或到网点柜台办理该业务。办理时请携带本人有效身份证件，"
+    "部分业务需要提前预约。具体的费用、额度和利率以银行最新公告为准，如有疑问可以拨打客服热线咨询。"
+)
+THINK_TEXT = "用户问的是银行业务办理流程，我需要结合背景知识给出简洁准确的回答，先确认渠道，再说明所需材料。"
+# 中文大约每个 token 1.5 个字符
+CHARS_PER_TOKEN = 1.5
+
+
+def _tokens(text, n):
+    """把文本循环切成 n 个 token 片段"""
+    size = max(1, int(CHARS_PER_TOKEN))
+    pieces = [text[i:i + size] for i in range(0, len(text), size)]
+    return [pieces[i % len(pieces)] for i in range(n)]
+
+
+class FakeOllama:
+    def __init__(self, args, models=None, seed=0):
+        self.args = args
+        self.rng = random.Random(seed)
+        self.slots = asyncio.Semaphore(args.parallel)
+        models = args.models if models is None else models
+        self.models = set(models.split(",")) if models else None
+        # 各故障比例，可通过 /fake/config 修改
+        self.faults = {"error_rate": args.error_rate, "drop_rate": args.drop_rate, "stall_rate": args.stall_rate}
+        # 已加载的模型 -> 最后使用时间
+        self.loaded = {}
+        self.stats = {"requests": 0, "completed": 0, "errors": 0, "drops": 0, "stalls": 0, "not_found": 0,
+                      "active": 0, "max_active": 0, "waiting": 0, "tokens": 0, "loads": 0}
+
+    def _fault(self):
+        roll = self.rng.random()
+        error, drop, stall = self.faults["error_rate"], self.faults["drop_rate"], self.faults["stall_rate"]
+        if roll < error:
+            return "error"
+        if roll < error + drop:
+            return "drop"
+        if roll < error + drop + stall:
+            return "stall"
+        return None
+
+    def loaded_models(self):
+        now = time.monotonic()
+        for model, used in list(self.loaded.items()):
+            if now - used > self.args.keep_alive:
+                del self.loaded[model]
+        return sorted(self.loaded)
+
+    def _plan(self, payload):
+        """(推理 token, 回答 token, prompt token 数)"""
+        args = self.args
+        prompt_tokens = int(len(payload.get("prompt", "")) / CHARS_PER_TOKEN) + len(payload.get("context") or [])
+        n = max(1, int(self.rng.gauss(args.response_tokens, args.response_tokens * 0.25)))
+        options = payload.get("options") or {}
+        if options.get("num_predict"):
+            n = min(n, int(options["num_predict"]))
+        think = []
+        if "r1" in payload.get("model", "") and payload.get("think") is not False and args.think_tokens:
+            think = ["<think>"] + _tokens(THINK_TEXT, args.think_tokens) + ["</think>"]
+        return think, _tokens(ANSWER_TEXT, n), prompt_tokens
+
+    async def generate(self, payload):
+        """产出 Ollama 格式的响应片段；stall 与 drop 通过异常或长时间等待模拟"""
+        args = self.args
+        model = payload.get("model", "")
+        fault = self._fault()
+        think, answer, prompt_tokens = self._plan(payload)
+        tokens = think + answer
+        self.stats["waiting"] += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.stats["waiting"] -= 1
+        self.stats["active"] += 1
+        self.stats["max_active"] = max(self.stats["max_active"], self.stats["active"])
+        started = time.perf_counter()
+        try:
+            if model not in self.loaded_models():
+                self.stats["loads"] += 1
+                await asyncio.sleep(args.load_seconds)
+            self.loaded[model] = time.monotonic()
+            prompt_seconds = args.first_token_delay + prompt_tokens / args.prompt_tokens_per_second
+            await asyncio.sleep(prompt_seconds)
+            interval = 1.0 / args.tokens_per_second
+            for i, token in enumerate(tokens):
+                if fault == "drop" and i == len(tokens) // 2:
+                    self.stats["drops"] += 1
+                    raise ConnectionResetError("模拟连接中断")
+                if fault == "stall" and i == len(tokens) // 2:
+                    self.stats["stalls"] += 1
+                    await asyncio.sleep(args.stall_seconds)
+                self.stats["tokens"] += 1
+                yield {"model": model, "response": token, "done": False}
+                await asyncio.sleep(interval)
+            total = time.perf_counter() - started
+            context = list(payload.get("context") or [])[-2048:] + list(range(prompt_tokens + len(tokens)))[-2048:]
+            self.stats["completed"] += 1
+            yield {
+                "model": model,
+                "response": "",
+                "done": True,
+                "done_reason": "stop",
+                "context": context[-4096:],
+                "total_duration": int(total * 1e9),
+                "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int(prompt_seconds * 1e9),
+                "eval_count": len(tokens),
+                "eval_duration": int((total - prompt_seconds) * 1e9),
+            }
+        finally:
+            if model in self.loaded:
+                self.loaded[model] = time.monotonic()
+            self.stats["active"] -= 1
+            self.slots.release()
+
+
+def create_app(args, models=None, seed=None):
+    fake = FakeOllama(args, models, args.seed if seed is None else seed)
+    app = FastAPI()
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        payload = await request.json()
+        fake.stats["requests"] += 1
+        if fake.models is not None and payload.get("model") not in fake.models:
+            fake.stats["not_found"] += 1
+            return JSONResponse(status_code=404, content={"error": f"model '{payload.get('model')}' not found"})
+        if fake._fault() == "error":
+            fake.stats["errors"] += 1
+            return JSONResponse(status_code=500, content={"error": "模拟的服务端错误"})
+
+        if payload.get("stream", True):
+            async def body():
+                async for chunk in fake.generate(payload):
+                    yield json.dumps(chunk, ensure_ascii=False) + "\n"
+
+            return StreamingResponse(body(), media_type="application/x-ndjson")
+
+        parts, final = [], {}
+        async for chunk in fake.generate(payload):
+            parts.append(chunk["response"])
+            final = chunk
+        return dict(final, response="".join(parts))
+
+    @app.get("/api/tags")
+    async def tags():
+        names = sorted(fake.models) if fake.models else ["deepseek-r1:7b", "qwen2.5:1.5b"]
+        return {"models": [{"name": name, "model": name} for name in names]}
+
+    @app.get("/api/ps")
+    async def ps():
+        return {"models": [{"name": name, "model": name} for name in fake.loaded_models()]}
+
+    @app.get("/api/version")
+    async def version():
+        return {"version": "0.0.0-fake"}
+
+    @app.get("/fake/stats")
+    async def stats():
+        return fake.stats
+
+    @app.post("/fake/config")
+    async def config(request: Request):
+        updates = await request.json()
+        fake.faults.update({key: float(value) for key, value in updates.items() if key in fake.faults})
+        return fake.faults
+
+    return app
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="模拟 Ollama HTTP API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--tokens-per-second", type=float, default=20.0, help="每个生成的输出速度")
+    parser.add_argument("--prompt-tokens-per-second", type=float, default=400.0, help="prompt 评估速度")
+    parser.add_argument("--first-token-delay", type=float, default=0.3, help="prompt 评估之外的固定首 token 延迟（秒）")
+    parser.add_argument("--response-tokens", type=int, default=120, help="回答的平均 token 数")
+    parser.add_argument("--think-tokens", type=int, default=60, help="推理模型输出的推理 token 数")
+    parser.add_argument("--parallel", type=int, default=1, help="同时进行的生成数，超出的排队")
+    parser.add_argument("--models", default="",
+                        help="逗号分隔的可用模型，其余返回 404；默认全部可用。多实例时用分号分隔各实例的列表")
+    parser.add_argument("--instances", type=int, default=1, help="实例数，端口从 --port 起连续分配")
+    parser.add_argument("--load-seconds", type=float, default=0.0, help="模型未加载时首次生成前的加载耗时（秒）")
+    parser.add_argument("--keep-alive", type=float, default=300.0, help="模型空闲多久后卸载（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的比例")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="输出中途断开连接的比例")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="输出中途停止的比例")
+    parser.add_argument("--stall-seconds", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def instance_models(args):
+    """各实例的模型列表；没有分号时所有实例相同"""
+    if ";" not in args.models:
+        return [args.models] * args.instances
+    parts = args.models.split(";")
+    return [parts[i % len(parts)] for i in range(args.instances)]
+
+
+async def serve(args):
+    servers = [
+        uvicorn.Server(uvicorn.Config(create_app(args, models, args.seed + i), host=args.host, port=args.port + i,
+                                      log_level="warning"))
+        for i, models in enumerate(instance_models(args))
+    ]
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def main():
+    args = build_parser().parse_args()
+    if args.instances == 1:
+        uvicorn.run(create_app(args, instance_models(args)[0]), host=args.host, port=args.port, log_level="warning")
+    else:
+        asyncio.run(serve(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+"""
+ollama_server 压测：按设定的接口比例和问题分布发送请求，逐级提高并发或到达速率，
+输出每一级的吞吐、各接口的 p50/p95/p99 延迟、错误率，以及从 /metrics 抓取的服务端指标变化
+
+在 ollama_server 目录下运行（服务已启动）：
+    python -m loadtest.loadgen --url http://127.0.0.1:8000 --concurrency 1,4,16 --stage-seconds 30
+    python -m loadtest.loadgen --mode open --rate 0.5,1,2 --mix chat=5,ask=3,search=2,stream=1 --json
+
+closed 模式下每个虚拟用户收到响应后立即发下一个请求，测的是给定并发下的吞吐；
+open 模式按泊松过程以固定速率发请求，不受响应快慢影响，更接近真实流量，服务跟不上时排队会持续增长
+
+问题分布：热门问题按 Zipf 分布抽取（少数问题占大部分请求，缓存、合并与预生成在这部分生效），
+另有 --long-tail 比例的请求由模板随机组合，几乎不重复，必须检索 + 生成
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from collections import Counter, defaultdict
+
+import httpx
+
+
+HOT_QUERIES = [
+    "信用卡年费怎么收取？",
+    "转账限额是多少？",
+    "如何挂失银行卡？",
+    "定期存款利率是多少？",
+    "忘记登录密码怎么办？",
+    "怎么开通手机银行？",
+    "跨行转账要手续费吗？",
+    "信用卡逾期了会怎么样？",
+    "如何申请个人住房贷款？",
+    "外币兑换在哪里办理？",
+    "理财产品有哪些风险？",
+    "怎么修改预留手机号？",
+]
+TAIL_PRODUCTS = ["信用卡", "借记卡", "手机银行", "网上银行", "定期存款", "大额存单", "个人消费贷", "房贷", "基金定投", "外汇业务"]
+TAIL_ASPECTS = ["手续费", "办理条件", "额度", "利率", "办理流程", "所需材料", "到账时间", "注销方式", "优惠活动", "风险提示"]
+TAIL_TEMPLATES = [
+    "{product}的{aspect}是什么？",
+    "请问{product}{aspect}怎么查？",
+    "我想了解一下{product}的{aspect}，和上个月比有变化吗？",
+    "{product}和{other}的{aspect}有什么区别？",
+]
+
+# 接口名 -> (路径, 是否流式)
+ENDPOINTS = {
+    "chat": ("/chat", False),
+    "ask": ("/api/chat/ask", False),
+    "search": ("/api/knowledge/search", False),
+    "stream": ("/chat/stream", True),
+}
+# 每一级开始和结束时抓取 /metrics，报告这些计数器的增量
+COUNTER_METRICS = (
+    "ollama_server_answers_total",
+    "ollama_server_generations_saved_total",
+    "ollama_server_precomputed_generations_total",
+    "ollama_server_timeouts_total",
+    "ollama_server_errors_total",
+)
+# 压测期间定期采样的瞬时指标
+GAUGE_METRICS = (
+    "ollama_server_generation_queue_depth",
+    "ollama_server_generations_in_flight",
+)
+GAUGE_SAMPLE_SECONDS = 0.5
+PERCENTILES = (50, 95, 99)
+
+_SAMPLE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})?\s+(\S+)$")
+
+
+class QueryMix:
+    """按 Zipf 分布抽取热门问题，或由模板组合出长尾问题"""
+
+    def __init__(self, zipf_s=1.1, long_tail=0.3, seed=0):
+        self.rng = random.Random(seed)
+        self.long_tail = long_tail
+        self.weights = [1 / rank ** zipf_s for rank in range(1, len(HOT_QUERIES) + 1)]
+
+    def next(self):
+        if self.rng.random() < self.long_tail:
+            product, other = self.rng.sample(TAIL_PRODUCTS, 2)
+            template = self.rng.choice(TAIL_TEMPLATES)
+            return template.format(product=product, other=other, aspect=self.rng.choice(TAIL_ASPECTS)), "tail"
+        return self.rng.choices(HOT_QUERIES, self.weights)[0], "hot"
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"未知接口 {name}，可选 {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def parse_levels(text):
+    return [float(value) for value in text.split(",") if value.strip()]
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def parse_metrics(text):
+    """Prometheus 文本格式 -> {(指标名, 标签串): 值}"""
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        match = _SAMPLE.match(line)
+        if match:
+            try:
+                samples[(match.group(1), match.group(2) or "")] = float(match.group(3))
+            except ValueError:
+                pass
+    return samples
+
+
+def metric_delta(before, after, names=COUNTER_METRICS):
+    delta = {}
+    for (name, labels), value in after.items():
+        if name in names:
+            change = value - before.get((name, labels), 0.0)
+            if change:
+                delta[name + labels] = round(change, 3)
+    # 各阶段的平均耗时
+    for (name, labels), count in after.items():
+        if name != "ollama_server_stage_seconds_count":
+            continue
+        calls = count - before.get((name, labels), 0.0)
+        total = after.get(("ollama_server_stage_seconds_sum", labels), 0.0) - before.get(
+            ("ollama_server_stage_seconds_sum", labels), 0.0)
+        if calls:
+            delta["stage_mean_ms" + labels] = round(total / calls * 1000, 1)
+    return delta
+
+
+class LoadGenerator:
+    def __init__(self, client, mix, queries, timeout=120.0, reasoning="hide", user_pool=50, seed=0):
+        self.client = client
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.queries = queries
+        self.timeout = timeout
+        self.reasoning = reasoning
+        self.user_pool = user_pool
+        self.rng = random.Random(seed)
+        self.results = []
+
+    async def request(self):
+        name = self.rng.choices(self.names, self.weights)[0]
+        path, streaming = ENDPOINTS[name]
+        query, kind = self.queries.next()
+        if name == "search":
+            body = {"query": query, "limit": 3, "fields": ["id", "snippet", "score"]}
+        else:
+            # 用户数有限，部分请求落在已有会话上，覆盖多轮对话的路径
+            body = {"user_id": f"load-{self.rng.randrange(self.user_pool)}", "query": query,
+                    "reasoning": self.reasoning, "timeout": self.timeout}
+        result = {"endpoint": name, "query_kind": kind, "status": None, "error": None, "tier": None, "ttfb": None}
+        started = time.perf_counter()
+        try:
+            if streaming:
+                await self._stream(path, body, result, started)
+            else:
+                response = await self.client.post(path, json=body)
+                result["status"] = response.status_code
+                if response.status_code == 200 and name != "search":
+                    payload = response.json()
+                    result["tier"] = payload.get("tier")
+                    # 生成失败时仍返回 200，回答为错误提示，failed 为 true
+                    if payload.get("failed"):
+                        result["error"] = "generation_failed"
+        except httpx.TimeoutException:
+            result["error"] = "timeout"
+        except httpx.HTTPError as e:
+            result["error"] = type(e).__name__
+        result["latency"] = time.perf_counter() - started
+        if result["error"] is None and result["status"] != 200:
+            result["error"] = f"http_{result['status']}"
+        self.results.append(result)
+
+    async def _stream(self, path, body, result, started):
+        async with self.client.stream("POST", path, json=body) as response:
+            result["status"] = response.status_code
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                if result["ttfb"] is None:
+                    result["ttfb"] = time.perf_counter() - started
+                event = json.loads(line)
+                if event.get("error"):
+                    result["error"] = event["error"]
+                elif event.get("failed"):
+                    result["error"] = "generation_failed"
+                if event.get("done"):
+                    result["tier"] = event.get("tier")
+
+    async def closed_loop(self, concurrency, seconds):
+        stop_at = time.perf_counter() + seconds
+
+        async def user():
+            while time.perf_counter() < stop_at:
+                await self.request()
+
+        await asyncio.gather(*(user() for _ in range(int(concurrency))))
+
+    async def open_loop(self, rate, seconds, max_outstanding):
+        """泊松到达；未完成的请求超过 max_outstanding 时不再发新请求并计为 dropped，避免压测端自身失控"""
+        stop_at = time.perf_counter() + seconds
+        tasks = set()
+        dropped = 0
+        while True:
+            await asyncio.sleep(self.rng.expovariate(rate))
+            if time.perf_counter() >= stop_at:
+                break
+            if len(tasks) >= max_outstanding:
+                dropped += 1
+                continue
+            task = asyncio.ensure_future(self.request())
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+        return dropped
+
+
+async def scrape(client):
+    try:
+        response = await client.get("/metrics")
+        return parse_metrics(response.text)
+    except httpx.HTTPError:
+        return {}
+
+
+async def sample_gauges(client, samples, stop):
+    while not stop.is_set():
+        metrics = await scrape(client)
+        for (name, _), value in metrics.items():
+            if name in GAUGE_METRICS:
+                samples[name].append(value)
+        try:
+            await asyncio.wait_for(stop.wait(), GAUGE_SAMPLE_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+def summarize(level, mode, results, elapsed, metrics_delta, gauges, dropped=0):
+    def latency_row(rows, key="latency"):
+        values = [row[key] for row in rows if row.get(key) is not None]
+        row = {f"p{p}_ms": round(percentile(values, p) * 1000, 1) if values else None for p in PERCENTILES}
+        row["mean_ms"] = round(sum(values) / len(values) * 1000, 1) if values else None
+        return row
+
+    by_endpoint = defaultdict(list)
+    for row in results:
+        by_endpoint[row["endpoint"]].append(row)
+    ok = [row for row in results if row["error"] is None]
+    endpoints = {}
+    for name, rows in sorted(by_endpoint.items()):
+        good = [row for row in rows if row["error"] is None]
+        endpoints[name] = dict(
+            requests=len(rows),
+            errors=len(rows) - len(good),
+            **latency_row(good),
+        )
+        if name == "stream":
+            endpoints[name]["ttfb"] = latency_row(good, "ttfb")
+    return {
+        "mode": mode,
+        "level": level,
+        "seconds": round(elapsed, 2),
+        "requests": len(results),
+        "completed": len(ok),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        "error_rate": round(1 - len(ok) / len(results), 4) if results else 0.0,
+        "errors": dict(Counter(row["error"] for row in results if row["error"]).most_common()),
+        "dropped": dropped,
+        "tiers": dict(Counter(row["tier"] for row in ok if row["tier"]).most_common()),
+        "latency": latency_row(ok),
+        "endpoints": endpoints,
+        "server": {
+            "counters": metrics_delta,
+            "gauges": {
+                name: {"mean": round(sum(values) / len(values), 2), "max": max(values)}
+                for name, values in gauges.items() if values
+            },
+        },
+    }
+
+
+async def run(args):
+    mix = parse_mix(args.mix)
+    queries = QueryMix(zipf_s=args.zipf, long_tail=args.long_tail, seed=args.seed)
+    levels = parse_levels(args.rate if args.mode == "open" else args.concurrency)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    stages = []
+    # 客户端多等一会，让服务端先按截止时间返回 503
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout + 10, limits=limits) as client:
+        for level in levels:
+            generator = LoadGenerator(client, mix, queries, timeout=args.timeout, reasoning=args.reasoning,
+                                      seed=args.seed)
+            before = await scrape(client)
+            gauges, stop = defaultdict(list), asyncio.Event()
+            sampler = asyncio.ensure_future(sample_gauges(client, gauges, stop))
+            started = time.perf_counter()
+            dropped = 0
+            if args.mode == "open":
+                dropped = await generator.open_loop(level, args.stage_seconds, args.max_outstanding)
+            else:
+                await generator.closed_loop(level, args.stage_seconds)
+            elapsed = time.perf_counter() - started
+            stop.set()
+            await sampler
+            after = await scrape(client)
+            stage = summarize(level, args.mode, generator.results, elapsed, metric_delta(before, after), gauges,
+                              dropped)
+            stages.append(stage)
+            if not args.json:
+                print_stage(stage)
+    return stages
+
+
+def print_stage(stage):
+    unit = "req/s" if stage["mode"] == "open" else "并发"
+    latency = stage["latency"]
+    print(f"\n== {stage['mode']} {stage['level']:g} {unit}，{stage['seconds']} 秒 ==")
+    print(f"请求 {stage['requests']}，成功 {stage['completed']}，吞吐 {stage['throughput_rps']} req/s，"
+          f"错误率 {stage['error_rate']:.2%}" + (f"，未发送 {stage['dropped']}" if stage["dropped"] else ""))
+    if stage["errors"]:
+        print("错误：" + "，".join(f"{kind} {n}" for kind, n in stage["errors"].items()))
+    if stage["tiers"]:
+        print("回答层级：" + "，".join(f"{tier} {n}" for tier, n in stage["tiers"].items()))
+    print(f"  {'接口':<10}{'请求':>8}{'错误':>8}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}")
+    print(f"  {'全部':<10}{stage['requests']:>8}{stage['requests'] - stage['completed']:>8}"
+          f"{latency['p50_ms']!s:>10}{latency['p95_ms']!s:>10}{latency['p99_ms']!s:>10}")
+    for name, row in stage["endpoints"].items():
+        print(f"  {name:<10}{row['requests']:>8}{row['errors']:>8}"
+              f"{row['p50_ms']!s:>10}{row['p95_ms']!s:>10}{row['p99_ms']!s:>10}")
+        if "ttfb" in row:
+            ttfb = row["ttfb"]
+            print(f"  {'  首字节':<9}{'':>16}{ttfb['p50_ms']!s:>10}{ttfb['p95_ms']!s:>10}{ttfb['p99_ms']!s:>10}")
+    server = stage["server"]
+    for name, values in server["gauges"].items():
+        print(f"服务端 {name}：平均 {values['mean']}，最大 {values['max']:g}")
+    for name, value in sorted(server["counters"].items()):
+        print(f"服务端 {name} {value:g}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="ollama_server 压测")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--mode", choices=("closed", "open"), default="closed",
+                        help="closed 为固定并发，open 为固定到达速率")
+    parser.add_argument("--concurrency", default="1,4,16", help="closed 模式下逐级的并发数，逗号分隔")
+    parser.add_argument("--rate", default="0.5,1,2", help="open 模式下逐级的到达速率（req/s），逗号分隔")
+    parser.add_argument("--stage-seconds", type=float, default=30.0, help="每一级持续的秒数")
+    parser.add_argument("--max-outstanding", type=int, default=1000, help="open 模式下未完成请求的上限")
+    parser.add_argument("--mix", default="chat=5,ask=3,search=2",
+                        help="各接口的请求比例，可选 chat、ask、search、stream")
+    parser.add_argument("--long-tail", type=float, default=0.3, help="模板生成的长尾问题占比")
+    parser.add_argument("--zipf", type=float, default=1.1, help="热门问题 Zipf 分布的指数，越大越集中")
+    parser.add_argument("--reasoning", choices=("hide", "skip", "show"), default="hide")
+    parser.add_argument("--timeout", type=float, default=120.0, help="单个请求的超时（秒），同时作为服务端截止时间")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出全部结果")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    stages = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(stages, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
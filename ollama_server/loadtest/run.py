@@ -0,0 +1,102 @@
+"""
+一键压测：启动模拟 Ollama 和 ollama_server，等待 /ready 后运行 loadgen，结束后关闭两者
+
+在 ollama_server 目录下运行（知识库需已建好，或设置 KB_STORE=mmap 使用不依赖 Chroma 的向量存储）：
+    python -m loadtest.run --concurrency 1,4,16 --stage-seconds 30
+    python -m loadtest.run --workers 2 --fake-args "--tokens-per-second 40 --parallel 2 --error-rate 0.02"
+    python -m loadtest.run --fake-instances 3 --fake-args "--load-seconds 5"
+
+--fake-instances 大于 1 时启动多个模拟实例，通过 OLLAMA_BACKENDS 组成后端池。
+
+除 --port、--workers、--fake-port、--fake-instances、--fake-args、--ready-timeout、--server-log 外的参数原样传给 loadgen。
+服务端的其他配置（CHAT_TOP_K、GEN_MAX_CONCURRENCY 等）通过环境变量设置，对比改动前后的结果时保持一致
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+
+import httpx
+
+from loadtest import loadgen
+
+READY_POLL_SECONDS = 0.5
+
+
+def wait_http(url, timeout, process):
+    """轮询直到 url 返回 200；进程提前退出或超时时报错"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"进程已退出（返回码 {process.returncode}），请查看日志")
+        try:
+            if httpx.get(url, timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(READY_POLL_SECONDS)
+    raise RuntimeError(f"{url} 在 {timeout} 秒内未就绪")
+
+
+def stop(process):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动模拟 Ollama 与 ollama_server 并压测", add_help=False)
+    parser.add_argument("--port", type=int, default=8800, help="ollama_server 端口")
+    parser.add_argument("--workers", type=int, default=1, help="ollama_server worker 进程数")
+    parser.add_argument("--fake-port", type=int, default=11500, help="模拟 Ollama 端口，多个实例时为起始端口")
+    parser.add_argument("--fake-instances", type=int, default=1, help="模拟 Ollama 实例数")
+    parser.add_argument("--fake-args", default="", help="传给 loadtest.fake_ollama 的参数")
+    parser.add_argument("--ready-timeout", type=float, default=300.0, help="等待服务就绪的秒数（含加载嵌入模型）")
+    parser.add_argument("--server-log", default="loadtest_server.log", help="ollama_server 输出写入的文件")
+    args, rest = parser.parse_known_args()
+    load_args = loadgen.build_parser().parse_args(rest + ["--url", f"http://127.0.0.1:{args.port}"])
+
+    fake_hosts = [f"http://127.0.0.1:{args.fake_port + i}" for i in range(args.fake_instances)]
+    fake = subprocess.Popen([sys.executable, "-m", "loadtest.fake_ollama", "--port", str(args.fake_port),
+                             "--instances", str(args.fake_instances)] + shlex.split(args.fake_args))
+    server = None
+    try:
+        for host in fake_hosts:
+            wait_http(host + "/api/version", 30, fake)
+        env = dict(os.environ, OLLAMA_HOST=fake_hosts[0])
+        if args.fake_instances > 1:
+            env["OLLAMA_BACKENDS"] = ",".join(fake_hosts)
+        with open(args.server_log, "ab") as log:
+            server = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(args.port),
+                 "--workers", str(args.workers), "--log-level", "warning"],
+                env=env, stdout=log, stderr=subprocess.STDOUT,
+            )
+        print(f"等待 ollama_server 就绪（日志：{args.server_log}）...")
+        wait_http(f"http://127.0.0.1:{args.port}/ready", args.ready_timeout, server)
+
+        stages = asyncio.run(loadgen.run(load_args))
+        fake_stats = [httpx.get(host + "/fake/stats", timeout=5).json() for host in fake_hosts]
+        if load_args.json:
+            print(json.dumps({"stages": stages, "fake_ollama": fake_stats if len(fake_stats) > 1 else fake_stats[0]},
+                             ensure_ascii=False, indent=2))
+        else:
+            for host, stats in zip(fake_hosts, fake_stats):
+                print(f"\n模拟 Ollama {host}：收到 {stats['requests']} 个生成请求，完成 {stats['completed']}，"
+                      f"最大同时生成 {stats['max_active']}，加载模型 {stats['loads']} 次，输出 {stats['tokens']} 个 token")
+    finally:
+        if server is not None:
+            stop(server)
+        stop(fake)
+
+
+if __name__ == "__main__":
+    main()
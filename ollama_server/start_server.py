@@ -1,24 +1,58 @@
-#这东西是一个叫吕迪的山西大学的孩子花了三个星期完成的前端后端的项目，遇到很多困难，做出来其实很一般，但是我觉得我一直不断努力一会一定会更好的
-#还是可以的，但是要花很多时间去理解代码，并且要自己写一个前端，但是这个项目还是可以的。
-#这是一个启动Ollama API服务器的脚本
-import uvicorn
-import sys
-import os
-
-def main():
-    """
-    启动Ollama API服务器
-    """
-    host = "0.0.0.0"
-    port = 8000
-    
-    print(f"启动服务器在 {host}:{port}...")
-    
-    # 添加当前目录到PYTHONPATH
-    sys.path.insert(0, os.path.abspath("."))
-    
-    # 启动FastAPI服务器
-    uvicorn.run("app.main:app", host=host, port=port, reload=True)
-
-if __name__ == "__main__":
-    main()
\ No newline at end of file
+#这东西是一个叫吕迪的山西大学的孩子花了三个星期完成的前端后端的项目，遇到很多困难，做出来其实很一般，但是我觉得我一直不断努力一会一定会更好的
+#还是可以的，但是要花很多时间去理解代码，并且要自己写一个前端，但是这个项目还是可以的。
+#这是一个启动Ollama API服务器的脚本
+import argparse
+import uvicorn
+import sys
+import os
+
+# 生产模式下优雅退出时等待进行中请求的最长时间（秒），应大于单次生成的超时时间
+GRACEFUL_TIMEOUT = 75
+# 生产模式下收到 SIGTERM 后 /ready 先返回 503 的时长（秒）
+DRAIN_SECONDS = 5
+
+def main():
+    """
+    启动Ollama API服务器
+
+    默认为开发模式：单进程，开启代码热重载
+    --prod 为生产模式：多个 worker 进程，关闭热重载，SIGTERM 时优雅排空
+    """
+    parser = argparse.ArgumentParser(description="启动Ollama API服务器")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--prod", action="store_true", help="生产模式")
+    parser.add_argument("--workers", type=int, default=2, help="生产模式的 worker 进程数")
+    parser.add_argument("--graceful-timeout", type=int, default=GRACEFUL_TIMEOUT,
+                        help="优雅退出时等待进行中请求的秒数")
+    parser.add_argument("--drain-seconds", type=float, default=DRAIN_SECONDS,
+                        help="收到 SIGTERM 后先让 /ready 返回 503 的秒数")
+    args = parser.parse_args()
+
+    print(f"启动服务器在 {args.host}:{args.port}...")
+
+    # 添加当前目录到PYTHONPATH
+    sys.path.insert(0, os.path.abspath("."))
+
+    if not args.prod:
+        # 启动FastAPI服务器
+        uvicorn.run("app.main:app", host=args.host, port=args.port, reload=True)
+        return
+
+    # 每个 worker 各自加载一份嵌入模型和 Chroma 客户端（Chroma 的 SQLite 连接和
+    # PyTorch 线程池都不能安全地跨 fork 共享），推理线程按 worker 数平分 CPU，避免超额订阅
+    os.environ.setdefault("EMBED_THREADS", str(max(1, (os.cpu_count() or 1) // args.workers)))
+    os.environ.setdefault("SHUTDOWN_DRAIN_SECONDS", str(args.drain_seconds))
+    print(f"生产模式：{args.workers} 个 worker，每个 worker {os.environ['EMBED_THREADS']} 个推理线程")
+
+    uvicorn.run(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        log_level="info",
+    )
+
+if __name__ == "__main__":
+    main()
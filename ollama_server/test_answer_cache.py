@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+语义回答缓存测试：距离阈值、检索文档集合、TTL 过期以及 LRU / LFU 淘汰
+"""
+
+import numpy as np
+import pytest
+
+from app import answer_cache
+from app.answer_cache import SemanticCache
+
+
+def _vec(angle):
+    """二维单位向量，两个向量的余弦距离为 1 - cos(夹角)"""
+    return np.array([np.cos(angle), np.sin(angle)], dtype=np.float32)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache.time, "time", lambda: now[0])
+    return now
+
+
+def test_distance_threshold_and_doc_set():
+    cache = SemanticCache(max_distance=0.05, policy="lru")
+    cache.put(_vec(0.0), ["a", "b"], "回答")
+    # cos(0.2) ≈ 0.980，距离约 0.02，视为同一问题；文档集合与顺序无关
+    assert cache.get(_vec(0.2), ["b", "a"]) == "回答"
+    # cos(0.4) ≈ 0.921，距离约 0.08，超过阈值
+    assert cache.get(_vec(0.4), ["a", "b"]) is None
+    # 检索到的文档不同时不命中
+    assert cache.get(_vec(0.0), ["a"]) is None
+    # 向量长度不影响比较
+    assert cache.get(_vec(0.0) * 5, ["a", "b"]) == "回答"
+
+    # 相近的问题覆盖原有条目而不是新增
+    cache.put(_vec(0.1), ["a", "b"], "新回答")
+    assert cache.stats()["size"] == 1
+    assert cache.get(_vec(0.0), ["a", "b"]) == "新回答"
+    assert cache.stats()["hits"] == 3 and cache.stats()["misses"] == 2
+
+
+def test_ttl(clock):
+    cache = SemanticCache(ttl=60)
+    cache.put(_vec(0.0), ["a"], "回答")
+    clock[0] += 59
+    assert cache.get(_vec(0.0), ["a"]) == "回答"
+    # 过期时间从写入起算，命中不会延长
+    clock[0] += 2
+    assert cache.get(_vec(0.0), ["a"]) is None
+    assert cache.stats()["size"] == 0
+
+    # 覆盖写入刷新写入时间
+    cache.put(_vec(0.0), ["a"], "回答")
+    clock[0] += 50
+    cache.put(_vec(0.0), ["a"], "新回答")
+    clock[0] += 50
+    assert cache.get(_vec(0.0), ["a"]) == "新回答"
+
+
+def test_lru_eviction():
+    cache = SemanticCache(max_size=2, policy="lru")
+    cache.put(_vec(0.0), ["a"], "A")
+    cache.put(_vec(0.0), ["b"], "B")
+    # 访问 A 后 B 成为最久未使用的条目
+    assert cache.get(_vec(0.0), ["a"]) == "A"
+    cache.put(_vec(0.0), ["c"], "C")
+    assert cache.get(_vec(0.0), ["b"]) is None
+    assert cache.get(_vec(0.0), ["a"]) == "A"
+    assert cache.get(_vec(0.0), ["c"]) == "C"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lfu_eviction():
+    cache = SemanticCache(max_size=2, policy="lfu")
+    cache.put(_vec(0.0), ["a"], "A")
+    cache.put(_vec(0.0), ["b"], "B")
+    for _ in range(3):
+        cache.get(_vec(0.0), ["a"])
+    cache.get(_vec(0.0), ["b"])
+    # B 虽然是最近访问的，但命中次数少于 A，写入 C 时淘汰 B；新写入的条目本身不会被立即淘汰
+    cache.put(_vec(0.0), ["c"], "C")
+    assert cache.get(_vec(0.0), ["b"]) is None
+    assert cache.get(_vec(0.0), ["c"]) == "C"
+    assert cache.get(_vec(0.0), ["a"]) == "A"
+    # C 命中 1 次、A 命中 4 次，写入 D 时淘汰 C
+    cache.put(_vec(0.0), ["d"], "D")
+    assert cache.get(_vec(0.0), ["c"]) is None
+    assert cache.get(_vec(0.0), ["d"]) == "D"
+    assert cache.get(_vec(0.0), ["a"]) == "A"
+
+
+def test_invalid_policy():
+    with pytest.raises(ValueError):
+        SemanticCache(policy="fifo")
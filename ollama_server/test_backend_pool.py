@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Ollama 后端池测试：用 httpx.MockTransport 模拟多个 Ollama 实例，
+验证按负载和已加载模型选择后端、失败时换后端重试、连续失败后熔断以及熔断后的试探恢复
+"""
+
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app import backend_pool, ollama_client
+from app.backend_pool import BackendPool, ModelNotFound, OllamaUnavailable
+
+HOSTS = ["http://a:11434", "http://b:11434"]
+
+
+class FakeHosts:
+    """按主机名返回预设状态码的假 Ollama，记录每个实例收到的生成请求"""
+
+    def __init__(self):
+        self.status = {"a": 200, "b": 200}
+        self.models = {"a": {"deepseek-r1:7b"}, "b": {"deepseek-r1:7b", "qwen2.5:1.5b"}}
+        self.calls = {"a": 0, "b": 0}
+
+    def __call__(self, request):
+        host = request.url.host
+        if request.url.path == "/api/tags":
+            return httpx.Response(200, json={"models": [{"name": name} for name in sorted(self.models[host])]})
+        if request.url.path in ("/api/ps", "/api/version"):
+            return httpx.Response(404)
+        self.calls[host] += 1
+        if json.loads(request.content)["model"] not in self.models[host]:
+            return httpx.Response(404, json={"error": "model not found"})
+        if self.status[host] != 200:
+            return httpx.Response(self.status[host], json={"error": "boom"})
+        lines = [{"response": host, "done": False}, {"response": "", "done": True, "context": [1, 2]}]
+        return httpx.Response(200, content="".join(json.dumps(line) + "\n" for line in lines).encode())
+
+
+@pytest.fixture
+def hosts(monkeypatch):
+    fake = FakeHosts()
+    pool = BackendPool(HOSTS, transport=httpx.MockTransport(fake))
+    monkeypatch.setattr(ollama_client, "_pool", pool)
+    return fake, pool
+
+
+def _generate(model="deepseek-r1:7b"):
+    async def run():
+        return [chunk async for chunk in ollama_client.stream_generate_async("你好", model=model)]
+
+    return asyncio.run(run())
+
+
+def test_prefers_loaded_model_then_least_outstanding(hosts):
+    _, pool = hosts
+    a, b = pool.backends
+    b.loaded.add("deepseek-r1:7b")
+    # b 已加载模型：进行中的请求数不超过 a + POOL_COLD_PENALTY 时仍选 b
+    assert pool.acquire("deepseek-r1:7b") is b
+    assert pool.acquire("deepseek-r1:7b") is b
+    b.outstanding += 1
+    assert pool.acquire("deepseek-r1:7b") is a
+    for backend in (a, b, b, b):
+        pool.release(backend, "deepseek-r1:7b", "cancelled")
+    assert a.outstanding == b.outstanding == 0
+
+
+def test_model_affinity_from_health_check(hosts):
+    fake, pool = hosts
+    asyncio.run(pool.check_all())
+    # 只有 b 有 qwen2.5:1.5b，不会发给 a
+    assert _generate("qwen2.5:1.5b")[0]["response"] == "b"
+    assert fake.calls["a"] == 0
+    with pytest.raises(ModelNotFound):
+        _generate("llama3")
+
+
+def test_failover_and_circuit_breaker(hosts, monkeypatch):
+    fake, pool = hosts
+    a, b = pool.backends
+    a.loaded.add("deepseek-r1:7b")
+    fake.status["a"] = 500
+    for _ in range(backend_pool.POOL_FAILURE_THRESHOLD):
+        # a 返回 500 后换到 b，调用方拿到的是 b 的正常输出
+        assert _generate()[0]["response"] == "b"
+    assert a.state == backend_pool.OPEN
+    calls = fake.calls["a"]
+    _generate()
+    assert fake.calls["a"] == calls
+
+    # 熔断期满后放行一个试探请求，成功即恢复
+    fake.status["a"] = 200
+    monkeypatch.setattr(backend_pool, "POOL_OPEN_SECONDS", 0.0)
+    b.outstanding += 10
+    assert _generate()[0]["response"] == "a"
+    assert a.state == backend_pool.CLOSED and a.failures == 0
+    b.outstanding -= 10
+
+
+def test_all_backends_failing(hosts):
+    fake, pool = hosts
+    fake.status.update(a=500, b=500)
+    # 全部 5xx 时返回最后一个错误片段
+    assert "500" in _generate()[0]["error"]
+    for backend in pool.backends:
+        backend.healthy = False
+    with pytest.raises(OllamaUnavailable):
+        _generate()
+
+
+def test_failure_is_flagged_by_type(hosts, monkeypatch):
+    fake, _ = hosts
+    monkeypatch.setattr(ollama_client, "OLLAMA_BACKENDS", HOSTS)
+    answer = asyncio.run(ollama_client.generate_response_async("你好"))
+    assert answer in ("a", "b")
+    assert not ollama_client.is_error_response(answer)
+
+    fake.status.update(a=500, b=500)
+    answer = asyncio.run(ollama_client.generate_response_async("你好"))
+    assert ollama_client.is_error_response(answer) and "500" in answer
+    # 模型的正常回答以“抱歉，”开头时不算失败
+    assert not ollama_client.is_error_response("抱歉，该业务暂不支持线上办理。")
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+客户端断开时的生成取消测试
+用一个只会 sleep 的假 ollama 可执行文件模拟长时间生成，
+验证客户端断开后生成名额在限定时间内释放、子进程被结束
+"""
+
+import asyncio
+import os
+import stat
+import sys
+import time
+
+import pytest
+
+from app import ollama_client
+from app.cancellation import ClientDisconnected, cancel_on_disconnect
+from app.scheduler import GenerationScheduler
+from app.singleflight import SingleFlight
+
+# 断开后名额必须在该时间内释放（秒）
+RELEASE_BOUND = 1.0
+
+
+class FakeRequest:
+    """只实现 is_disconnected() 的假请求"""
+
+    def __init__(self):
+        self.disconnected = False
+
+    async def is_disconnected(self):
+        return self.disconnected
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+@pytest.fixture
+def fake_ollama(tmp_path, monkeypatch):
+    """记录自身 pid 后长时间 sleep 的假 ollama"""
+    pid_file = tmp_path / "ollama.pid"
+    script = tmp_path / "ollama"
+    script.write_text(f"#!/bin/sh\necho $$ > {pid_file}\nexec sleep 30\n")
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(ollama_client, "OLLAMA_BIN", str(script))
+    return pid_file
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="假 ollama 为 shell 脚本")
+def test_disconnect_releases_slot(fake_ollama):
+    """客户端断开后，生成名额和 ollama 子进程都应在限定时间内释放"""
+
+    async def run():
+        scheduler = GenerationScheduler(concurrency=1, max_queue=4)
+        inflight = SingleFlight()
+        request = FakeRequest()
+
+        async def generate():
+            async with scheduler.slot("interactive"):
+                return await ollama_client.generate_response_async("你好", timeout=30)
+
+        async def handle():
+            return await inflight.do("key", generate)
+
+        task = asyncio.ensure_future(cancel_on_disconnect(request, handle(), poll_interval=0.05))
+
+        # 等待生成开始
+        while not fake_ollama.exists() or not fake_ollama.read_text().strip():
+            await asyncio.sleep(0.05)
+        pid = int(fake_ollama.read_text())
+        assert scheduler.active == 1
+
+        request.disconnected = True
+        disconnected_at = time.monotonic()
+        with pytest.raises(ClientDisconnected):
+            await task
+
+        while scheduler.active and time.monotonic() - disconnected_at < RELEASE_BOUND:
+            await asyncio.sleep(0.01)
+        assert scheduler.active == 0
+        assert inflight.in_flight == 0
+
+        while _pid_alive(pid) and time.monotonic() - disconnected_at < RELEASE_BOUND:
+            await asyncio.sleep(0.05)
+        assert not _pid_alive(pid)
+        assert time.monotonic() - disconnected_at < RELEASE_BOUND
+
+    asyncio.run(run())
+
+
+def test_waiting_request_leaves_queue_on_disconnect():
+    """排队中的请求断开后应离开队列，不占用后续名额"""
+
+    async def run():
+        scheduler = GenerationScheduler(concurrency=1, max_queue=4)
+        release = asyncio.Event()
+
+        async def holder():
+            async with scheduler.slot("interactive"):
+                await release.wait()
+
+        async def waiter():
+            async with scheduler.slot("interactive"):
+                pass
+
+        holding = asyncio.ensure_future(holder())
+        await asyncio.sleep(0)
+        request = FakeRequest()
+        task = asyncio.ensure_future(cancel_on_disconnect(request, waiter(), poll_interval=0.05))
+        await asyncio.sleep(0.05)
+        assert scheduler.queue_depth == 1
+
+        request.disconnected = True
+        with pytest.raises(ClientDisconnected):
+            await task
+        assert scheduler.queue_depth == 0
+
+        release.set()
+        await holding
+        assert scheduler.active == 0
+
+    asyncio.run(run())
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+文档切分测试
+片段按整句打包，不超过目标大小，相邻片段有重叠，偏移量能从原文取回片段内容
+"""
+
+import io
+
+from app.chunking import chunk_text, iter_chunks
+from app.context_builder import estimate_tokens
+
+SENTENCES = [
+    "信用卡年费为每年两百元。",
+    "持卡人每年刷卡满六次可免次年年费！",
+    "转账限额可以在手机银行中调整吗？",
+    "Online banking supports SWIFT transfers; fees apply.",
+    "第三章 贷款业务\n",
+    "\n\n",
+]
+
+
+def _document(n=300):
+    return "".join(SENTENCES[(i * 7) % len(SENTENCES)] for i in range(n))
+
+
+def test_chunks_pack_sentences_with_overlap_and_offsets():
+    doc = _document()
+    chunks = chunk_text(doc, target_tokens=80, overlap_tokens=20)
+    assert [chunk.index for chunk in chunks] == list(range(len(chunks)))
+    for chunk in chunks:
+        assert doc[chunk.start:chunk.end] == chunk.text
+        assert chunk.tokens <= 80
+    # 除文档末尾外大小均匀
+    assert min(chunk.tokens for chunk in chunks[:-1]) >= 60
+    for prev, chunk in zip(chunks, chunks[1:]):
+        # 下一片段从上一片段末尾的某一句开始
+        assert prev.start < chunk.start <= prev.end
+    assert chunks[0].start == 0 and chunks[-1].end == len(doc.rstrip())
+
+
+def test_long_sentence_is_split_and_stream_matches_text():
+    doc = "开头一句。" + "这是一个没有句号的超长句子，" * 40 + "结束。\n" + "x" * 2000
+    chunks = chunk_text(doc, target_tokens=100, overlap_tokens=10)
+    assert all(estimate_tokens(chunk.text) <= 101 for chunk in chunks)
+    # 片段之间不漏掉内容
+    for prev, chunk in zip(chunks, chunks[1:]):
+        assert not doc[prev.end:chunk.start].strip()
+    assert chunks[-1].end == len(doc)
+    # 逐行读取与整篇切分结果相同
+    streamed = list(iter_chunks(io.StringIO(doc), target_tokens=100, overlap_tokens=10))
+    assert streamed == chunks
+    assert chunk_text("太短") == []
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+背景知识组装测试：近似重复的片段被丢弃，总量不超过 token 预算，
+过长的片段只保留与问题相关的句子，单句超限时按 token 估算截断；节省的 token 数不为负
+"""
+
+from app.bm25_index import tokenize
+from app.context_builder import _trim_to_relevant, build_context, estimate_tokens
+
+LPR = "LPR 是贷款市场报价利率，由报价行按公开市场操作利率加点报出。"
+LPR_COPY = "LPR 是贷款市场报价利率，由报价行按公开市场操作利率加点报出！"
+CARD = "信用卡免息期最长 56 天，到期还款日前全额还款不收利息。"
+DEPOSIT = "大额存单起存金额 20 万元，可以提前支取，提前支取部分按活期计息。"
+
+
+def _hits(*documents):
+    return [{"id": f"doc_{i}", "document": doc} for i, doc in enumerate(documents)]
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("贷款利率") == 4
+    assert estimate_tokens("abcd") == 1
+    assert estimate_tokens("abcde") == 2
+    assert estimate_tokens("LPR 利率") == 3
+
+
+def test_near_duplicates_are_dropped():
+    context, used, stats = build_context("LPR 是什么", _hits(LPR, LPR_COPY, CARD))
+    assert [hit["id"] for hit in used] == ["doc_0", "doc_2"]
+    assert stats["duplicates_dropped"] == 1
+    assert context == LPR + "\n" + CARD
+    assert stats["tokens_after"] == estimate_tokens(LPR) + estimate_tokens(CARD)
+
+
+def test_budget_is_respected():
+    hits = _hits(LPR, CARD, DEPOSIT)
+    budget = estimate_tokens(LPR) + 10
+    context, used, stats = build_context("LPR 信用卡 大额存单", hits, token_budget=budget)
+    assert stats["tokens_after"] <= budget
+    assert estimate_tokens(context.replace("\n", "")) <= budget
+    assert used[0]["id"] == "doc_0"
+
+    _, used, stats = build_context("LPR", hits, max_chunks=1)
+    assert len(used) == 1 and stats["chunks_used"] == 1 and stats["chunks_retrieved"] == 3
+
+
+def test_long_chunk_keeps_relevant_sentences():
+    document = "网点营业时间为工作日九点至十七点。" * 3 + "大额存单可以提前支取。" + "周末部分网点不营业。"
+    query_terms = set(tokenize("大额存单能提前支取吗"))
+    trimmed = _trim_to_relevant(document, query_terms, 12)
+    assert trimmed == "大额存单可以提前支取。"
+
+
+def test_single_long_sentence_is_cut_by_tokens():
+    # 一整句超过上限，按估算的 token 数而不是字符数截断
+    sentence = "abcd" * 40 + "。"
+    trimmed = _trim_to_relevant(sentence, set(), 10)
+    assert estimate_tokens(trimmed) <= 10
+    assert len(trimmed) > 10
+    assert sentence.startswith(trimmed)
+
+
+def test_tokens_saved_is_never_negative():
+    # 前两个片段重复，max_chunks=2 时由排名靠后的长片段替补，使用的 token 数超过基准
+    long_doc = "贷款审批需要提供收入证明和征信报告，审批通过后签订合同并办理抵押登记。" * 2
+    _, used, stats = build_context("贷款", _hits(LPR, LPR_COPY, long_doc), max_chunks=2)
+    assert len(used) == 2
+    assert stats["tokens_after"] > stats["tokens_before"]
+    assert stats["tokens_saved"] == 0
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+嵌入后端一致性测试
+比较 ONNX Runtime 后端（fp32 与 int8 量化）与 PyTorch 后端输出向量的余弦相似度
+需要先运行 python -m app.export_onnx 导出模型，未导出时跳过
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from app.embeddings import EMBED_MODEL_NAME, ONNX_MODEL_DIR
+
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("onnxruntime")
+
+if not os.path.exists(os.path.join(ONNX_MODEL_DIR, "export_config.json")):
+    pytest.skip(f"未找到导出的 ONNX 模型: {ONNX_MODEL_DIR}", allow_module_level=True)
+
+from app.embeddings import OnnxBackend, TorchBackend
+
+# 平均余弦相似度下限 / 单条最低余弦相似度下限
+THRESHOLDS = {
+    False: (0.999, 0.995),  # fp32
+    True: (0.98, 0.95),     # int8 动态量化
+}
+
+SENTENCES = [
+    "LPR 是贷款市场报价利率",
+    "大额存单可以提前支取吗",
+    "信用卡逾期会影响征信吗",
+    "银行卡丢失了怎么办",
+    "手机银行的转账限额是多少",
+    "What are the business hours of the branch?",
+    "短",
+    "房贷利率以 LPR 为基准加点确定，首套房和二套房的加点幅度不同。" * 8,
+]
+
+
+@pytest.fixture(scope="module")
+def torch_embeddings():
+    return TorchBackend(EMBED_MODEL_NAME).encode(SENTENCES, batch_size=4)
+
+
+@pytest.mark.parametrize("quantized", [False, True], ids=["fp32", "int8"])
+def test_onnx_matches_torch(torch_embeddings, quantized):
+    """ONNX 后端的向量与 PyTorch 后端的余弦相似度应足够接近"""
+    onnx_embeddings = OnnxBackend(ONNX_MODEL_DIR, quantized=quantized).encode(SENTENCES, batch_size=4)
+
+    assert onnx_embeddings.shape == torch_embeddings.shape
+    assert np.allclose(np.linalg.norm(onnx_embeddings, axis=1), 1.0, atol=1e-4)
+
+    cosines = np.sum(onnx_embeddings * torch_embeddings, axis=1)
+    mean_floor, min_floor = THRESHOLDS[quantized]
+    assert cosines.mean() >= mean_floor, cosines
+    assert cosines.min() >= min_floor, cosines
+
+
+def test_onnx_single_text_matches_batch():
+    """单条输入与批量输入（含 padding）的结果应一致"""
+    backend = OnnxBackend(ONNX_MODEL_DIR, quantized=False)
+    batch = backend.encode(SENTENCES, batch_size=8)
+    single = np.stack([backend.encode(text) for text in SENTENCES])
+    assert np.allclose(batch, single, atol=1e-4)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+FAQ 层测试：匹配分数高于 FAQ_CONFIDENCE 才直接返回精选答案，其余问题交给 LLM；
+QAProcessor 加载失败时关闭 FAQ 层，并发的首批请求只加载一次
+"""
+
+import threading
+import time
+
+import pytest
+
+from app import faq_tier
+from app.faq_tier import FAQTier
+
+ITEM = {"id": 7, "question": "LPR 是什么？", "answer": "贷款市场报价利率。", "category": "贷款服务"}
+
+
+class FakeProcessor:
+    instances = 0
+
+    def __init__(self):
+        FakeProcessor.instances += 1
+
+    def initialize(self):
+        # 模拟加载 FAQ 知识库和 TF-IDF 的耗时，让并发请求同时进入加载
+        time.sleep(0.05)
+
+    def match_query(self, query):
+        return {"item": ITEM, "score": 0.9 if "LPR" in query else 0.3}
+
+
+@pytest.fixture
+def fake_processor(monkeypatch):
+    FakeProcessor.instances = 0
+    monkeypatch.setattr(faq_tier, "_load_qa_processor_class", lambda: FakeProcessor)
+    return FakeProcessor
+
+
+def test_confidence_threshold():
+    tier = FAQTier(confidence=0.7)
+    assert tier.answer({"item": ITEM, "score": 0.71}) == dict(ITEM, score=0.71)
+    # 分数等于阈值、没有匹配项或没有结果时都交给 LLM
+    assert tier.answer({"item": ITEM, "score": 0.7}) is None
+    assert tier.answer({"item": None, "score": 0.95}) is None
+    assert tier.answer(None) is None
+
+
+def test_low_confidence_falls_through(fake_processor):
+    tier = FAQTier(confidence=0.7, enabled=True)
+    assert tier.answer(tier.analyze("LPR 怎么算")) is not None
+    assert tier.answer(tier.analyze("信用卡怎么还款")) is None
+
+
+def test_disabled_or_failed_tier_returns_none(monkeypatch):
+    assert FAQTier(enabled=False).analyze("LPR") is None
+
+    def broken():
+        raise FileNotFoundError("qa_processor.py")
+
+    monkeypatch.setattr(faq_tier, "_load_qa_processor_class", broken)
+    tier = FAQTier(enabled=True)
+    assert tier.analyze("LPR") is None
+    assert tier.stats()["loaded"] is False and "qa_processor.py" in tier.stats()["load_error"]
+
+
+def test_concurrent_first_requests_load_once(fake_processor):
+    tier = FAQTier(enabled=True)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(tier.analyze("LPR"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert fake_processor.instances == 1
+    assert len(results) == 8 and all(result["item"] is ITEM for result in results)
+
+
+def test_real_faq_knowledge_base():
+    tier = FAQTier(confidence=0.7, enabled=True)
+    if tier.processor is None:
+        pytest.skip(f"无法加载 SmartQAApp 的 QAProcessor：{tier.stats()['load_error']}")
+    hit = tier.answer(tier.analyze("如何开立银行账户?"))
+    assert hit is not None and hit["id"] == 1 and hit["category"] == "账户服务"
+    # 与 FAQ 相关但不够接近的问题、无关的问题都交给 LLM
+    assert tier.answer(tier.analyze("LPR 和房贷利率是什么关系？")) is None
+    assert tier.answer(tier.analyze("今天天气怎么样")) is None
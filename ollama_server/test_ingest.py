@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+批量导入测试
+写入中途失败后重新导入同一文档，不会因为部分片段已带上新的 file_hash 而被当作未变化跳过；
+逐行解析上传的文档，任务从提交到完成（或失败）的状态变化，以及其他 worker 读取状态文件
+"""
+
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pytest
+
+from app import bm25_index
+from app.chunking import chunk_text
+from app.ingest import ORIGIN_BULK, BatchWriter, IngestWorker, parse_document
+from app.vector_store import MmapStore
+
+DIM = 8
+
+
+class FakeEncoder:
+    """按文本哈希生成确定的向量；fail_after 次 encode 之后抛出异常，模拟写入中途崩溃"""
+
+    def __init__(self, fail_after=None):
+        self.calls = 0
+        self.fail_after = fail_after
+
+    def encode(self, texts, batch_size=32):
+        self.calls += 1
+        if self.fail_after is not None and self.calls > self.fail_after:
+            raise RuntimeError("模拟 encode 失败")
+        rows = [np.frombuffer(hashlib.sha256(text.encode("utf-8")).digest()[:DIM], dtype=np.uint8) for text in texts]
+        return np.asarray(rows, dtype=np.float32) + 1.0
+
+
+def _text(n):
+    return "".join(f"第{i}条规定：办理该业务需要携带本人有效身份证件并填写申请表。" for i in range(n))
+
+
+def _ingest(worker, source, text):
+    job = worker.create_job()
+    writer = BatchWriter(worker.collection, worker.embed_model, worker.batch_size)
+    worker._ingest_document(job, writer, source, text, {})
+    writer.flush()
+    return job
+
+
+def _submit(worker, lines):
+    job = worker.create_job()
+    with open(job.spool_path, "wb") as f:
+        for line in lines:
+            raw = (line if isinstance(line, str) else json.dumps(line, ensure_ascii=False)).encode("utf-8") + b"\n"
+            f.write(raw)
+            job.bytes_received += len(raw)
+    worker.submit(job)
+    return job
+
+
+def _wait(worker, job_id, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        state = worker.get(job_id)
+        if state["status"] in ("done", "failed"):
+            return state
+        time.sleep(0.02)
+    raise AssertionError(f"任务 {job_id} 未在 {timeout} 秒内结束")
+
+
+def _wait_rebuild(worker, count, timeout=10):
+    deadline = time.monotonic() + timeout
+    while worker.bm25_rebuilds < count and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert worker.bm25_rebuilds == count
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(bm25_index, "BM25_DIR", str(tmp_path / "bm25"))
+    return MmapStore(str(tmp_path / "kb"), "kb_test")
+
+
+def test_parse_document():
+    source, text, metadata = parse_document(
+        json.dumps({"source": " 贷款.txt ", "text": "正文", "metadata": {"year": 2024, "domain": "贷款服务"}})
+    )
+    assert (source, text, metadata) == ("贷款.txt", "正文", {"year": 2024, "domain": "贷款服务"})
+    assert parse_document('{"source": "a", "text": ""}') == ("a", "", {})
+
+    for line, reason in (
+        ("{", "JSON 格式错误"),
+        ("[1, 2]", "JSON 对象"),
+        ('{"text": "正文"}', "缺少 source"),
+        ('{"source": "  ", "text": "正文"}', "缺少 source"),
+        ('{"source": "a"}', "缺少 text"),
+        ('{"source": "a", "text": "正文", "metadata": [1]}', "metadata 应为对象"),
+        ('{"source": "a", "text": "正文", "metadata": {"origin": "x"}}', "保留字段 origin"),
+        ('{"source": "a", "text": "正文", "metadata": {"tags": ["x"]}}', "metadata.tags"),
+        ('{"source": "a", "text": "正文", "metadata": {"domain": "不存在"}}', "未知的 domain"),
+    ):
+        with pytest.raises(ValueError) as exc:
+            parse_document(line)
+        assert reason in str(exc.value), line
+
+
+def test_job_lifecycle(store, tmp_path):
+    changes = []
+    spool_dir = str(tmp_path / "spool")
+    worker = IngestWorker(store, FakeEncoder(), spool_dir=spool_dir, batch_size=4,
+                          on_change=lambda: changes.append(1))
+    job = _submit(worker, [
+        {"source": "a.txt", "text": _text(3)},
+        "不是 JSON",
+        {"source": "b.txt", "text": _text(2), "metadata": {"year": 2024}},
+        "",
+        {"source": "a.txt", "text": _text(3)},
+    ])
+    assert worker.get(job.id)["status"] in ("queued", "running", "done")
+
+    state = _wait(worker, job.id)
+    assert state["status"] == "done" and state["progress"] == 1.0
+    assert state["docs_done"] == 3 and state["docs_unchanged"] == 1 and state["docs_failed"] == 1
+    assert [error["line"] for error in state["errors"]] == [2]
+    assert "JSON 格式错误" in state["errors"][0]["error"]
+    assert state["chunks_embedded"] == len(chunk_text(_text(3))) + len(chunk_text(_text(2)))
+    assert not os.path.exists(job.spool_path)
+
+    result = store.get(where={"source": "b.txt"}, include=["metadatas"])
+    assert result["ids"] and all(meta["origin"] == ORIGIN_BULK and meta["year"] == 2024
+                                 for meta in result["metadatas"])
+
+    # 整个队列处理完后重建一次 BM25 索引并通知
+    _wait_rebuild(worker, 1)
+    assert changes == [1]
+    assert os.path.exists(bm25_index.bm25_path(store.name))
+
+    # 其他 worker 进程从状态文件读取任务状态
+    other = IngestWorker(store, FakeEncoder(), spool_dir=spool_dir)
+    assert other.get(job.id)["status"] == "done"
+    assert other.get(job.id)["docs_done"] == 3
+    assert other.get("../secret") is None and other.get("missing") is None
+
+    stats = worker.stats()
+    assert stats["completed"] == 1 and stats["failed"] == 0 and stats["running"] is None
+
+    # 按 source 删除
+    assert worker.delete_source("a.txt") == len(chunk_text(_text(3)))
+    assert store.get(where={"source": "a.txt"}, include=[])["ids"] == []
+    assert worker.delete_source("a.txt") == 0
+
+
+def test_failed_job(store, tmp_path):
+    worker = IngestWorker(store, FakeEncoder(fail_after=0), spool_dir=str(tmp_path / "spool"))
+    job = _submit(worker, [{"source": "a.txt", "text": _text(3)}])
+    state = _wait(worker, job.id)
+    assert state["status"] == "failed" and "模拟 encode 失败" in state["error"]
+    assert not os.path.exists(job.spool_path)
+    assert worker.stats()["failed"] == 1
+
+    # 失败不影响后续任务
+    worker.embed_model = FakeEncoder()
+    assert _wait(worker, _submit(worker, [{"source": "a.txt", "text": _text(3)}]).id)["status"] == "done"
+    _wait_rebuild(worker, 1)
+
+
+def test_crash_mid_document_is_not_skipped(store, tmp_path):
+    worker = IngestWorker(store, FakeEncoder(), spool_dir=str(tmp_path / "spool"), batch_size=2)
+    _ingest(worker, "doc", _text(40))
+    assert len(chunk_text(_text(40))) < len(chunk_text(_text(80)))
+
+    # 文档变长：前面的片段不变，新增的片段在文档处理完之后的最后一批 encode 失败
+    changed = len(chunk_text(_text(80))) - len(chunk_text(_text(40))) + 1
+    worker.embed_model = FakeEncoder(fail_after=(changed - 1) // worker.batch_size)
+    with pytest.raises(RuntimeError):
+        _ingest(worker, "doc", _text(80))
+
+    worker.embed_model = FakeEncoder()
+    job = _ingest(worker, "doc", _text(80))
+    assert job.docs_unchanged == 0
+    expected = chunk_text(_text(80))
+    result = store.get(where={"source": "doc"})
+    assert sorted(result["ids"]) == sorted(f"doc_{chunk.index}" for chunk in expected)
+    assert sorted(result["documents"]) == sorted(chunk.text for chunk in expected)
+    assert len({meta["file_hash"] for meta in result["metadatas"]}) == 1
+
+    # 完整写入后再次导入相同内容才跳过
+    assert _ingest(worker, "doc", _text(80)).docs_unchanged == 1
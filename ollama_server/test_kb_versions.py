@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+知识库版本测试：多个 worker 各自持有 ActiveCollection，
+任一 worker 修改当前版本的内容或切换别名后，其他 worker 在下一次检查时都会收到通知；
+切换前的校验、别名切换与回滚，以及切换期间导入等待排他锁
+"""
+
+import threading
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip("chromadb")
+
+from app import kb_versions  # noqa: E402
+from app.ingest import IngestWorker  # noqa: E402
+
+
+@pytest.fixture
+def versions(tmp_path, monkeypatch):
+    monkeypatch.setattr(kb_versions, "KB_VERSIONS_DIR", str(tmp_path))
+    monkeypatch.setattr(kb_versions, "KB_ALIAS_PATH", str(tmp_path / "alias.json"))
+    monkeypatch.setattr(kb_versions, "KB_ALIAS_CHECK_SECONDS", 0.0)
+    kb_versions._clients.clear()
+    return tmp_path
+
+
+def _build(name, n=4):
+    store = kb_versions.create_version(name, store="mmap")
+    embeddings = np.eye(n, 8, dtype=np.float32)
+    store.upsert(ids=[f"{name}_{i}" for i in range(n)], embeddings=embeddings,
+                 documents=[f"片段{i}" for i in range(n)], metadatas=[{"source": name}] * n)
+    return store
+
+
+def test_content_change_reaches_other_workers(versions):
+    _build(kb_versions.version_name(1))
+    kb_versions.activate(kb_versions.version_name(1))
+    calls = {"a": 0, "b": 0}
+    a = kb_versions.ActiveCollection(on_switch=lambda: calls.__setitem__("a", calls["a"] + 1))
+    b = kb_versions.ActiveCollection(on_switch=lambda: calls.__setitem__("b", calls["b"] + 1))
+    assert calls == {"a": 0, "b": 0}
+    assert a.version == b.version
+
+    # worker a 导入后递增内容代数，b 下一次检查时发现变化
+    a.mark_changed()
+    assert calls["a"] == 1
+    assert a.generation == 1 and b.generation == 0
+    b.current()
+    assert calls == {"a": 1, "b": 1}
+    assert a.version == b.version
+
+    # 没有变化时不重复通知
+    a.current()
+    b.current()
+    assert calls == {"a": 1, "b": 1}
+
+    # 切换版本只通知一次，新版本的内容代数从该版本目录读取
+    _build(kb_versions.version_name(2))
+    kb_versions.bump_generation(kb_versions.version_name(2))
+    kb_versions.activate(kb_versions.version_name(2))
+    b.current()
+    assert calls["b"] == 2
+    assert b.name == kb_versions.version_name(2) and b.generation == 1
+
+
+def test_validate_version(versions):
+    name = kb_versions.version_name(1)
+    store = _build(name)
+    assert kb_versions.validate_version(store, 4, 8) == []
+    assert kb_versions.validate_version(store, 4, 8, active_count=4) == []
+
+    errors = kb_versions.validate_version(store, 5, 8)
+    assert len(errors) == 1 and "写入数 5" in errors[0]
+    errors = kb_versions.validate_version(store, 4, 16)
+    assert len(errors) == 1 and "向量维度" in errors[0]
+    # 片段数远少于当前版本，多半是文档目录不完整
+    errors = kb_versions.validate_version(store, 4, 8, active_count=100)
+    assert len(errors) == 1 and "不足当前版本" in errors[0]
+
+    empty = kb_versions.create_version(kb_versions.version_name(2), store="mmap")
+    assert kb_versions.validate_version(empty, 0, 8) == ["新版本没有任何片段"]
+
+
+def test_activate_and_rollback(versions):
+    v1, v2 = kb_versions.version_name(1), kb_versions.version_name(2)
+    _build(v1)
+    _build(v2)
+    with pytest.raises(ValueError):
+        kb_versions.activate(kb_versions.version_name(3))
+
+    kb_versions.activate(v1)
+    worker = kb_versions.ActiveCollection()
+    assert worker.name == v1
+
+    kb_versions.activate(v2)
+    assert kb_versions.read_alias()["active"] == v2
+    assert kb_versions.read_alias()["previous"] == v1
+    assert worker.name == v2 and worker.switches == 1
+    assert worker.count() == 4
+
+    assert kb_versions.rollback() == v1
+    alias = kb_versions.read_alias()
+    assert (alias["active"], alias["previous"]) == (v1, v2)
+    assert worker.name == v1 and worker.switches == 2
+
+
+def test_ingest_waits_for_swap_and_writes_to_new_version(versions, monkeypatch):
+    v1, v2 = kb_versions.version_name(1), kb_versions.version_name(2)
+    _build(v1)
+    kb_versions.activate(v1)
+    # 导入线程检查别名的间隔很长，只有拿到锁后的 refresh 才会发现切换
+    monkeypatch.setattr(kb_versions, "KB_ALIAS_CHECK_SECONDS", 3600.0)
+    worker = kb_versions.ActiveCollection()
+    assert worker.name == v1
+
+    ingest = IngestWorker(worker, None, spool_dir=str(versions / "spool"), swap_lock=kb_versions.swap_lock)
+    written = []
+
+    def write():
+        with ingest._locked():
+            written.append(worker.name)
+
+    with kb_versions.swap_lock(exclusive=True):
+        thread = threading.Thread(target=write)
+        thread.start()
+        time.sleep(0.2)
+        # 持有排他锁期间导入被阻塞，此时切换别名
+        assert written == []
+        _build(v2)
+        kb_versions.activate(v2)
+    thread.join(timeout=5)
+    assert written == [v2]
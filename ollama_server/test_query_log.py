@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+查询日志测试
+后台线程写入的记录应能被离线分析读回：超过大小上限时换新文件，不完整的行计入无法解析，
+近似计数仍能找出热门问题
+"""
+
+import json
+import os
+import time
+
+from app.query_log import QueryLogWriter
+from app.query_report import HeavyHitters, Report, iter_files, iter_records
+
+
+def _event(query, tier="llm", distance=0.3, stages=None):
+    return {
+        "event": "chat",
+        "query": query,
+        "tier": tier,
+        "faq_score": 0.2,
+        "hits": [{"id": "doc.txt_0", "distance": distance, "score": 0.016}],
+        "used": ["doc.txt_0"],
+        "answer_chars": 42,
+        "stages": stages or {"embed": 0.004, "generation": 1.5},
+    }
+
+
+def test_writer_rotates_and_report_reads_back(tmp_path):
+    writer = QueryLogWriter(log_dir=str(tmp_path), rotate_bytes=2000, flush_seconds=0.05)
+    for i in range(30):
+        writer.write(_event("转账限额？" if i % 3 else "挂失 信用卡", distance=0.3 if i % 3 else 1.5),
+                     total_seconds=1.6)
+        if i % 10 == 9:
+            # 每批记录一次写入，分三批写才会触发轮转
+            deadline = time.time() + 5
+            while writer.written < i + 1 and time.time() < deadline:
+                time.sleep(0.01)
+    writer.close()
+    assert writer.written == 30 and writer.dropped == 0
+    files = iter_files([str(tmp_path)])
+    assert len(files) > 1
+
+    first = json.loads(open(files[0], encoding="utf-8").readline())
+    assert first["q"] == "挂失信用卡"
+    assert first["id"] == "doc.txt_0" and first["distance"] == 1.5
+    assert first["stages"] == {"embed": 4.0, "generation": 1500.0} and first["total_ms"] == 1600.0
+
+    with open(files[-1], "ab") as f:
+        f.write(b'{"ts": 1, "q": "')  # 进程被强制结束时写了一半的行
+    report = Report(max_distance=1.0, keywords=["挂失", "信用", "信用卡", "转账"])
+    for record in iter_records(files, report.stats):
+        report.add(record)
+    result = report.to_dict(top=5)
+    assert result["records"] == 30 and result["invalid_lines"] == 1
+    assert result["top_queries"][0] == {"query": "转账限额", "count": 20}
+    assert result["low_confidence"] == 10
+    assert result["low_confidence_clusters"] == [{"cluster": "信用卡+挂失", "count": 10, "examples": ["挂失信用卡"]}]
+    assert sum(row["requests_per_day"] for row in result["by_hour"]) == 30
+    # 对数分桶，分位数的相对误差不超过 5%
+    assert abs(result["by_hour"][0]["p50_ms"] - 1600) / 1600 <= 0.05
+
+
+def test_heavy_hitters_keeps_frequent_items_with_bounded_memory():
+    counter = HeavyHitters(capacity=10)
+    for i in range(5000):
+        counter.add("利率" if i % 4 == 0 else f"长尾问题{i}")
+    assert len(counter.counts) <= 10
+    key, count, _ = counter.top(1)[0]
+    assert key == "利率"
+    # 计数为下界，误差不超过 总数 / (容量 + 1)
+    assert 1250 - 5000 / 11 <= count <= 1250
+
+
+def test_disabled_writer_creates_nothing(tmp_path):
+    writer = QueryLogWriter(log_dir=str(tmp_path / "logs"), enabled=False)
+    writer.write(_event("利率"))
+    writer.close()
+    assert not os.path.exists(tmp_path / "logs")
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+条件请求测试：If-None-Match 按弱比较命中时返回 304，列出多个 ETag 时任一命中即可；
+内容每次都变化的接口不带 ETag，只带 Cache-Control
+"""
+
+from starlette.requests import Request
+
+from app.responses import cached_json
+
+CONTENT = {"success": True, "total": 3}
+
+
+def _request(if_none_match=None):
+    headers = [] if if_none_match is None else [(b"if-none-match", if_none_match.encode("latin-1"))]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+def test_weak_etag_round_trip():
+    first = cached_json(_request(), CONTENT, 5)
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    assert etag.startswith('W/"')
+    assert first.headers["vary"] == "Accept-Encoding"
+
+    assert cached_json(_request(etag), CONTENT, 5).status_code == 304
+    # 去掉 W/ 前缀或与其他 ETag 一起列出时同样命中
+    assert cached_json(_request(etag[2:]), CONTENT, 5).status_code == 304
+    assert cached_json(_request(f'"other", {etag}'), CONTENT, 5).status_code == 304
+    assert cached_json(_request("*"), CONTENT, 5).status_code == 304
+    assert cached_json(_request(etag), dict(CONTENT, total=4), 5).status_code == 200
+
+
+def test_volatile_content_has_no_etag():
+    response = cached_json(_request('W/"anything", *'), CONTENT, 2, etag=False)
+    assert response.status_code == 200
+    assert "etag" not in response.headers
+    assert response.headers["cache-control"] == "max-age=2"
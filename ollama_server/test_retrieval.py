@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+混合检索测试：jieba 分词后的 BM25 排序，RRF 融合的顺序与同分时的先后，
+每路召回的候选数不少于 n_results，BM25 索引缺失或为空时只用向量检索的结果
+"""
+
+import asyncio
+
+import numpy as np
+import pytest
+
+from app import bm25_index, retrieval
+from app.bm25_index import BM25Index, rebuild_bm25, tokenize
+from app.retrieval import HybridRetriever, rrf_fuse
+from app.vector_store import MmapStore
+
+DIM = 8
+
+DOCS = {
+    "lpr": "LPR 是贷款市场报价利率，房贷利率按 LPR 加点确定。",
+    "card": "信用卡免息期最长 56 天，到期还款日前全额还款不收利息。",
+    "deposit": "大额存单起存金额 20 万元，可以提前支取。",
+    "loss": "银行卡丢失后请立即通过手机银行挂失。",
+}
+
+
+class FakeEncoder:
+    """问题按 vectors 中的 key 查找向量，文档按顺序分配正交向量"""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def encode(self, texts, batch_size=32):
+        return np.asarray([self.vectors[text] for text in texts], dtype=np.float32)
+
+
+def _onehot(i):
+    vec = np.zeros(DIM, dtype=np.float32)
+    vec[i] = 1.0
+    return vec
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(bm25_index, "BM25_DIR", str(tmp_path / "bm25"))
+    store = MmapStore(str(tmp_path / "kb"), "kb_test")
+    ids = list(DOCS)
+    store.upsert(ids=ids, documents=[DOCS[i] for i in ids], embeddings=np.stack([_onehot(i) for i in range(len(ids))]),
+                 metadatas=[{"source": f"{i}.txt"} for i in ids])
+    return store
+
+
+def test_tokenize_keeps_domain_terms():
+    tokens = tokenize("大额存单可以提前支取吗？")
+    assert "大额存单" in tokens and "提前支取" in tokens
+    assert "？" not in tokens
+    # 英文统一小写
+    assert "lpr" in tokenize("LPR 怎么算")
+
+
+def test_bm25_ranks_matching_documents_first():
+    index = BM25Index().build(list(DOCS), list(DOCS.values()))
+    results = index.search("信用卡免息期有多长", k=2)
+    assert results[0][0] == "card"
+    assert all(score > 0 for _, score in results)
+    assert [doc_id for doc_id, _ in index.search("LPR 利率", k=4)][0] == "lpr"
+    assert index.search("完全无关的天气问题", k=3) == []
+    assert BM25Index().build([], []).search("LPR") == []
+
+
+def test_bm25_round_trip(tmp_path):
+    index = BM25Index().build(list(DOCS), list(DOCS.values()))
+    path = str(tmp_path / "index.json")
+    index.save(path)
+    loaded = BM25Index.load(path)
+    assert loaded.search("挂失银行卡", k=2) == index.search("挂失银行卡", k=2)
+
+
+def test_rrf_order_and_ties():
+    fused = rrf_fuse([["a", "b", "c"], ["b", "d"]], k=60)
+    # 两路都召回的 b 排在最前，只在一路排第一的 a 其次
+    assert [doc_id for doc_id, _ in fused] == ["b", "a", "d", "c"]
+    assert fused[0][1] == pytest.approx(1 / 62 + 1 / 61)
+
+    # 同分时保持第一次出现的先后：向量检索的结果在前
+    fused = rrf_fuse([["x", "y"], ["z", "w"]])
+    assert [doc_id for doc_id, _ in fused] == ["x", "z", "y", "w"]
+    assert fused[0][1] == fused[1][1]
+    assert rrf_fuse([[], []]) == []
+
+
+def test_hybrid_fuses_both_searches(store):
+    rebuild_bm25(store)
+    # 向量检索认为最相关的是 deposit，词法检索命中 card
+    retriever = HybridRetriever(store, FakeEncoder({"信用卡免息期": _onehot(2)}))
+    q_emb, hits = asyncio.run(retriever.retrieve("信用卡免息期", n_results=2))
+    assert q_emb.shape == (DIM,)
+    assert {hit["id"] for hit in hits} == {"deposit", "card"}
+    card = next(hit for hit in hits if hit["id"] == "card")
+    # 只被词法检索召回的片段从存储中补取正文
+    assert card["document"] == DOCS["card"]
+    assert all(hit["score"] > 0 for hit in hits)
+
+
+def test_hybrid_falls_back_to_vector_only(store, tmp_path):
+    retriever = HybridRetriever(store, FakeEncoder({"信用卡免息期": _onehot(2)}))
+    # 没有 BM25 索引文件
+    _, hits = asyncio.run(retriever.retrieve("信用卡免息期", n_results=2))
+    assert hits[0]["id"] == "deposit"
+    assert len(hits) == 2 and all(hit["distance"] is not None for hit in hits)
+
+    # 索引为空（例如知识库清空后重建）
+    BM25Index().build([], []).save(bm25_index.bm25_path(store.name))
+    _, hits = asyncio.run(retriever.retrieve("信用卡免息期", n_results=2))
+    assert hits[0]["id"] == "deposit" and len(hits) == 2
+
+
+def test_recall_depth_covers_n_results(store, monkeypatch):
+    rebuild_bm25(store)
+    monkeypatch.setattr(retrieval, "HYBRID_CANDIDATES", 1)
+    retriever = HybridRetriever(store, FakeEncoder({"利率": _onehot(0)}))
+    _, hits = asyncio.run(retriever.retrieve("利率", n_results=4))
+    # 若每路只召回 HYBRID_CANDIDATES 个候选，融合后最多只有 2 个结果
+    assert len(hits) == 4
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+模型路由测试：按意图、关键词、长度和检索置信度选择档位，
+会话换档位时不复用上一档位的 context，覆盖配置缺少 reasoning 档时自动补上
+"""
+
+from app import router
+from app.router import DEFAULT_TIER, SIMPLE_TIER, ModelRouter
+from app.sessions import SessionStore
+
+CLOSE = [{"distance": 0.3}]
+FAR = [{"distance": 1.5}]
+
+
+def test_classify_rules():
+    r = ModelRouter(enabled=True)
+    assert r.classify("营业时间", hits=CLOSE) == (SIMPLE_TIER, "simple")
+    assert r.classify("营业时间", {"intents": {"比较": 1}}, CLOSE) == (DEFAULT_TIER, "intent:比较")
+    assert r.classify("为什么扣费", hits=CLOSE) == (DEFAULT_TIER, "complex_pattern")
+    assert r.classify("营" * (router.ROUTE_MAX_SIMPLE_CHARS + 1), hits=CLOSE)[1] == "long_query"
+    assert r.classify("营业时间", hits=FAR) == (DEFAULT_TIER, "low_retrieval_confidence")
+    assert r.classify("营业时间") == (DEFAULT_TIER, "low_retrieval_confidence")
+
+    r.mark_unavailable(SIMPLE_TIER)
+    assert r.classify("营业时间", hits=CLOSE) == (DEFAULT_TIER, "fast_unavailable")
+    assert ModelRouter(enabled=False).classify("营业时间", hits=CLOSE) == (DEFAULT_TIER, "disabled")
+
+
+def test_session_context_is_tier_specific():
+    r = ModelRouter(enabled=True)
+    store = SessionStore()
+    session = store.get("u1")
+    store.record(session, "营业时间", "九点到五点", context=[1, 2, 3], generated=True, tier=SIMPLE_TIER)
+
+    # 会话已有 fast 档的 context，复杂问题仍然交给推理模型
+    route = r.route("为什么周末不营业", hits=CLOSE)
+    assert route["tier"] == DEFAULT_TIER
+    prompt, context = session.build_prompt("问题：为什么周末不营业\n", tier=route["tier"])
+    assert context is None
+    assert "用户：营业时间" in prompt and "助手：九点到五点" in prompt
+
+    # 同一档位继续复用 context，只发送新内容
+    prompt, context = session.build_prompt("问题：营业地点\n", tier=r.route("营业地点", hits=CLOSE)["tier"])
+    assert context == [1, 2, 3]
+    assert "营业时间" not in prompt
+
+    # 推理模型生成后 context 换成新档位的
+    store.record(session, "为什么周末不营业", "人手不足", context=[4, 5], generated=True, tier=DEFAULT_TIER)
+    assert session.build_prompt("问题\n", tier=DEFAULT_TIER)[1] == [4, 5]
+    assert session.build_prompt("问题\n", tier=SIMPLE_TIER)[1] is None
+
+
+def test_tiers_override_without_reasoning():
+    r = ModelRouter(tiers={"fast": {"model": "qwen2.5:0.5b"}}, enabled=True)
+    assert r.route("为什么扣费", hits=CLOSE)["model"] == router.MODEL_NAME
+    assert r.route("营业时间", hits=CLOSE)["model"] == "qwen2.5:0.5b"
+    # fast 模型不存在时回退到补上的 reasoning 档
+    r.mark_unavailable(SIMPLE_TIER)
+    assert r.route("营业时间", hits=CLOSE)["tier"] == DEFAULT_TIER
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+生成调度测试：名额释放后按优先级、同优先级按到达顺序放行；
+队列满时新请求以 429 被拒绝并带 Retry-After，高优先级请求挤掉排在最后的低优先级请求；
+排队超过截止时间返回 503，被取消的等待方不占用名额
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from app.scheduler import GenerationScheduler, SchedulerRejected
+
+
+async def _hold(scheduler, name, order, priority="interactive", gate=None, deadline=None):
+    async with scheduler.slot(priority, deadline):
+        order.append(name)
+        if gate is not None:
+            await gate.wait()
+
+
+def test_priority_ordering():
+    async def run():
+        scheduler = GenerationScheduler(concurrency=1, max_queue=8)
+        order = []
+        gate = asyncio.Event()
+        first = asyncio.ensure_future(_hold(scheduler, "first", order, gate=gate))
+        await asyncio.sleep(0)
+        # 占用名额期间依次到达：两个批量任务、两个交互请求
+        waiting = [
+            asyncio.ensure_future(_hold(scheduler, name, order, priority))
+            for name, priority in (("batch1", "batch"), ("chat1", "interactive"),
+                                   ("batch2", "batch"), ("chat2", "interactive"))
+        ]
+        await asyncio.sleep(0.01)
+        assert scheduler.active == 1 and scheduler.queue_depth == 4
+        gate.set()
+        await asyncio.gather(first, *waiting)
+        assert order == ["first", "chat1", "chat2", "batch1", "batch2"]
+        stats = scheduler.stats()
+        assert stats["admitted"] == 5 and stats["active"] == 0 and stats["queue_depth"] == 0
+
+    asyncio.run(run())
+
+
+def test_queue_full_is_rejected_with_429():
+    async def run():
+        scheduler = GenerationScheduler(concurrency=1, max_queue=2)
+        order = []
+        gate = asyncio.Event()
+        tasks = [asyncio.ensure_future(_hold(scheduler, "first", order, gate=gate))]
+        await asyncio.sleep(0)
+        tasks += [asyncio.ensure_future(_hold(scheduler, f"queued{i}", order)) for i in range(2)]
+        await asyncio.sleep(0.01)
+
+        with pytest.raises(SchedulerRejected) as exc:
+            await scheduler.acquire("interactive")
+        assert exc.value.reason == "queue_full"
+        assert exc.value.status_code == 429
+        assert exc.value.retry_after >= 1
+        assert scheduler.rejected == 1 and scheduler.queue_depth == 2
+
+        gate.set()
+        await asyncio.gather(*tasks)
+        assert order == ["first", "queued0", "queued1"]
+
+    asyncio.run(run())
+
+
+def test_interactive_preempts_batch_when_full():
+    async def run():
+        scheduler = GenerationScheduler(concurrency=1, max_queue=2)
+        order = []
+        gate = asyncio.Event()
+        first = asyncio.ensure_future(_hold(scheduler, "first", order, gate=gate))
+        await asyncio.sleep(0)
+        batch = [asyncio.ensure_future(_hold(scheduler, f"batch{i}", order, "batch")) for i in range(2)]
+        await asyncio.sleep(0.01)
+
+        # 队列已满，交互请求挤掉最后到达的批量任务
+        chat = asyncio.ensure_future(_hold(scheduler, "chat", order))
+        await asyncio.sleep(0.01)
+        assert batch[1].done()
+        with pytest.raises(SchedulerRejected) as exc:
+            batch[1].result()
+        assert exc.value.reason == "preempted" and exc.value.status_code == 429
+
+        # 批量任务之间不互相挤占
+        with pytest.raises(SchedulerRejected) as exc:
+            await scheduler.acquire("batch")
+        assert exc.value.reason == "queue_full"
+
+        gate.set()
+        await asyncio.gather(first, batch[0], chat)
+        assert order == ["first", "chat", "batch0"]
+
+    asyncio.run(run())
+
+
+def test_queue_timeout_and_cancel_release_the_queue():
+    async def run():
+        scheduler = GenerationScheduler(concurrency=1, max_queue=4)
+        order = []
+        gate = asyncio.Event()
+        first = asyncio.ensure_future(_hold(scheduler, "first", order, gate=gate))
+        await asyncio.sleep(0)
+
+        with pytest.raises(SchedulerRejected) as exc:
+            await scheduler.acquire("interactive", deadline=time.monotonic() + 0.02)
+        assert exc.value.reason == "queue_timeout" and exc.value.status_code == 503
+        assert scheduler.expired == 1 and scheduler.queue_depth == 0
+
+        cancelled = asyncio.ensure_future(_hold(scheduler, "cancelled", order))
+        waiting = asyncio.ensure_future(_hold(scheduler, "waiting", order))
+        await asyncio.sleep(0.01)
+        cancelled.cancel()
+        await asyncio.sleep(0.01)
+        assert scheduler.queue_depth == 1
+
+        gate.set()
+        await asyncio.gather(first, waiting)
+        assert order == ["first", "waiting"]
+        assert scheduler.active == 0
+
+    asyncio.run(run())
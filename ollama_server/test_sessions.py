@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+多轮会话测试：超过会话数上限时淘汰最久未使用的会话，空闲超过 TTL 的会话过期，
+淘汰后留下摘要供同一用户继续；文本历史只保留最近几轮，更早的并入摘要，摘要超长时保留最新的部分；
+context 超过上限时丢弃，改用文本历史
+"""
+
+import pytest
+
+from app import sessions
+from app.sessions import SessionStore, strip_think
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(sessions.time, "monotonic", clock)
+    return clock
+
+
+def test_lru_eviction_leaves_summary(clock):
+    store = SessionStore(max_users=2, ttl=3600)
+    a = store.get("a")
+    store.record(a, "信用卡年费怎么收", "首年免年费。", generated=True, context=[1, 2, 3])
+    store.get("b")
+    # 访问 a 后，最久未使用的是 b
+    assert store.get("a") is a
+    store.get("c")
+    assert store.stats()["sessions"] == 2 and store.evictions == 1
+    assert store.stats()["summaries"] == 0  # b 没有任何对话，不留摘要
+
+    store.get("b")
+    store.get("d")
+    # a 被淘汰，再次提问时以摘要作为历史
+    resumed = store.get("a")
+    assert resumed is not a and resumed.turns == [] and resumed.context is None
+    assert "信用卡年费怎么收" in resumed.summary
+    assert not resumed.is_fresh
+    assert store.resumed == 1
+    prompt, context = resumed.build_prompt("问题：那怎么免年费\n")
+    assert prompt.startswith("此前对话摘要：") and context is None
+
+
+def test_idle_sessions_expire(clock):
+    store = SessionStore(max_users=10, ttl=60)
+    a = store.get("a")
+    store.record(a, "LPR 是什么", "贷款市场报价利率。")
+    clock.now += 30
+    store.get("b")
+    clock.now += 31
+    # a 空闲 61 秒已过期，b 只空闲 31 秒
+    assert store.get("b") is not None
+    assert store.stats()["sessions"] == 1 and store.evictions == 1
+    assert "LPR 是什么" in store.get("a").summary
+
+
+def test_turn_limit_folds_old_turns_into_summary(clock, monkeypatch):
+    monkeypatch.setattr(sessions, "SESSION_MAX_TURNS", 2)
+    store = SessionStore()
+    session = store.get("u")
+    for i in range(4):
+        store.record(session, f"问题{i}", f"回答{i}")
+    assert session.turns == [("问题2", "回答2"), ("问题3", "回答3")]
+    assert "问题0" in session.summary and "问题1" in session.summary
+    prompt, _ = session.build_prompt("问题：新问题\n")
+    assert "用户：问题2" in prompt and "用户：问题0" not in prompt
+
+
+def test_summary_keeps_latest_part(clock, monkeypatch):
+    monkeypatch.setattr(sessions, "SESSION_SUMMARY_CHARS", 40)
+    store = SessionStore(max_users=1)
+    session = store.get("u")
+    for i in range(6):
+        store.record(session, f"第{i}个关于大额存单提前支取的问题", "可以提前支取。")
+    store.get("other")
+    summary = store.get("u").summary
+    assert len(summary) <= 40
+    # 超长时截掉最早的内容
+    assert summary.endswith("最近回答：可以提前支取。")
+
+
+def test_summaries_are_bounded(clock):
+    store = SessionStore(max_users=1, max_summaries=2)
+    for user_id in ("a", "b", "c", "d"):
+        store.record(store.get(user_id), f"{user_id} 的问题", "回答")
+    assert store.stats()["summaries"] == 2
+    assert store.get("a").summary == ""
+    assert store.get("c").summary != ""
+
+
+def test_context_over_limit_is_dropped(clock):
+    store = SessionStore(max_context_tokens=4)
+    session = store.get("u")
+    store.record(session, "q1", "a1", context=[1, 2, 3], generated=True, tier="fast")
+    assert session.context.tolist() == [1, 2, 3] and session.synced == 1
+    # FAQ 等未经过 LLM 的回答保留原 context，下次以文本补上
+    store.record(session, "q2", "a2")
+    prompt, context = session.build_prompt("问题：q3\n", tier="fast")
+    assert context == [1, 2, 3] and "用户：q2" in prompt and "用户：q1" not in prompt
+
+    store.record(session, "q3", "a3", context=[1, 2, 3, 4, 5], generated=True, tier="fast")
+    assert session.context is None and session.synced == 0
+    assert store.context_reset == 1
+
+
+def test_followup_and_think_stripping(clock):
+    store = SessionStore()
+    session = store.get("u")
+    assert session.retrieval_query("那利率呢") == "那利率呢"
+    store.record(session, "房贷怎么申请", "<think>先想想</think>\n需要收入证明。")
+    assert session.turns[-1] == ("房贷怎么申请", "需要收入证明。")
+    assert session.retrieval_query("那利率呢") == "房贷怎么申请 那利率呢"
+    assert session.retrieval_query("房贷利率和公积金贷款利率有什么区别") == "房贷利率和公积金贷款利率有什么区别"
+    assert strip_think("<think>a</think>b<think>c</think>") == "b"
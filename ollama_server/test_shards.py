@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+领域分片测试：片段按 domain 写入对应分片，领域变化时从原分片移除；
+检索只查询问题所属领域和通用分片，结果不足时补查其余分片；
+按 where 分页时各页拼接起来与一次取全部一致，且不会为每一页扫描整个分片；
+各领域片段数按写入和删除的增减维护，不逐个分片计数
+"""
+
+import numpy as np
+import pytest
+
+chromadb = pytest.importorskip("chromadb")
+
+from app.shards import ShardedCollection  # noqa: E402
+
+DIM = 8
+
+
+@pytest.fixture
+def sharded(tmp_path, request):
+    client = chromadb.PersistentClient(path=str(tmp_path))
+    return ShardedCollection(client, f"kb_test_{request.node.name}")
+
+
+def _vec(i):
+    vec = np.zeros(DIM, dtype=np.float32)
+    vec[i % DIM] = 1.0
+    return vec
+
+
+def _upsert(store, ids, domains, source="a.txt"):
+    store.upsert(
+        ids=ids,
+        documents=[f"片段 {chunk_id}" for chunk_id in ids],
+        embeddings=np.stack([_vec(i) for i in range(len(ids))]),
+        metadatas=[{"source": source, **({"domain": d} if d else {})} for d in domains],
+    )
+
+
+def test_upsert_routes_by_domain(sharded):
+    _upsert(sharded, ["l1", "l2", "c1", "g1"], ["贷款服务", "贷款服务", "信用卡", None])
+    counts = sharded.domain_counts()
+    assert counts["贷款服务"] == 2 and counts["信用卡"] == 1 and counts["通用"] == 1
+    assert sharded.count() == 4
+
+    # 领域变化后片段只留在新分片中
+    _upsert(sharded, ["l2"], ["信用卡"])
+    counts = sharded.domain_counts()
+    assert counts["贷款服务"] == 1 and counts["信用卡"] == 2
+    assert sharded.count() == 4
+    assert sorted(sharded.get(where={"domain": "信用卡"}, include=[])["ids"]) == ["c1", "l2"]
+
+
+def test_query_only_routed_shards(sharded):
+    _upsert(sharded, ["l1", "l2", "c1", "c2", "g1"], ["贷款服务", "贷款服务", "信用卡", "信用卡", None])
+    result = sharded.query(np.stack([_vec(0)]), n_results=2, domains=["贷款服务"])
+    # 贷款分片和通用分片共 3 个片段，足够返回 2 个，不补查
+    assert set(result["ids"][0]) <= {"l1", "l2", "g1"}
+    assert len(result["ids"][0]) == 2
+    assert sharded.fallbacks == 0
+    assert sharded.shards_queried == 2
+
+
+def test_query_falls_back_when_too_few(sharded):
+    _upsert(sharded, ["l1", "c1", "c2", "c3"], ["贷款服务", "信用卡", "信用卡", "信用卡"])
+    result = sharded.query(np.stack([_vec(0)]), n_results=3, domains=["贷款服务"])
+    # 贷款分片只有 1 个片段，补查其余分片凑满 3 个
+    assert len(result["ids"][0]) == 3
+    assert "l1" in result["ids"][0]
+    assert sharded.fallbacks == 1
+    distances = result["distances"][0]
+    assert distances == sorted(distances)
+
+
+def test_where_pagination_does_not_rescan(sharded):
+    domains = ["贷款服务", "信用卡", None, "存款服务"]
+    ids = [f"a{i}" for i in range(10)]
+    _upsert(sharded, ids, [domains[i % len(domains)] for i in range(10)], source="a.txt")
+    _upsert(sharded, [f"b{i}" for i in range(5)], [domains[i % len(domains)] for i in range(5)], source="b.txt")
+
+    calls = []
+    for shard in sharded.shards.values():
+        original = shard.get
+
+        def recording_get(*args, _original=original, **kwargs):
+            calls.append(kwargs)
+            return _original(*args, **kwargs)
+
+        shard.get = recording_get
+
+    pages = []
+    offset = 0
+    while True:
+        page = sharded.get(where={"source": "a.txt"}, include=["metadatas"], limit=3, offset=offset)
+        if not page["ids"]:
+            break
+        assert len(page["ids"]) <= 3
+        assert all(meta["source"] == "a.txt" for meta in page["metadatas"])
+        pages.extend(page["ids"])
+        offset += len(page["ids"])
+
+    assert sorted(pages) == sorted(ids)
+    assert len(pages) == len(set(pages))
+    # 每次访问分片都带 limit，不会为了算偏移取出分片中的全部匹配片段
+    assert calls and all(call.get("limit") is not None for call in calls)
+
+
+def test_counts_are_maintained_incrementally(sharded):
+    _upsert(sharded, ["l1", "l2", "c1"], ["贷款服务", "贷款服务", "信用卡"])
+    calls = []
+    for shard in sharded.shards.values():
+        original = shard.count
+
+        def recording_count(_original=original):
+            calls.append(1)
+            return _original()
+
+        shard.count = recording_count
+
+    # 覆盖已有片段不增加片段数，新片段和领域变化的片段按增减计数
+    _upsert(sharded, ["l1", "c2"], ["贷款服务", "信用卡"])
+    _upsert(sharded, ["l2"], ["信用卡"])
+    assert sharded.count() == 4
+    counts = sharded.domain_counts()
+    assert counts["贷款服务"] == 1 and counts["信用卡"] == 3
+
+    # 删除不存在的 id 不减少片段数
+    sharded.delete(ids=["c1", "missing"])
+    sharded.delete(where={"domain": "贷款服务"})
+    assert sharded.count() == 2
+    assert sharded.domain_counts()["贷款服务"] == 0
+    assert calls == []
+
+    sharded.refresh_counts()
+    assert sharded.count() == 2 and calls
+
+
+def test_update_without_metadatas(sharded):
+    _upsert(sharded, ["l1", "c1"], ["贷款服务", "信用卡"])
+    sharded.update(ids=["c1", "l1", "missing"], documents=["新信用卡片段", "新贷款片段", "不存在"])
+    result = sharded.get(ids=["l1", "c1"], include=["documents", "metadatas"])
+    documents = dict(zip(result["ids"], result["documents"]))
+    assert documents == {"l1": "新贷款片段", "c1": "新信用卡片段"}
+    assert sharded.domain_counts()["信用卡"] == 1
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+相同请求合并测试：并发的相同请求共享一次生成的结果，单个等待方取消不影响其他等待方，
+共享的生成按等待方中最晚的截止时间和最高的优先级排队
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from app.scheduler import GenerationScheduler, SchedulerRejected
+from app.singleflight import Flight, SingleFlight, StreamBuffer
+
+
+def test_result_is_shared():
+    async def run():
+        inflight = SingleFlight()
+        gate = asyncio.Event()
+        calls = []
+        buffer = StreamBuffer()
+
+        async def generate():
+            calls.append(1)
+            buffer.publish("你")
+            await gate.wait()
+            buffer.publish("好")
+            return "你好"
+
+        deltas = [[], [], []]
+        tasks = [
+            asyncio.ensure_future(inflight.do("key", generate, buffer=buffer if i == 0 else StreamBuffer(),
+                                              on_delta=deltas[i].append))
+            for i in range(3)
+        ]
+        await asyncio.sleep(0.01)
+        assert inflight.in_flight == 1
+        gate.set()
+        results = await asyncio.gather(*tasks)
+        assert results == [("你好", False), ("你好", True), ("你好", True)]
+        # 后加入的等待方也先收到已生成的部分
+        assert deltas == [["你", "好"]] * 3
+        assert len(calls) == 1
+        assert inflight.stats() == {"in_flight": 0, "executions": 1, "generations_saved": 2}
+
+    asyncio.run(run())
+
+
+def test_joiner_cancel_does_not_cancel_generation():
+    async def run():
+        inflight = SingleFlight()
+        gate = asyncio.Event()
+        cancelled = []
+
+        async def generate():
+            try:
+                await gate.wait()
+                return "回答"
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+
+        leader = asyncio.ensure_future(inflight.do("key", generate))
+        joiner = asyncio.ensure_future(inflight.do("key", generate))
+        await asyncio.sleep(0.01)
+        joiner.cancel()
+        await asyncio.sleep(0.01)
+        assert not cancelled
+        gate.set()
+        assert await leader == ("回答", False)
+
+        # 等待方超时也只影响自己；全部离开后才取消生成
+        gate.clear()
+        first = asyncio.ensure_future(inflight.do("key", generate, timeout=0.02))
+        second = asyncio.ensure_future(inflight.do("key", generate))
+        with pytest.raises(asyncio.TimeoutError):
+            await first
+        assert not cancelled and inflight.in_flight == 1
+        second.cancel()
+        await asyncio.sleep(0.01)
+        assert cancelled == [1] and inflight.in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_flight_uses_latest_deadline_and_highest_priority():
+    async def run():
+        scheduler = GenerationScheduler(concurrency=1, max_queue=4)
+        inflight = SingleFlight()
+        release = asyncio.Event()
+        order = []
+
+        async def holder():
+            async with scheduler.slot("interactive"):
+                await release.wait()
+
+        now = time.monotonic()
+        flight = Flight(now + 0.1, "batch")
+
+        async def generate():
+            async with scheduler.slot(flight=flight):
+                order.append("shared")
+                return "回答"
+
+        async def other():
+            async with scheduler.slot("interactive", now + 5):
+                order.append("other")
+
+        holding = asyncio.ensure_future(holder())
+        await asyncio.sleep(0)
+        leader = asyncio.ensure_future(inflight.do("key", generate, flight=flight))
+        await asyncio.sleep(0)
+        waiting = asyncio.ensure_future(other())
+        await asyncio.sleep(0)
+        # 交互式请求加入批量任务发起的生成：排到先到的 other 之前，截止时间推迟到 5 秒后
+        joiner = asyncio.ensure_future(inflight.do("key", generate, flight=Flight(now + 5, "interactive")))
+        await asyncio.sleep(0.2)
+        assert flight.priority == "interactive" and flight.deadline == now + 5
+        assert scheduler.queue_depth == 2
+
+        release.set()
+        await asyncio.gather(holding, waiting)
+        assert await leader == ("回答", False)
+        assert await joiner == ("回答", True)
+        assert order == ["shared", "other"]
+
+    asyncio.run(run())
+
+
+def test_flight_without_joiners_expires_at_own_deadline():
+    async def run():
+        scheduler = GenerationScheduler(concurrency=1, max_queue=4)
+        release = asyncio.Event()
+
+        async def holder():
+            async with scheduler.slot("interactive"):
+                await release.wait()
+
+        holding = asyncio.ensure_future(holder())
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerRejected) as info:
+            await scheduler.acquire(flight=Flight(time.monotonic() + 0.05))
+        assert info.value.reason == "queue_timeout"
+        assert scheduler.queue_depth == 0
+        release.set()
+        await holding
+
+    asyncio.run(run())
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+<think> 推理内容流式过滤测试
+标签可能被拆在任意位置，按不同的切分方式输入，结果都应与整段输入一致；
+聊天模板已经打开 <think> 时输出中只有结束标签，之前的内容同样不能放行
+"""
+
+import pytest
+
+from app.think_filter import ThinkFilter
+
+OUTPUT = "<think>\n先确认 LPR 的定义，<b> 不是标签\n</think>\n\nLPR 是贷款市场报价利率。"
+ANSWER = "LPR 是贷款市场报价利率。"
+
+
+def _run(text, size, show=False):
+    think_filter = ThinkFilter(show=show)
+    pieces = [think_filter.feed(text[i:i + size]) for i in range(0, len(text), size)]
+    pieces.append(think_filter.finish())
+    return "".join(pieces), think_filter
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 8, len(OUTPUT)])
+def test_strips_reasoning_across_chunk_boundaries(size):
+    visible, think_filter = _run(OUTPUT, size)
+    assert visible == ANSWER
+    assert think_filter.reasoning_chars == len("\n先确认 LPR 的定义，<b> 不是标签\n")
+
+
+def test_visible_text_starts_as_soon_as_reasoning_ends():
+    think_filter = ThinkFilter()
+    assert think_filter.feed("<think>想一想") == ""
+    assert think_filter.feed("</think>\n\nLPR") == "LPR"
+
+
+def test_show_mode_passes_reasoning_through():
+    visible, think_filter = _run(OUTPUT, 3, show=True)
+    assert visible == OUTPUT
+    assert think_filter.reasoning_chars > 0
+
+
+def test_unclosed_reasoning_is_dropped():
+    visible, _ = _run("<think>推理被截断", 4)
+    assert visible == ""
+
+
+TEMPLATE_OPENED = "先想一想用户的问题\n</think>\n\nLPR 是贷款市场报价利率。"
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 8, len(TEMPLATE_OPENED)])
+def test_template_opened_reasoning_is_held(size):
+    think_filter = ThinkFilter(hold=True)
+    pieces = [think_filter.feed(TEMPLATE_OPENED[i:i + size]) for i in range(0, len(TEMPLATE_OPENED), size)]
+    pieces.append(think_filter.finish())
+    assert "".join(pieces) == ANSWER
+    assert think_filter.reasoning_chars == len("先想一想用户的问题\n")
+
+
+def test_template_opened_stream():
+    think_filter = ThinkFilter(hold=True)
+    assert think_filter.feed("先想一想用户的问题") == ""
+    assert think_filter.held_chars == len("先想一想用户的问题")
+    assert think_filter.feed("</think>\n\n答案") == "答案"
+    assert think_filter.reasoning_chars == len("先想一想用户的问题")
+    assert think_filter.held_chars == 0
+
+
+def test_hold_mode_without_tags():
+    # 模型自己输出 <think> 时照常过滤
+    visible, _ = _run(OUTPUT, 3)
+    think_filter = ThinkFilter(hold=True)
+    assert think_filter.feed(OUTPUT) + think_filter.finish() == visible == ANSWER
+
+    # 没有任何标签（例如关闭了推理）时，生成结束后整段放行
+    think_filter = ThinkFilter(hold=True)
+    assert think_filter.feed("直接回答") == ""
+    assert think_filter.finish() == "直接回答"
+    assert think_filter.reasoning_chars == 0
+
+    # 推理内容在单独的 thinking 字段时不再等待标签
+    think_filter = ThinkFilter(hold=True)
+    assert think_filter.feed("LPR") == ""
+    think_filter.release()
+    assert think_filter.feed(" 是贷款市场报价利率。") == ANSWER
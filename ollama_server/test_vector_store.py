@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+内存映射向量存储测试
+检索结果应与 float32 精确计算一致，覆盖写入、删除后的结果，另一个进程打开的实例能看到新提交的行，
+写入中途失败留下的未提交字节不会让之后写入的行错位；降维存储对写入和检索的向量做同样的投影；
+没有 fcntl 的平台（Windows）同样能打开和写入
+"""
+
+import numpy as np
+import pytest
+
+from app import vector_store
+from app.reduction import ReducedStore, Reducer
+from app.vector_store import MmapStore
+
+DIM = 16
+
+
+def _vectors(n, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(n, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = MmapStore(str(tmp_path / "kb"), "kb_test")
+    vectors = _vectors(200)
+    ids = [f"doc{i % 20}.txt_{i}" for i in range(200)]
+    metas = [{"source": f"doc{i % 20}.txt", "para_id": i} for i in range(200)]
+    store.upsert(ids=ids, documents=[f"片段{i}" for i in range(200)], embeddings=vectors.tolist(), metadatas=metas)
+    return store, vectors
+
+
+def test_exact_top_k_matches_float32(store):
+    store, vectors = store
+    query = _vectors(1, seed=1)[0]
+    result = store.query(query_embeddings=[query.tolist()], n_results=5)
+    expected = np.argsort(-(vectors @ query))[:5]
+    assert result["ids"][0] == [f"doc{i % 20}.txt_{i}" for i in expected]
+    assert result["documents"][0][0] == f"片段{expected[0]}"
+    # 平方 L2 距离，float16 存储带来的误差很小
+    assert result["distances"][0][0] == pytest.approx(2 - 2 * float(vectors[expected[0]] @ query), abs=1e-2)
+
+
+def test_upsert_replaces_and_delete_removes(store):
+    store, vectors = store
+    store.upsert(ids=["doc0.txt_0"], documents=["新内容"], embeddings=[vectors[1].tolist()],
+                 metadatas=[{"source": "doc0.txt", "para_id": 0}])
+    assert store.count() == 200
+    assert store.get(ids=["doc0.txt_0"])["documents"] == ["新内容"]
+
+    removed = store.get(where={"source": "doc1.txt"}, include=[])["ids"]
+    assert len(removed) == 10
+    store.delete(ids=removed)
+    assert store.count() == 190
+    result = store.query(query_embeddings=[vectors[1].tolist()], n_results=3)
+    assert "doc1.txt_1" not in result["ids"][0]
+    assert result["ids"][0][0] == "doc0.txt_0"
+
+
+def test_other_instance_sees_committed_rows(store, tmp_path, monkeypatch):
+    store, vectors = store
+    monkeypatch.setattr(vector_store, "MMAP_SYNC_SECONDS", 0)
+    reader = MmapStore(str(tmp_path / "kb"), "kb_test")
+    assert reader.count() == 200
+    store.upsert(ids=["new_0"], documents=["新增"], embeddings=[vectors[5].tolist()],
+                 metadatas=[{"source": "new"}])
+    store.delete(ids=["doc5.txt_5"])
+    assert reader.count() == 200
+    assert reader.query(query_embeddings=[vectors[5].tolist()], n_results=1)["ids"][0] == ["new_0"]
+
+
+def test_uncommitted_tail_is_truncated(tmp_path):
+    store = MmapStore(str(tmp_path / "kb"), "kb_test")
+    vectors = _vectors(3)
+    store.upsert(ids=["a", "b"], documents=["A", "B"], embeddings=vectors[:2], metadatas=[{}, {}])
+    # 模拟写入中途崩溃：各文件追加了部分内容，manifest 未更新
+    files = store._files
+    with open(files["keys"], "ab") as f:
+        f.write(b'["zz", null]\n')
+    with open(files["records"], "ab") as f:
+        f.write(b'{"document": "ZZ", "metad')
+    with open(files["vectors"], "ab") as f:
+        f.write(vectors[2].astype(np.float16).tobytes()[:10])
+
+    store.upsert(ids=["c"], documents=["C"], embeddings=vectors[2:], metadatas=[{}])
+    reopened = MmapStore(str(tmp_path / "kb"), "kb_test")
+    for s in (store, reopened):
+        result = s.get()
+        assert result["ids"] == ["a", "b", "c"]
+        assert result["documents"] == ["A", "B", "C"]
+        hit = s.query(query_embeddings=vectors[2:], n_results=1)
+        assert hit["ids"][0] == ["c"]
+        assert hit["distances"][0][0] == pytest.approx(0.0, abs=1e-2)
+
+
+def test_reduced_store_projects_writes_and_queries(tmp_path):
+    # 向量集中在 4 维子空间内，PCA 降到 4 维几乎不损失信息
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(100, 4)).astype(np.float32) @ rng.normal(size=(4, DIM)).astype(np.float32)
+    reducer = Reducer.fit_pca(vectors, 4)
+    assert reducer.explained > 0.999
+    path = str(tmp_path / "reducer.npz")
+    reducer.save(path)
+    store = ReducedStore(MmapStore(str(tmp_path / "kb"), "kb_test"), Reducer.load(path))
+    ids = [f"doc.txt_{i}" for i in range(100)]
+    store.upsert(ids=ids, documents=ids, embeddings=vectors, metadatas=[{"source": "doc.txt"}] * 100)
+    assert store.stats()["dim"] == 4 and store.stats()["reducer"]["out_dim"] == 4
+
+    result = store.query(vectors[:5], n_results=1)
+    assert [row[0] for row in result["ids"]] == ids[:5]
+    # 取出的是降维后的向量，用它检索时不再投影
+    stored = store.get(ids=ids[:1], include=["embeddings"])["embeddings"]
+    assert len(stored[0]) == 4
+    assert store.query(np.asarray(stored), n_results=1)["ids"] == [ids[:1]]
+    with pytest.raises(ValueError):
+        store.query(vectors[:1, :3])
+
+
+def test_writes_without_fcntl(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(vector_store, "fcntl", None)
+    monkeypatch.setattr(vector_store, "msvcrt", None, raising=False)
+    monkeypatch.setattr(vector_store, "_warned_no_lock", False)
+    store = MmapStore(str(tmp_path / "kb"), "kb_test")
+    vectors = _vectors(3)
+    store.upsert(ids=["a", "b", "c"], documents=["甲", "乙", "丙"], embeddings=vectors.tolist(),
+                 metadatas=[{"source": "x"}] * 3)
+    store.delete(ids=["b"])
+    assert store.count() == 2
+    assert store.query(query_embeddings=[vectors[2].tolist()], n_results=1)["ids"][0] == ["c"]
+    # 不支持文件锁时只警告一次
+    assert sum("不支持文件锁" in record.getMessage() for record in caplog.records) == 1